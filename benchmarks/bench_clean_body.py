@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark clean_press_release_text against the original multi-pass implementation.
+
+Bodies are read from the CSV files in data/processed. Every output of the new
+cleaner is compared with the reference and the run fails if any differ.
+
+    python benchmarks/bench_clean_body.py --repeat 20
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'src'))
+
+from data_processing.clean_body import EXTRANEOUS_KEYWORDS, clean_press_release_text
+
+def reference_clean_press_release_text(text):
+    """The original implementation: seven re.sub passes and a per-line keyword test."""
+    if pd.isna(text):
+        return text
+    text = re.sub(r'\[!\[Pfizer logo\].*?\]\(.*?\)', '', text)
+    text = re.sub(r'##\s*\*\s*\[.*?\].*?(?=##|\Z)', '', text, flags=re.DOTALL)
+    text = re.sub(r'#{1,5}\s*Receive real-time updates.*?inbox\..*?pipeline\.', '', text, flags=re.DOTALL)
+    text = re.sub(r"\[.*?\]\(.*?\)", "", text, flags=re.DOTALL)
+    text = re.sub(r"\[.*?\]", "", text, flags=re.DOTALL)
+    text = re.sub(r"\(.*?\)", "", text, flags=re.DOTALL)
+    text = re.sub(r"What can we help you find\? Search for: &gt;&gt;News release ##", "", text)
+    cleaned_lines = []
+    for line in text.splitlines():
+        lower_line = line.lower().strip()
+        if any(keyword in lower_line for keyword in EXTRANEOUS_KEYWORDS):
+            continue
+        if line.strip():
+            cleaned_lines.append(line.strip())
+    cleaned_text = "\n".join(cleaned_lines)
+    cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
+    return cleaned_text.strip()
+
+def load_bodies(pattern):
+    """Load all non-empty bodies from the matching CSV files."""
+    bodies = []
+    for file_path in sorted(glob.glob(pattern)):
+        df = pd.read_csv(file_path)
+        if 'body' in df.columns:
+            bodies.extend(df['body'].dropna().tolist())
+    return bodies
+
+def time_cleaner(cleaner, bodies, repeat):
+    """Best wall time over `repeat` runs of cleaning every body."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            cleaner(body)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark clean_press_release_text')
+    parser.add_argument('--input', default=os.path.join(ROOT, 'data', 'processed', '*.csv'),
+                        help='Glob of CSV files with a body column')
+    parser.add_argument('--repeat', type=int, default=10, help='Timing repetitions')
+    args = parser.parse_args()
+
+    bodies = load_bodies(args.input)
+    if not bodies:
+        sys.exit(f"No bodies found in {args.input}")
+
+    mismatches = sum(
+        clean_press_release_text(body) != reference_clean_press_release_text(body)
+        for body in bodies
+    )
+
+    total_mb = sum(len(body) for body in bodies) / 1e6
+    reference = time_cleaner(reference_clean_press_release_text, bodies, args.repeat)
+    current = time_cleaner(clean_press_release_text, bodies, args.repeat)
+
+    print(f"Bodies: {len(bodies)} ({total_mb:.2f} MB)")
+    print(f"Reference: {reference * 1000:.2f} ms ({total_mb / reference:.1f} MB/s)")
+    print(f"Current:   {current * 1000:.2f} ms ({total_mb / current:.1f} MB/s)")
+    print(f"Speedup:   {reference / current:.2f}x")
+    print(f"Mismatches: {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
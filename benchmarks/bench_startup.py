@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""
+Startup time of the main.py subcommands, with an import budget.
+
+Each command runs under `python -X importtime`. The time spent importing the
+modules the bare interpreter (`python -c pass`) does not import is checked
+against the command's budget, and the light commands must not import any of
+the heavy packages at all. The run fails if any command is over budget.
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+
+# Command line: milliseconds of imports it may add to the bare interpreter's
+BUDGETS = {
+    ('--help',): 25,
+    ('search', 'pfizer vaccine', '-k', '3'): 40,
+    ('stats',): 25,
+}
+# Packages that take 100 ms or more to import, none of which a light command needs
+HEAVY = ('pandas', 'numpy', 'scipy', 'pyarrow', 'matplotlib', 'seaborn', 'agentql',
+         'playwright', 'requests', 'httpx', 'dotenv')
+
+def import_times(args):
+    """Microseconds of cumulative import time by top-level module of one run."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=ROOT,
+                            capture_output=True, text=True)
+    if result.returncode:
+        sys.exit(f"{' '.join(args)} failed:\n{result.stderr[-2000:]}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # One space follows the separator, nested imports are indented further
+        times[name[1:].rstrip()] = int(cumulative)
+    return times
+
+def added_time(times, baseline):
+    """Total of the modules imported directly (not by another module) that are not
+    in baseline; interpreter startup varies too much run to run to subtract."""
+    return sum(us for name, us in times.items()
+               if not name.startswith(' ') and name not in baseline)
+
+def wall_time(args, repeat):
+    """Best wall time over `repeat` runs."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    """Time every command and check it against its budget"""
+    parser = argparse.ArgumentParser(description='Benchmark main.py startup')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per command')
+    args = parser.parse_args()
+
+    baseline_args = ['-c', 'pass']
+    baseline = set(import_times(baseline_args))
+    baseline_wall = wall_time(baseline_args, args.repeat)
+    print(f"{'python -c pass':<40} {baseline_wall * 1000:7.1f} ms")
+
+    over = []
+    for command, budget in BUDGETS.items():
+        runs = [import_times([MAIN, *command]) for _ in range(args.repeat)]
+        # Best of repeat, as the first run also pays for cold caches
+        added = min(added_time(times, baseline) for times in runs)
+        heavy = sorted({name.strip() for name in runs[0]} & set(HEAVY))
+        wall = wall_time([MAIN, *command], args.repeat)
+        label = 'main.py ' + ' '.join(command)
+        print(f"{label:<40} {wall * 1000:7.1f} ms  imports +{added / 1000:5.1f} ms "
+              f"(budget {budget} ms)")
+        if added > budget * 1000:
+            over.append(f"{label}: imports take {added / 1000:.1f} ms, budget {budget} ms")
+        if heavy:
+            over.append(f"{label}: imports {', '.join(heavy)}")
+
+    if over:
+        sys.exit("Over budget:\n  " + "\n  ".join(over))
+    print("All commands within budget")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+"""
+Offline benchmarks of the pipeline's hot paths, checked against a baseline.
+
+Everything runs from checked-in data, without a browser or network:
+
+- extract_listing: each scraper's extract_news_articles on a mock AgentQL page
+  serving the listing rows in data/raw page by page, then the known-URL filter
+  and clean_articles of what was extracted
+- clean_body: clean_press_release_text of the bodies in data/output_scraping.zip
+- parse_dates: parse_dates of every raw listing date
+- load_csv / load_parquet / load_parquet_metadata: reading the zipped articles
+  back from a CSV file, the Parquet dataset, and its metadata columns only
+- stats_build / stats_refresh: the statistics state built from every article,
+  and refreshed after 100 articles change, each with its statistics rendered
+
+Every benchmark reports the best of --repeat runs. Results are written as JSON
+and compared with benchmarks/baseline.json; a benchmark slower than its
+baseline by more than --threshold fails the run. Baselines are per machine:
+save one with --save-baseline before comparing changes.
+
+    python benchmarks/bench_suite.py --repeat 5
+    python benchmarks/bench_suite.py --only clean_body --only parse_dates
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'src'))
+
+from data_processing.clean_body import clean_press_release_text
+from data_processing.clean_data import clean_articles
+from data_processing.stats_state import StatsState
+from scrapers.harness import PAGE_SIZE, listing_rows, stored_articles
+from storage.parquet_store import METADATA_COLUMNS, read_articles, write_articles
+from utils.common import _parse_date_str, canonical_url, filter_new_articles, parse_dates
+
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+RESULTS_PATH = os.path.join(ROOT, 'benchmarks', 'results.json')
+COMPANIES = ['pfizer', 'merck', 'lilly']
+CHANGED_ARTICLES = 100  # articles changed between stats_refresh runs
+MIN_REGRESSION = 0.002  # seconds; slowdowns smaller than this are noise, whatever the ratio
+
+class MockPage:
+    """Just enough of an AgentQL page for extract_news_articles: query_data
+    returns the next page of listing rows."""
+
+    def __init__(self, rows):
+        self.pages = [rows[i:i + PAGE_SIZE] for i in range(0, len(rows), PAGE_SIZE)]
+        self.index = 0
+
+    async def query_data(self, query):
+        page = self.pages[self.index]
+        self.index += 1
+        return {'articles': [dict(row) for row in page]}
+
+async def _no_sleep(seconds):
+    pass
+
+def bench_extract_listing(workdir):
+    import scrapers.lilly_scraper
+    import scrapers.merck_scraper
+    import scrapers.pfizer_scraper
+
+    scrapers_by_company = {'pfizer': scrapers.pfizer_scraper, 'merck': scrapers.merck_scraper,
+                           'lilly': scrapers.lilly_scraper}
+    # Every other article counts as already scraped, so the filter has work to do
+    known = {company: {canonical_url(row['url']) for row in listing_rows(company)[::2]}
+             for company in COMPANIES}
+
+    async def extract_all():
+        for company, scraper in scrapers_by_company.items():
+            page = MockPage(listing_rows(company))
+            extracted = []
+            for _ in page.pages:
+                extracted += filter_new_articles(await scraper.extract_news_articles(page),
+                                                 known[company])
+            clean_articles(extracted)
+
+    def run():
+        # The Pfizer extractor waits 10 s for the page to settle; the mock needs no wait.
+        # The last, short page of every company logs a warning
+        logging.disable(logging.WARNING)
+        try:
+            with mock.patch.object(asyncio, 'sleep', _no_sleep):
+                asyncio.run(extract_all())
+        finally:
+            logging.disable(logging.NOTSET)
+
+    return run, sum(len(listing_rows(company)) for company in COMPANIES)
+
+def bench_clean_body(workdir):
+    bodies = stored_articles()['body'].dropna().tolist()
+
+    def run():
+        for body in bodies:
+            clean_press_release_text(body)
+
+    return run, len(bodies)
+
+def bench_parse_dates(workdir):
+    dates = pd.Series([row['date'] for company in COMPANIES for row in listing_rows(company)])
+
+    def run():
+        _parse_date_str.cache_clear()
+        parse_dates(dates)
+
+    return run, len(dates)
+
+def _saved_articles(workdir):
+    """Paths of the zipped articles saved as one CSV and as a Parquet dataset."""
+    csv_path = os.path.join(workdir, 'articles.csv')
+    dataset_root = os.path.join(workdir, 'dataset')
+    if not os.path.exists(csv_path):
+        df = stored_articles()
+        df.to_csv(csv_path, index=False)
+        for company, rows in df.groupby('company'):
+            write_articles(rows.drop(columns=['company']), 'output', company, root=dataset_root)
+    return csv_path, dataset_root
+
+def bench_load_csv(workdir):
+    csv_path, _ = _saved_articles(workdir)
+    return (lambda: pd.read_csv(csv_path, parse_dates=['date'])), len(stored_articles())
+
+def bench_load_parquet(workdir):
+    _, dataset_root = _saved_articles(workdir)
+    return (lambda: read_articles('output', root=dataset_root)), len(stored_articles())
+
+def bench_load_parquet_metadata(workdir):
+    _, dataset_root = _saved_articles(workdir)
+    return (lambda: read_articles('output', columns=METADATA_COLUMNS, root=dataset_root)), \
+        len(stored_articles())
+
+def _metadata():
+    return stored_articles()[['url', 'company', 'date', 'category']]
+
+def bench_stats_build(workdir):
+    df = _metadata()
+
+    def run():
+        with StatsState(':memory:') as state:
+            state.sync(df)
+            state.statistics()
+
+    return run, len(df)
+
+def bench_stats_refresh(workdir):
+    df = _metadata()
+    state = StatsState(':memory:')
+    state.sync(df)
+    changed = df.head(CHANGED_ARTICLES)
+    # Alternate the changed rows between two categories, so every run applies a change
+    variants = [changed.assign(category='financial news'),
+                changed.assign(category='management update')]
+    runs = iter(range(10 ** 9))
+
+    def run():
+        state.ingest(variants[next(runs) % 2])
+        state.statistics()
+
+    return run, CHANGED_ARTICLES
+
+# Name: setup function returning (function to time, items it processes)
+BENCHMARKS = {
+    'extract_listing': bench_extract_listing,
+    'clean_body': bench_clean_body,
+    'parse_dates': bench_parse_dates,
+    'load_csv': bench_load_csv,
+    'load_parquet': bench_load_parquet,
+    'load_parquet_metadata': bench_load_parquet_metadata,
+    'stats_build': bench_stats_build,
+    'stats_refresh': bench_stats_refresh,
+}
+
+def time_best(function, repeat):
+    """Best wall time over `repeat` calls."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def machine():
+    """What the timings were measured on."""
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(), 'cpus': os.cpu_count()}
+
+def run_benchmarks(names, repeat):
+    """Results by benchmark name: best seconds, items and items per second."""
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in names:
+            function, items = BENCHMARKS[name](workdir)
+            function()  # warm up imports and caches
+            seconds = time_best(function, repeat)
+            results[name] = {'seconds': round(seconds, 6), 'items': items,
+                             'per_second': round(items / seconds, 1)}
+            print(f"{name:<22} {seconds * 1000:9.2f} ms  {items:6d} items  "
+                  f"{items / seconds:12,.0f}/s")
+    return results
+
+def regressions(results, baseline, threshold):
+    """Descriptions of the benchmarks more than threshold slower than their baseline."""
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        ratio = result['seconds'] / before['seconds']
+        change = f"{name}: {before['seconds'] * 1000:.2f} -> {result['seconds'] * 1000:.2f} ms " \
+                 f"({(ratio - 1) * 100:+.0f}%)"
+        print(f"  {change}")
+        if ratio > 1 + threshold and result['seconds'] - before['seconds'] > MIN_REGRESSION:
+            found.append(change)
+    return found
+
+def main():
+    """Run the benchmarks and compare them with the baseline"""
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline hot paths')
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS),
+                        help='Run only this benchmark (repeatable)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing repetitions')
+    parser.add_argument('--output', default=RESULTS_PATH, help='Where to write the results JSON')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline results JSON')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Slowdown over the baseline that fails the run (0.25 = 25%%)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Save the results as the new baseline instead of comparing')
+    args = parser.parse_args()
+
+    report = {'machine': machine(), 'repeat': args.repeat,
+              'results': run_benchmarks(args.only or list(BENCHMARKS), args.repeat)}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        report['results'] = {**baseline.get('results', {}), **report['results']}
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, save one with --save-baseline")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('machine') != report['machine']:
+        print("Note: the baseline was measured on a different machine or Python")
+    print(f"Against {args.baseline}:")
+    found = regressions(report['results'], baseline['results'], args.threshold)
+    if found:
+        sys.exit(f"{len(found)} regressions over {args.threshold:.0%}:\n  " + "\n  ".join(found))
+    print(f"No regressions over {args.threshold:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -95,14 +95,15 @@ def process_file(file_path):
         df['body'] = df['body'].apply(clean_press_release_text)
     return df
 
-files = [
-    # 'data/processed/merck_news_cleaned.csv'
-    'data/processed/pfizer_news_cleaned.csv'
-]
+if __name__ == "__main__":
+    files = [
+        # 'data/processed/merck_news_cleaned.csv'
+        'data/processed/pfizer_news_cleaned.csv'
+    ]
 
-for file_path in files:
-    print(f"Processing {file_path}")
-    df = process_file(file_path)
-    output_path = file_path.replace('data/processed', 'data/output')
-    df.to_csv(output_path, index=False)
-    print(f"Saved cleaned {output_path}")
+    for file_path in files:
+        print(f"Processing {file_path}")
+        df = process_file(file_path)
+        output_path = file_path.replace('data/processed', 'data/output')
+        df.to_csv(output_path, index=False)
+        print(f"Saved cleaned {output_path}")
@@ -48,15 +48,16 @@ def clean_news_data(file_path):
     
     return df
 
-# Clean each file
-lilly_df = clean_news_data('data/raw/lilly/lilly_news_20250101_113822_latest.csv')
-merck_df = clean_news_data('data/raw/merck/merck_news_20241231_160018.csv')
-pfizer_df = clean_news_data('data/raw/pfizer/pfizer_news_20241231_221326_latest.csv')
+if __name__ == "__main__":
+    # Clean each file
+    lilly_df = clean_news_data('data/raw/lilly/lilly_news_20250101_113822_latest.csv')
+    merck_df = clean_news_data('data/raw/merck/merck_news_20241231_160018.csv')
+    pfizer_df = clean_news_data('data/raw/pfizer/pfizer_news_20241231_221326_latest.csv')
 
-# Save cleaned files
-merck_df = merck_df.drop('excerpt', axis=1)
-merck_df = merck_df.rename(columns={'tags': 'category'})
+    # Save cleaned files
+    merck_df = merck_df.drop('excerpt', axis=1)
+    merck_df = merck_df.rename(columns={'tags': 'category'})
 
-lilly_df.to_csv('data/clean/lilly_news_cleaned.csv', index=False)
-merck_df.to_csv('data/clean/merck_news_cleaned.csv', index=False)
-pfizer_df.to_csv('data/clean/pfizer_news_cleaned.csv', index=False)
\ No newline at end of file
+    lilly_df.to_csv('data/clean/lilly_news_cleaned.csv', index=False)
+    merck_df.to_csv('data/clean/merck_news_cleaned.csv', index=False)
+    pfizer_df.to_csv('data/clean/pfizer_news_cleaned.csv', index=False)
\ No newline at end of file
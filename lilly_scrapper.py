@@ -12,10 +12,6 @@ from agentql.ext.playwright.async_api import Page
 from playwright.async_api import async_playwright
 from urllib.parse import urlparse, parse_qs, urlencode
 
-# Load environment variables
-load_dotenv()
-os.environ["AGENTQL_API_KEY"] = os.getenv("AGENTQL_API_KEY")
-
 BASE_URL = "https://lilly.mediaroom.com/index.php"
 ITEMS_PER_PAGE = 50  # Changed from 100 to 50
 
@@ -108,4 +104,7 @@ async def main():
             await browser.close()
 
 if __name__ == "__main__":
+    # Load environment variables
+    load_dotenv()
+    os.environ["AGENTQL_API_KEY"] = os.getenv("AGENTQL_API_KEY")
     asyncio.run(main())
\ No newline at end of file
@@ -3,10 +3,18 @@
 """
 Main entry point for the Pharma Insights Scraper.
 This script allows running different scrapers and data processing tools.
+
+Startup is kept light: this module imports only the standard library it needs
+to parse arguments, and each subcommand imports its own modules when it runs
+(see COMMANDS), so `--help`, search and statistics summaries never load pandas,
+numpy or the browser. benchmarks/bench_startup.py enforces the import budget.
+
+Every command is a metrics run (see utils.metrics): when it ends, the spans
+and counters it recorded are written to data/runs/ and summarized in a table.
+Commands other than search and stats log through utils.common.setup_logging.
 """
 
 import argparse
-import asyncio
 import os
 import sys
 
@@ -16,6 +24,8 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 def setup_parser():
     """Set up command line argument parser."""
     parser = argparse.ArgumentParser(description='Pharma Insights Scraper')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='Also show (sampled) debug messages on the console')
     
     subparsers = parser.add_subparsers(dest='command', help='Command to run')
     
@@ -26,8 +36,86 @@ def setup_parser():
     
     # Process command
     process_parser = subparsers.add_parser('process', help='Process scraped data')
-    process_parser.add_argument('--input', '-i', help='Input file or directory')
-    process_parser.add_argument('--output', '-o', help='Output file or directory')
+    process_parser.add_argument('--company', '-c', choices=['pfizer', 'merck', 'lilly', 'all'],
+                                default='all', help='Company to process')
+    stages = ['merge', 'clean', 'bodies', 'clean-bodies', 'dedup', 'index', 'entities', 'trials',
+              'stats']
+    process_parser.add_argument('--from', dest='start', choices=stages,
+                                help='Resume at this stage, reusing the outputs of earlier ones')
+    process_parser.add_argument('--only', choices=stages, help='Run a single stage')
+    process_parser.add_argument('--force', action='store_true',
+                                help='Rerun the selected stages even if their inputs are unchanged')
+    process_parser.add_argument('--engine', choices=['jina', 'spider'], default='jina',
+                                help='API used to fetch article bodies')
+    process_parser.add_argument('--delay', type=float, default=1,
+                                help='Seconds between body fetches')
+    process_parser.add_argument('--max-fetch', type=int,
+                                help='Fetch at most this many bodies per company')
+    process_parser.add_argument('--workers', '-w', type=int,
+                                help='Worker processes per company for cleaning bodies')
+    
+    # Daemon command
+    daemon_parser = subparsers.add_parser('daemon', help='Continuously scrape and process new articles')
+    daemon_parser.add_argument('--company', '-c', choices=['pfizer', 'merck', 'lilly', 'all'],
+                               default='all', help='Company to keep up to date')
+    daemon_parser.add_argument('--interval', action='append', metavar='[COMPANY=]SECONDS',
+                               help='Refresh interval, for all companies or one (repeatable)')
+    daemon_parser.add_argument('--jitter', type=float, default=60,
+                               help='Random +/- seconds added to every interval')
+    daemon_parser.add_argument('--max-pages', type=int, default=2,
+                               help='Listing pages to check per refresh')
+    daemon_parser.add_argument('--engine', choices=['jina', 'spider'], default='jina',
+                               help='API used to fetch article bodies')
+    daemon_parser.add_argument('--once', action='store_true',
+                               help='Run a single refresh per company and exit')
+    daemon_parser.add_argument('--boilerplate', nargs='?', const='data/models/boilerplate.npz',
+                               metavar='MODEL',
+                               help='Clean bodies with the learned per-site boilerplate model')
+    daemon_parser.add_argument('--classifier', nargs='?',
+                               const='data/models/category_classifier.npz', metavar='MODEL',
+                               help='Categorize with the local classifier, keeping the LLM '
+                                    'category only for low-confidence articles')
+    daemon_parser.add_argument('--metrics-port', type=int,
+                               help='Serve Prometheus metrics at http://127.0.0.1:PORT/metrics')
+    
+    # Store command
+    store_parser = subparsers.add_parser('store', help='Manage the SQLite article store')
+    store_parser.add_argument('action', choices=['import', 'export'],
+                              help='Load the stage CSVs into the store, or write them from it')
+    store_parser.add_argument('--data-dir', default='data',
+                              help='Directory holding the clean, processed and output CSVs')
+    
+    # Search command
+    search_parser = subparsers.add_parser('search', help='Full-text search of the articles')
+    search_parser.add_argument('query', help='Words to search for')
+    search_parser.add_argument('--company', '-c', action='append',
+                               choices=['pfizer', 'merck', 'lilly'],
+                               help='Only this company (repeatable)')
+    search_parser.add_argument('--category', action='append',
+                               help='Only this category (repeatable)')
+    search_parser.add_argument('--since', help='Earliest publication date, YYYY-MM-DD')
+    search_parser.add_argument('--until', help='Latest publication date, YYYY-MM-DD')
+    search_parser.add_argument('-k', type=int, default=10, help='Number of results')
+    search_parser.add_argument('--update', action='store_true',
+                               help='Index new and changed articles of data/output first')
+    
+    # Stats command
+    stats_parser = subparsers.add_parser('stats', help='Summarize or query the statistics')
+    stats_parser.add_argument('--scope', choices=['all', 'company'], default='all',
+                              help="Count duplicates once overall ('all') or per company")
+    stats_parser.add_argument('--freq', choices=['M', 'Q', 'Y'], help='Period length')
+    stats_parser.add_argument('--company', '-c', action='append',
+                              choices=['pfizer', 'merck', 'lilly'],
+                              help='Only this company (repeatable)')
+    stats_parser.add_argument('--category', action='append',
+                              help='Only this category (repeatable)')
+    stats_parser.add_argument('--since', help='First period, e.g. 2023-01, 2023-Q1 or 2023')
+    stats_parser.add_argument('--until', help='Last period')
+    stats_parser.add_argument('--top', type=int, metavar='K', help='Top K categories')
+    stats_parser.add_argument('--per', choices=['company', 'period'],
+                              help='Group --top or --share by')
+    stats_parser.add_argument('--share', action='store_true',
+                              help='Category share of the articles')
     
     return parser
 
@@ -48,48 +136,158 @@ async def run_lilly_scraper():
 
 async def run_scrapers(company):
     """Run the selected scrapers."""
+    import logging
+    
+    logger = logging.getLogger(__name__)
     if company == 'all' or company == 'pfizer':
-        print("Running Pfizer scraper...")
+        logger.info("Running Pfizer scraper...")
         await run_pfizer_scraper()
     
     if company == 'all' or company == 'merck':
-        print("Running Merck scraper...")
+        logger.info("Running Merck scraper...")
         await run_merck_scraper()
     
     if company == 'all' or company == 'lilly':
-        print("Running Lilly scraper...")
+        logger.info("Running Lilly scraper...")
         await run_lilly_scraper()
 
-def process_data(input_path, output_path):
-    """Process scraped data."""
-    from data_processing.clean_data import process_files
-    from data_processing.clean_body import process_file
+def run_scrape(args):
+    """Run the selected scrapers to completion."""
+    import asyncio
     
-    print(f"Processing data from {input_path} to {output_path}...")
-    # Implementation depends on the specific processing needs
+    asyncio.run(run_scrapers(args.company))
+
+def run_daemon(args):
+    """Run the continuous ingestion daemon."""
+    import asyncio
+    import logging
     
-    if not output_path:
-        output_path = 'data/processed'
-        
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
+    from pipeline.daemon import COMPANIES, IngestionDaemon, parse_intervals
     
-    # Example implementation:
-    # process_files(input_path, output_path)
+    logger = logging.getLogger(__name__)
+    companies = COMPANIES if args.company == 'all' else (args.company,)
+    daemon = IngestionDaemon(
+        companies=companies,
+        intervals=parse_intervals(args.interval, companies),
+        jitter=args.jitter,
+        max_pages=args.max_pages,
+        engine=args.engine,
+        boilerplate_path=args.boilerplate,
+        classifier_path=args.classifier,
+    )
+    if args.metrics_port:
+        from utils.metrics import serve_prometheus
+        serve_prometheus(args.metrics_port)
+        logger.info(f"Serving metrics at http://127.0.0.1:{args.metrics_port}/metrics")
+    logger.info(f"Starting daemon for {', '.join(companies)}...")
+    try:
+        asyncio.run(daemon.run(once=args.once))
+    except KeyboardInterrupt:
+        logger.info("Daemon stopped.")
+
+def run_store(args):
+    """Import the stage CSVs into the article store or export them from it."""
+    from storage.sql_store import ArticleRepository
+    
+    with ArticleRepository() as repo:
+        if args.action == 'import':
+            added = repo.import_stages(args.data_dir)
+            print(f"Imported {added} new articles into {repo.path} ({repo.count()} total)")
+        else:
+            paths = repo.export_stages(args.data_dir)
+            print(f"Exported {len(paths)} files from {repo.path}")
+
+def process_data(args):
+    """Run the processing pipeline."""
+    from pipeline.stages import COMPANIES, run_pipeline
     
-    print("Data processing complete.")
+    companies = COMPANIES if args.company == 'all' else (args.company,)
+    ok = run_pipeline(companies, start=args.start, only=args.only, force=args.force,
+                      engine=args.engine, delay=args.delay, max_fetch=args.max_fetch,
+                      workers=args.workers)
+    if not ok:
+        sys.exit(1)
+
+def run_search(args):
+    """Search the full-text index and print the best matches."""
+    import glob
+    import time
+    
+    from search.index import SearchIndex, index_files
+    
+    index = SearchIndex()
+    if args.update:
+        files = sorted(glob.glob(os.path.join('data', 'output', '*_news_cleaned.csv')))
+        print(f"Indexed {index_files(files, index)} new or changed articles")
+    started = time.perf_counter()
+    results = index.search(args.query, k=args.k, companies=args.company, start=args.since,
+                           end=args.until, categories=args.category)
+    elapsed = (time.perf_counter() - started) * 1000
+    for result in results:
+        print(f"{result['score']:7.2f}  {result['date']}  {result['company']:<7} {result['title']}")
+        print(f"         {result['url']}")
+    print(f"{len(results)} results from {len(index)} articles in {elapsed:.1f} ms")
+
+def run_stats(args):
+    """Print the statistics summary, or answer a query of the category cube."""
+    if any((args.freq, args.company, args.category, args.since, args.until, args.top, args.per,
+            args.share)):
+        from data_processing.cube import query
+        query(args)
+        return
+    
+    import json
+    
+    stats_file = os.path.join('data', 'stats', 'pharma_news_stats.json')
+    if not os.path.exists(stats_file):
+        sys.exit(f"No statistics at {stats_file}, run generate_stats.py first")
+    with open(stats_file) as f:
+        stats = json.load(f)
+    top = sorted(stats['category_counts'].items(), key=lambda x: x[1], reverse=True)[:5]
+    print(f"Total news articles: {stats['total_articles']}")
+    print(f"Articles by company: {stats['company_counts']}")
+    print(f"Date range: {stats['date_range']['start']} to {stats['date_range']['end']}")
+    print(f"Top categories: {top}")
+
+# Commands that only print their results, and so skip setting up logging
+QUIET_COMMANDS = ('search', 'stats')
+
+# Subcommand -> function running it. Each function imports what its command
+# needs when called, so only the chosen command pays for its imports.
+COMMANDS = {
+    'scrape': run_scrape,
+    'process': process_data,
+    'daemon': run_daemon,
+    'store': run_store,
+    'search': run_search,
+    'stats': run_stats,
+}
 
 def main():
     """Main entry point."""
     parser = setup_parser()
     args = parser.parse_args()
     
-    if args.command == 'scrape':
-        asyncio.run(run_scrapers(args.company))
-    elif args.command == 'process':
-        process_data(args.input, args.output)
-    else:
+    command = COMMANDS.get(args.command)
+    if command is None:
         parser.print_help()
+        return
+    
+    from utils import metrics
+    
+    if args.command not in QUIET_COMMANDS:
+        from utils.common import setup_logging
+        setup_logging('DEBUG' if args.verbose else 'INFO')
+    metrics.start_run(args.command)
+    try:
+        command(args)
+    finally:
+        summary = metrics.finish_run()
+        if args.command not in QUIET_COMMANDS:
+            from utils.common import stop_logging
+            stop_logging()  # so the queued log lines come out before the summary
+        if summary:
+            print(f"\n{summary}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -11,11 +11,6 @@ import agentql
 from agentql.ext.playwright.async_api import Page
 from playwright.async_api import async_playwright
 
-# Load environment variables from .env file
-load_dotenv()
-
-os.environ["AGENTQL_API_KEY"] = os.getenv("AGENTQL_API_KEY")
-
 URL = "https://www.merck.com/media/news/"
 
 async def extract_news_articles(page: Page) -> list:
@@ -239,4 +234,7 @@ async def main():
             await browser.close()
 
 if __name__ == "__main__":
+    # Load environment variables
+    load_dotenv()
+    os.environ["AGENTQL_API_KEY"] = os.getenv("AGENTQL_API_KEY")
     asyncio.run(main())
\ No newline at end of file
@@ -11,10 +11,6 @@ import agentql
 from agentql.ext.playwright.async_api import Page
 from playwright.async_api import async_playwright
 
-# Load environment variables
-load_dotenv()
-os.environ["AGENTQL_API_KEY"] = os.getenv("AGENTQL_API_KEY")
-
 URL = "https://www.pfizer.com/news/press-releases"
 
 async def set_items_per_page(page: Page) -> bool:
@@ -176,4 +172,7 @@ async def main():
             await browser.close()
 
 if __name__ == "__main__":
+    # Load environment variables
+    load_dotenv()
+    os.environ["AGENTQL_API_KEY"] = os.getenv("AGENTQL_API_KEY")
     asyncio.run(main())
\ No newline at end of file
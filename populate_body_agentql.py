@@ -7,10 +7,6 @@ from tqdm import tqdm
 import agentql
 from playwright.async_api import async_playwright
 
-# Load environment variables
-load_dotenv()
-os.environ["AGENTQL_API_KEY"] = os.getenv("AGENTQL_API_KEY")
-
 async def fetch_article_body(url, page):
     """Fetch article body using AgentQL"""
     try:
@@ -70,4 +66,7 @@ def main():
         asyncio.run(process_file(file))
 
 if __name__ == "__main__":
+    # Load environment variables
+    load_dotenv()
+    os.environ["AGENTQL_API_KEY"] = os.getenv("AGENTQL_API_KEY")
     main()
@@ -6,12 +6,6 @@ import time
 from tqdm import tqdm
 from firecrawl import FirecrawlApp
 
-# Load environment variables
-load_dotenv()
-
-# Initialize Firecrawl
-app = FirecrawlApp(api_key=os.getenv("FIRECRAWL_API_KEY"))
-
 def fetch_article_body(url):
     """Fetch article body using Firecrawl API"""
     try:
@@ -50,26 +44,33 @@ def process_file(file_path):
     return df
 
 
-# File paths
-input_files = [
-    'data/clean/lilly_news_cleaned_test.csv',
-    # 'data/clean/merck_news_cleaned.csv',
-    # 'data/clean/pfizer_news_cleaned.csv'
-]
+if __name__ == "__main__":
+    # Load environment variables
+    load_dotenv()
+
+    # Initialize Firecrawl
+    app = FirecrawlApp(api_key=os.getenv("FIRECRAWL_API_KEY"))
+
+    # File paths
+    input_files = [
+        'data/clean/lilly_news_cleaned_test.csv',
+        # 'data/clean/merck_news_cleaned.csv',
+        # 'data/clean/pfizer_news_cleaned.csv'
+    ]
 
-# Create processed directory if it doesn't exist
-os.makedirs('data/processed', exist_ok=True)
+    # Create processed directory if it doesn't exist
+    os.makedirs('data/processed', exist_ok=True)
 
-# Process each file
-for input_file in input_files:
-    print(f"\nProcessing {input_file}")
+    # Process each file
+    for input_file in input_files:
+        print(f"\nProcessing {input_file}")
     
-    # Read and process file
-    df = process_file(input_file)
+        # Read and process file
+        df = process_file(input_file)
     
-    # Create output path
-    output_file = input_file.replace('data/clean', 'data/processed')
+        # Create output path
+        output_file = input_file.replace('data/clean', 'data/processed')
     
-    # Save updated file
-    df.to_csv(output_file, index=False)
-    print(f"Saved processed file to {output_file}")
+        # Save updated file
+        df.to_csv(output_file, index=False)
+        print(f"Saved processed file to {output_file}")
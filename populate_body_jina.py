@@ -5,9 +5,6 @@ import os
 import time
 from tqdm import tqdm
 
-# Load environment variables
-load_dotenv()
-
 def fetch_article_body(url):
     """Fetch article body using Jina AI API"""
     try:
@@ -69,4 +66,6 @@ def main():
         print(f"Saved updated {output_path}")
 
 if __name__ == "__main__":
+    # Load environment variables
+    load_dotenv()
     main()
\ No newline at end of file
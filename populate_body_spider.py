@@ -5,9 +5,6 @@ import os
 import time
 from tqdm import tqdm
 
-# Load environment variables
-load_dotenv()
-
 def fetch_article_body(url):
     """Fetch article body using Spider Cloud API"""
     try:
@@ -59,26 +56,30 @@ def process_file(file_path):
     
     return df
 
-# File paths
-files = [
-    # 'data/clean/lilly_news_cleaned_test.csv',
-    # 'data/clean/lilly_news_cleaned.csv',
-    'data/clean/merck_news_cleaned.csv',
-    'data/clean/pfizer_news_cleaned.csv'
-]
+if __name__ == "__main__":
+    # Load environment variables
+    load_dotenv()
+
+    # File paths
+    files = [
+        # 'data/clean/lilly_news_cleaned_test.csv',
+        # 'data/clean/lilly_news_cleaned.csv',
+        'data/clean/merck_news_cleaned.csv',
+        'data/clean/pfizer_news_cleaned.csv'
+    ]
 
-# Process each file
-for file_path in files:
-    print(f"\nProcessing {file_path}")
-    df = process_file(file_path)
+    # Process each file
+    for file_path in files:
+        print(f"\nProcessing {file_path}")
+        df = process_file(file_path)
     
-    # Create processed directory if it doesn't exist
-    os.makedirs('data/processed', exist_ok=True)
+        # Create processed directory if it doesn't exist
+        os.makedirs('data/processed', exist_ok=True)
     
-    # Get the filename from the path and create new path
-    filename = os.path.basename(file_path)
-    processed_path = os.path.join('data/processed', filename)
+        # Get the filename from the path and create new path
+        filename = os.path.basename(file_path)
+        processed_path = os.path.join('data/processed', filename)
     
-    # Save to processed directory
-    df.to_csv(processed_path, index=False)
-    print(f"Saved to {processed_path}")
+        # Save to processed directory
+        df.to_csv(processed_path, index=False)
+        print(f"Saved to {processed_path}")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+"""
+Per-site boilerplate model learned from the corpus.
+
+Every line of every article body is normalized and hashed, and the model keeps,
+per site, how many documents contain each hash. Lines that occur in more than
+`threshold` of a site's documents (navigation, footers, cookie banners, the
+"About" paragraphs) are treated as template and removed in a single hash lookup
+per line. The counts are saved to disk and updated incrementally: documents
+already seen, keyed by URL, are not counted twice.
+"""
+
+import hashlib
+import json
+import os
+from collections import Counter
+from urllib.parse import urlparse
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.3  # fraction of a site's documents a template line appears in
+MIN_DOCUMENTS = 10  # documents needed before a site's template lines are trusted
+MODEL_PATH = 'data/models/boilerplate.npz'
+
+def site_key(url):
+    """Site a document belongs to, e.g. 'pfizer.com' for any pfizer.com URL."""
+    netloc = urlparse(str(url)).netloc.lower()
+    return netloc[4:] if netloc.startswith('www.') else netloc
+
+def line_hash(line):
+    """Stable 64-bit hash of a line, ignoring case and whitespace differences."""
+    normalized = ' '.join(line.split()).lower()
+    return int.from_bytes(hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest(),
+                          'little')
+
+class BoilerplateModel:
+    """Document frequency of normalized lines, per site."""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, min_documents=MIN_DOCUMENTS):
+        self.threshold = threshold
+        self.min_documents = min_documents
+        self.documents = Counter()
+        self.counts = {}
+        self.seen = set()
+        self._templates = {}
+
+    def update(self, site, lines, doc_key=None):
+        """Count the distinct lines of one document; returns False if already seen."""
+        if doc_key is not None:
+            key = line_hash(str(doc_key))
+            if key in self.seen:
+                return False
+            self.seen.add(key)
+
+        hashes = {line_hash(line) for line in lines if line.strip()}
+        self.counts.setdefault(site, Counter()).update(hashes)
+        self.documents[site] += 1
+        self._templates.pop(site, None)
+        return True
+
+    def template_lines(self, site):
+        """Hashes of the lines that are template for a site."""
+        if site not in self._templates:
+            documents = self.documents[site]
+            if documents < self.min_documents:
+                self._templates[site] = frozenset()
+            else:
+                cutoff = self.threshold * documents
+                self._templates[site] = frozenset(
+                    h for h, count in self.counts.get(site, {}).items() if count > cutoff)
+        return self._templates[site]
+
+    def templates(self):
+        """Template line hashes for every site."""
+        return {site: self.template_lines(site) for site in self.documents}
+
+    def save(self, path=MODEL_PATH):
+        """Save the counts as compact uint64 arrays in an .npz file."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        meta = {
+            'threshold': self.threshold,
+            'min_documents': self.min_documents,
+            'documents': dict(self.documents),
+        }
+        arrays = {
+            'meta': np.array(json.dumps(meta)),
+            'seen': np.fromiter(self.seen, dtype=np.uint64, count=len(self.seen)),
+        }
+        for i, (site, counts) in enumerate(self.counts.items()):
+            arrays[f'site_{i}'] = np.array(site)
+            arrays[f'hashes_{i}'] = np.fromiter(counts.keys(), dtype=np.uint64, count=len(counts))
+            arrays[f'counts_{i}'] = np.fromiter(counts.values(), dtype=np.uint32, count=len(counts))
+
+        tmp_path = f'{path}.tmp.npz'
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=MODEL_PATH, threshold=None):
+        """Load a saved model, or return an empty one if the file does not exist."""
+        if not os.path.exists(path):
+            return cls(threshold if threshold is not None else DEFAULT_THRESHOLD)
+
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            model = cls(threshold if threshold is not None else meta['threshold'],
+                        meta['min_documents'])
+            model.documents = Counter(meta['documents'])
+            model.seen = set(data['seen'].tolist())
+            i = 0
+            while f'site_{i}' in data:
+                model.counts[str(data[f'site_{i}'])] = Counter(
+                    dict(zip(data[f'hashes_{i}'].tolist(), data[f'counts_{i}'].tolist())))
+                i += 1
+        return model
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+"""
+Local category classifier trained on the already labeled articles.
+
+Titles and the start of the cleaned bodies are tokenized, hashed into
+N_FEATURES columns of a sparse matrix and weighted by TF-IDF. A one-vs-rest
+logistic regression over the canonical taxonomy (data_processing.taxonomy)
+is fitted on them with full-batch Adam, so an article can get several
+categories. Prediction is one sparse matrix product per batch.
+
+Every prediction has a confidence: the probability of the least certain
+per-category decision. Rows below the threshold keep the category the
+AgentQL listing query returned; the others take the model's.
+
+    python src/data_processing/classifier.py train
+    python src/data_processing/classifier.py classify data/clean/*.csv --apply
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+import zlib
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processing.taxonomy import BITS, category_labels, category_masks
+from search.tokenizer import tokenize
+from utils.common import DATA_DIR, flush_logging, setup_logging
+
+logger = logging.getLogger(__name__)
+
+MODEL_PATH = os.path.join(DATA_DIR, 'models', 'category_classifier.npz')
+N_FEATURES = 2 ** 18  # hashed feature columns
+BODY_CHARS = 2000  # leading body characters used; the lede says what a release is about
+MIN_EXAMPLES = 10  # categories with fewer labeled articles are not learned
+THRESHOLD = 0.8  # confidence needed to replace the LLM category
+EPOCHS = 300
+LEARNING_RATE = 0.05
+L2 = 1e-5
+SEED = 1
+
+def _text(value):
+    return '' if pd.isna(value) else str(value)
+
+def hashed_counts(titles, bodies=None):
+    """Sparse term counts of title words, title bigrams and leading body words."""
+    bodies = [None] * len(titles) if bodies is None else bodies
+    indptr, indices, data = [0], [], []
+    for title, body in zip(titles, bodies):
+        words = tokenize(_text(title))
+        terms = Counter(f't:{word}' for word in words)
+        terms.update(f't:{a} {b}' for a, b in zip(words, words[1:]))
+        terms.update(tokenize(_text(body)[:BODY_CHARS]))
+        columns = Counter()
+        for term, count in terms.items():
+            columns[zlib.crc32(term.encode('utf-8')) & (N_FEATURES - 1)] += count
+        indices.extend(columns)
+        data.extend(columns.values())
+        indptr.append(len(indices))
+    return sparse.csr_matrix((np.array(data, dtype=np.float32), indices, indptr),
+                             shape=(len(indptr) - 1, N_FEATURES))
+
+def tfidf(counts, idf):
+    """Sublinear TF-IDF rows scaled to unit length."""
+    X = counts.copy()
+    X.data = 1 + np.log(X.data)
+    X = X @ sparse.diags(idf)
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    return sparse.diags(1 / np.maximum(norms, 1e-12)) @ X
+
+def _sigmoid(z):
+    return 1 / (1 + np.exp(-np.clip(z, -30, 30)))
+
+class CategoryClassifier:
+    """Hashed TF-IDF features and one logistic regression per category."""
+
+    def __init__(self, classes=(), idf=None, weights=None, bias=None):
+        self.classes = list(classes)
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+
+    def features(self, titles, bodies=None):
+        return tfidf(hashed_counts(titles, bodies), self.idf).tocsr()
+
+    def fit(self, titles, bodies, masks, epochs=EPOCHS, learning_rate=LEARNING_RATE, l2=L2):
+        """Learn the categories with at least MIN_EXAMPLES articles from labeled rows."""
+        masks = np.asarray(masks, dtype=np.int64)
+        self.classes = [name for name, bit in BITS.items()
+                        if name != 'other' and ((masks & bit) != 0).sum() >= MIN_EXAMPLES]
+        Y = np.stack([(masks & BITS[name]) != 0 for name in self.classes], axis=1).astype(np.float32)
+
+        counts = hashed_counts(titles, bodies)
+        document_frequency = np.bincount(counts.indices, minlength=N_FEATURES)
+        self.idf = (np.log((1 + counts.shape[0]) / (1 + document_frequency)) + 1).astype(np.float32)
+        # Only the columns that occur in the training rows can get a weight
+        used = np.flatnonzero(document_frequency)
+        X = tfidf(counts, self.idf).tocsc()[:, used].tocsr()
+        XT = X.T.tocsr()
+
+        # Full-batch Adam on the mean log loss
+        n = X.shape[0]
+        W = np.zeros((len(used), len(self.classes)), dtype=np.float32)
+        b = np.log(Y.mean(axis=0) / (1 - Y.mean(axis=0))).astype(np.float32)
+        moments = [np.zeros_like(W), np.zeros_like(W), np.zeros_like(b), np.zeros_like(b)]
+        beta1, beta2 = 0.9, 0.999
+        for step in range(1, epochs + 1):
+            error = (_sigmoid(X @ W + b) - Y) / n
+            grad_W = XT @ error + l2 * W
+            grad_b = error.sum(axis=0)
+            for i, (param, grad) in enumerate(((W, grad_W), (b, grad_b))):
+                m, v = moments[2 * i], moments[2 * i + 1]
+                m *= beta1
+                m += (1 - beta1) * grad
+                v *= beta2
+                v += (1 - beta2) * grad * grad
+                param -= (learning_rate * (m / (1 - beta1 ** step))
+                          / (np.sqrt(v / (1 - beta2 ** step)) + 1e-8)).astype(np.float32)
+        self.weights = np.zeros((N_FEATURES, len(self.classes)), dtype=np.float32)
+        self.weights[used] = W
+        self.bias = b
+        return self
+
+    def predict_proba(self, titles, bodies=None):
+        """Probability of each class (columns in self.classes order) for each row."""
+        return _sigmoid(self.features(titles, bodies) @ self.weights + self.bias)
+
+    def predict(self, titles, bodies=None):
+        """Category masks and confidences of a batch of articles.
+
+        Every class with a probability of at least 0.5 is predicted, or the
+        most probable one if none is.
+        """
+        proba = self.predict_proba(titles, bodies)
+        chosen = proba >= 0.5
+        chosen[np.arange(len(proba)), proba.argmax(axis=1)] = True
+        bits = np.array([BITS[name] for name in self.classes], dtype=np.int64)
+        masks = (chosen * bits).sum(axis=1)
+        confidence = np.maximum(proba, 1 - proba).min(axis=1)
+        return masks, confidence
+
+    def save(self, path=MODEL_PATH):
+        """Save the model as a compressed .npz file."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.tmp.npz'
+        np.savez_compressed(tmp_path, classes=np.array(self.classes, dtype=str), idf=self.idf,
+                            weights=self.weights, bias=self.bias)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with np.load(path) as data:
+            return cls(data['classes'].tolist(), data['idf'], data['weights'], data['bias'])
+
+def route_categories(df, classifier, threshold=THRESHOLD):
+    """Replace the LLM category of the rows the model is confident about.
+
+    Adds category_confidence and category_source ('model' or 'llm'); rows
+    under the threshold keep their category.
+    """
+    df = df.copy()
+    masks, confidence = classifier.predict(df['title'], df.get('body'))
+    confident = confidence >= threshold
+    if 'category_mask' not in df.columns:
+        df['category_mask'] = category_masks(df['category'])
+    df['category_mask'] = np.where(confident, masks, df['category_mask'])
+    df['category'] = category_labels(df['category_mask'])
+    df['category_confidence'] = confidence.round(4)
+    df['category_source'] = np.where(confident, 'model', 'llm')
+    return df
+
+def load_labeled(files):
+    """Titles, bodies (when present) and category masks of labeled CSV files."""
+    frames = [pd.read_csv(path) for path in files]
+    df = pd.concat(frames, ignore_index=True)
+    df = df[df['category'].notna()].reset_index(drop=True)
+    bodies = df['body'] if 'body' in df.columns else None
+    return df['title'], bodies, category_masks(df['category']).to_numpy()
+
+def evaluate(classifier, titles, bodies, masks, threshold=THRESHOLD):
+    """Accuracy figures of a classifier on labeled rows."""
+    predicted, confidence = classifier.predict(titles, bodies)
+    masks = np.asarray(masks, dtype=np.int64)
+    learned = int(sum(BITS[name] for name in classifier.classes))
+    exact = predicted == (masks & learned)
+    confident = confidence >= threshold
+    report = {
+        'rows': len(masks),
+        'exact_match': float(exact.mean()),
+        'top_category_correct': float(((predicted & masks) != 0).mean()),
+        'confident_rows': float(confident.mean()),
+        'confident_exact_match': float(exact[confident].mean()) if confident.any() else None,
+        'categories': {},
+    }
+    for name in classifier.classes:
+        bit = BITS[name]
+        truth, guess = (masks & bit) != 0, (predicted & bit) != 0
+        tp = int((truth & guess).sum())
+        report['categories'][name] = {
+            'support': int(truth.sum()),
+            'precision': tp / guess.sum() if guess.any() else 0.0,
+            'recall': tp / truth.sum() if truth.any() else 0.0,
+        }
+    return report
+
+def print_report(report, threshold=THRESHOLD):
+    flush_logging()
+    print(f"Held-out rows: {report['rows']}")
+    print(f"  exact category set: {report['exact_match']:.1%}")
+    print(f"  a predicted category is right: {report['top_category_correct']:.1%}")
+    if report['confident_exact_match'] is not None:
+        print(f"  confidence >= {threshold}: {report['confident_rows']:.1%} of rows, "
+              f"{report['confident_exact_match']:.1%} exact")
+    print(f"\n  {'Category':<28} {'Support':>7} {'Precision':>9} {'Recall':>7}")
+    for name, scores in report['categories'].items():
+        print(f"  {name:<28} {scores['support']:>7} {scores['precision']:>9.2f} "
+              f"{scores['recall']:>7.2f}")
+
+def default_files():
+    """Cleaned bodies when available, otherwise the cleaned metadata (titles only)."""
+    return (sorted(glob.glob(os.path.join(DATA_DIR, 'output', '*_news_cleaned.csv')))
+            or sorted(glob.glob(os.path.join(DATA_DIR, 'clean', '*_news_cleaned.csv'))))
+
+def train(args):
+    titles, bodies, masks = load_labeled(args.files or default_files())
+    order = np.random.default_rng(SEED).permutation(len(titles))
+    test = order[:int(len(order) * args.test_size)]
+    train_rows = order[len(test):]
+
+    def rows(values, index):
+        return None if values is None else values.iloc[index].reset_index(drop=True)
+
+    if len(test):
+        started = time.perf_counter()
+        held_out = CategoryClassifier().fit(rows(titles, train_rows), rows(bodies, train_rows),
+                                            masks[train_rows])
+        logger.info(f"Trained on {len(train_rows)} rows in {time.perf_counter() - started:.1f}s")
+        print_report(evaluate(held_out, rows(titles, test), rows(bodies, test), masks[test],
+                              args.threshold), args.threshold)
+
+    classifier = CategoryClassifier().fit(titles, bodies, masks)
+    classifier.save(args.model)
+    logger.info(f"Model of {len(classifier.classes)} categories trained on all {len(titles)} rows "
+                f"saved to {args.model}")
+
+def classify(args):
+    classifier = CategoryClassifier.load(args.model)
+    for path in args.files:
+        df = pd.read_csv(path)
+        started = time.perf_counter()
+        routed = route_categories(df, classifier, args.threshold)
+        elapsed = time.perf_counter() - started
+        by_model = int((routed['category_source'] == 'model').sum())
+        logger.info(f"{path}: {len(df)} rows, {by_model} categorized by the model, "
+                    f"{len(df) - by_model} left to the LLM label "
+                    f"({elapsed / max(len(df), 1) * 1e6:.0f} µs/row)")
+        if args.apply:
+            tmp_path = f'{path}.tmp'
+            routed.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, path)
+
+def main():
+    """Train the category classifier or categorize articles with it"""
+    parser = argparse.ArgumentParser(description='Local article category classifier')
+    parser.add_argument('--model', default=MODEL_PATH, help='Model file')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='Confidence needed to use the model category instead of the LLM one')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help='Train on labeled articles')
+    train_parser.add_argument('files', nargs='*',
+                              help='Labeled CSV files (default: data/output, else data/clean)')
+    train_parser.add_argument('--test-size', type=float, default=0.2,
+                              help='Fraction of rows held out for the accuracy report')
+
+    classify_parser = subparsers.add_parser('classify', help='Categorize articles')
+    classify_parser.add_argument('files', nargs='+', help='CSV files with title (and body) columns')
+    classify_parser.add_argument('--apply', action='store_true',
+                                 help='Write the routed categories back to the files')
+
+    args = parser.parse_args()
+    setup_logging()
+    if args.command == 'train':
+        train(args)
+    else:
+        classify(args)
+
+if __name__ == "__main__":
+    main()
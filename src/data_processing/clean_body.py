@@ -1,108 +1,492 @@
+import argparse
+import hashlib
+import logging
+import os
+import sys
 import pandas as pd
 import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from bisect import bisect_right
+from itertools import accumulate, repeat
 
-def clean_press_release_text(text):
-    """Clean press release text by removing boilerplate and formatting"""
-    if pd.isna(text):
-        return text
-        
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processing.boilerplate import MODEL_PATH, BoilerplateModel, line_hash, site_key
+from data_processing.manifest import Manifest, merge_rows, row_hashes, row_keys
+from utils import metrics
+from utils.common import company_from_path, peak_rss_mb, setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Boilerplate patterns, compiled once. The passes below run in the same order as
+# the original sequence of re.sub calls because each one sees the previous output.
+PFIZER_LOGO_RE = re.compile(r'\[!\[Pfizer logo\].*?\]\(.*?\)')
+NAV_SECTION_RE = re.compile(r'##\s*\*\s*\[')
+SUBSCRIBE_PROMO_RE = re.compile(r'#{1,5}\s*Receive real-time updates')
+SEARCH_BOX = "What can we help you find? Search for: &gt;&gt;News release ##"
+
+OUTPUT_DIR = 'data/output'
+CHUNK_SIZE = 32  # rows per pool task
+STREAM_CHUNK_SIZE = 1000  # rows read at a time in streaming mode
+CLEANER_VERSION = 1  # bump when the cleaning changes so every body is recleaned
+
+# Lines containing any of these (case-insensitive) are dropped
+EXTRANEOUS_KEYWORDS = (
+    "skip to main content",
+    "select your country or region",
+    "all rights reserved",
+    "terms of use",
+    "privacy statement",
+    "accessibility statement",
+    "sitemap",
+    "copyright",
+    "follow us on",
+    "social media",
+    "facebook",
+    "twitter",
+    "linkedin",
+    "instagram",
+    "youtube",
+    "call(800)",
+    "investors",
+    "sources",
+    "suppliers",
+    "contact",
+    "diversity",
+    "menu",
+    "pdf version",
+    "search for",
+    "what can we help you find",
+    "hamburger",
+    "header close",
+    "changed",
+    "how can we help you",
+    "suggestions within pfizer.com",
+    "view pdf",
+    "copy to clipboard",
+    "open in tab",
+    "receive real-time updates",
+    "delivered directly to your inbox",
+    "visualized product pipeline",
+    "check out our new"
+)
+
+def _remove_nav_sections(text):
+    """Remove '## * [..]' navigation sections up to the next '##' or the end.
+
+    Same result as re.sub(r'##\s*\*\s*\[.*?\].*?(?=##|\Z)', '', text, flags=re.DOTALL)
+    without rescanning the rest of the text for every candidate header.
+    """
+    parts = []
+    pos = 0
+    while True:
+        match = NAV_SECTION_RE.search(text, pos)
+        if match is None:
+            break
+        close = text.find(']', match.end())
+        if close == -1:
+            break
+        end = text.find('##', close + 1)
+        if end == -1:
+            end = len(text)
+        parts.append(text[pos:match.start()])
+        pos = end
+    parts.append(text[pos:])
+    return ''.join(parts)
+
+def _remove_subscribe_promo(text):
+    """Remove the 'Receive real-time updates ... inbox. ... pipeline.' promotion."""
+    parts = []
+    pos = 0
+    while True:
+        match = SUBSCRIBE_PROMO_RE.search(text, pos)
+        if match is None:
+            break
+        inbox = text.find('inbox.', match.end())
+        if inbox == -1:
+            break
+        end = text.find('pipeline.', inbox + 6)
+        if end == -1:
+            break
+        parts.append(text[pos:match.start()])
+        pos = end + 9
+    parts.append(text[pos:])
+    return ''.join(parts)
+
+def _remove_links(text):
+    """Remove markdown links in one left-to-right scan.
+
+    Same result as re.sub(r"\[.*?\]\(.*?\)", "", text, flags=re.DOTALL): a link
+    runs from '[' to the first ')' after the first '](' that follows it.
+    """
+    parts = []
+    pos = 0
+    find = text.find
+    while True:
+        start = find('[', pos)
+        if start == -1:
+            break
+        middle = find('](', start + 1)
+        if middle == -1:
+            break
+        end = find(')', middle + 2)
+        if end == -1:
+            break
+        parts.append(text[pos:start])
+        pos = end + 1
+    parts.append(text[pos:])
+    return ''.join(parts)
+
+def _remove_enclosed(text, opening, closing):
+    """Remove text between delimiters, like a lazy DOTALL re.sub, in one scan."""
+    parts = []
+    pos = 0
+    find = text.find
+    while True:
+        start = find(opening, pos)
+        if start == -1:
+            break
+        end = find(closing, start + 1)
+        if end == -1:
+            break
+        parts.append(text[pos:start])
+        pos = end + 1
+    parts.append(text[pos:])
+    return ''.join(parts)
+
+def _extraneous_lines(text, lines):
+    """Indices of the lines that contain an extraneous keyword.
+
+    Each keyword is searched once over the whole lowercased text and hits are
+    mapped back to their line, instead of testing every keyword on every line.
+    """
+    lower = text.lower()
+    if len(lower) != len(text):
+        # A few characters lowercase to several, so offsets would not line up
+        return {i for i, line in enumerate(lines)
+                if any(keyword in line.lower() for keyword in EXTRANEOUS_KEYWORDS)}
+
+    starts = list(accumulate(map(len, lines), initial=0))
+    dropped = set()
+    find = lower.find
+    for keyword in EXTRANEOUS_KEYWORDS:
+        pos = find(keyword)
+        while pos != -1:
+            line_no = bisect_right(starts, pos) - 1
+            dropped.add(line_no)
+            pos = find(keyword, starts[line_no + 1])
+    return dropped
+
+def strip_markup(text):
+    """Remove links, bracketed text and the known Pfizer page furniture"""
     # Remove Pfizer logo and header
-    text = re.sub(r'\[!\[Pfizer logo\].*?\]\(.*?\)', '', text)
+    text = PFIZER_LOGO_RE.sub('', text)
     
     # Remove navigation sections with ## headers
-    text = re.sub(r'##\s*\*\s*\[.*?\].*?(?=##|\Z)', '', text, flags=re.DOTALL)
+    text = _remove_nav_sections(text)
     
     # Remove email subscription and pipeline promotion
-    text = re.sub(r'#{1,5}\s*Receive real-time updates.*?inbox\..*?pipeline\.', '', text, flags=re.DOTALL)
-    
-    # Remove markdown-style links
-    text = re.sub(r"\[.*?\]\(.*?\)", "", text, flags=re.DOTALL)
+    text = _remove_subscribe_promo(text)
     
-    # Remove leftover bracketed text
-    text = re.sub(r"\[.*?\]", "", text, flags=re.DOTALL)
-    
-    # Remove text in parentheses
-    text = re.sub(r"\(.*?\)", "", text, flags=re.DOTALL)
+    # Remove markdown-style links, leftover bracketed text and text in parentheses
+    text = _remove_links(text)
+    text = _remove_enclosed(text, '[', ']')
+    text = _remove_enclosed(text, '(', ')')
     
     # Remove search box pattern
-    text = re.sub(r"What can we help you find\? Search for: &gt;&gt;News release ##", "", text)
-    
-    # Split into lines for filtering
-    lines = text.splitlines()
-    
-    # Add Pfizer-specific patterns
-    extraneous_keywords = [
-        "skip to main content",
-        "select your country or region",
-        "all rights reserved",
-        "terms of use",
-        "privacy statement",
-        "accessibility statement",
-        "sitemap",
-        "copyright",
-        "follow us on",
-        "social media",
-        "facebook",
-        "twitter",
-        "linkedin",
-        "instagram",
-        "youtube",
-        "call(800)",
-        "investors",
-        "sources",
-        "suppliers",
-        "contact",
-        "diversity",
-        "menu",
-        "pdf version",
-        "search for",
-        "what can we help you find",
-        "hamburger",
-        "header close",
-        "changed",
-        "how can we help you",
-        "suggestions within pfizer.com",
-        "view pdf",
-        "copy to clipboard",
-        "open in tab",
-        "receive real-time updates",
-        "delivered directly to your inbox",
-        "visualized product pipeline",
-        "check out our new"
-    ]
-    
-    cleaned_lines = []
-    for line in lines:
-        lower_line = line.lower().strip()
-        if any(keyword in lower_line for keyword in extraneous_keywords):
-            continue
-        if line.strip():  # Only keep non-empty lines
-            cleaned_lines.append(line.strip())
-    
-    # Rejoin filtered lines
-    cleaned_text = "\n".join(cleaned_lines)
-    
-    # Clean up extra whitespace
-    cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
-    cleaned_text = cleaned_text.strip()
+    return text.replace(SEARCH_BOX, '')
+
+def body_lines(text):
+    """Lines of a body as seen by the line filter; used to learn boilerplate."""
+    return strip_markup(text).splitlines()
+
+def clean_press_release_text(text, template_lines=None):
+    """Clean press release text by removing boilerplate and formatting
+
+    Lines are dropped when they contain one of EXTRANEOUS_KEYWORDS, or, when
+    template_lines is given, when their hash is one of the site's template
+    lines learned by a BoilerplateModel.
+    """
+    if pd.isna(text):
+        return text
+        
+    text = strip_markup(text)
     
-    return cleaned_text
+    # Drop boilerplate lines, then collapse all whitespace
+    lines = text.splitlines(keepends=True)
+    if template_lines is None:
+        dropped = _extraneous_lines(text, lines)
+    else:
+        dropped = {i for i, line in enumerate(lines)
+                   if not line.isspace() and line_hash(line) in template_lines}
+    if dropped:
+        text = ' '.join([line for i, line in enumerate(lines) if i not in dropped])
+    return ' '.join(text.split())
+
+def learn_boilerplate(df, model):
+    """Add the bodies of a dataframe to a boilerplate model; returns new documents."""
+    added = 0
+    for url, body in zip(df['url'], df['body']):
+        if not pd.isna(body):
+            added += model.update(site_key(url), body_lines(body), url)
+    return added
 
-def process_file(file_path):
+def _clean_chunk(bodies, sites=None, templates=None):
+    """Clean a list of bodies; the unit of work sent to pool workers."""
+    if not templates:
+        return [clean_press_release_text(body) for body in bodies]
+    # Sites without learned templates fall back to the keyword filter
+    return [clean_press_release_text(body, templates.get(site) or None)
+            for body, site in zip(bodies, sites)]
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def clean_bodies(bodies, workers=1, chunk_size=CHUNK_SIZE, executor=None, urls=None,
+                 templates=None):
+    """Clean a sequence of bodies, in a process pool when workers > 1.
+
+    Bodies are sent to the workers as plain lists of strings in chunks of
+    chunk_size rows, and the results come back in the original order. With
+    templates (site -> template line hashes) the site of each row is taken
+    from urls.
+    """
+    bodies = list(bodies)
+    sites = [site_key(url) for url in urls] if templates else [None] * len(bodies)
+    if executor is None:
+        if workers <= 1 or len(bodies) <= chunk_size:
+            return _clean_chunk(bodies, sites, templates)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return clean_bodies(bodies, chunk_size=chunk_size, executor=executor, urls=urls,
+                                templates=templates)
+
+    cleaned = []
+    for chunk in executor.map(_clean_chunk, _chunks(bodies, chunk_size),
+                              _chunks(sites, chunk_size), repeat(templates)):
+        cleaned.extend(chunk)
+    return cleaned
+
+def process_file(file_path, workers=1, chunk_size=CHUNK_SIZE, templates=None):
     """Process a single file and clean its body content"""
     df = pd.read_csv(file_path)
     if 'body' in df.columns:
-        df['body'] = df['body'].apply(clean_press_release_text)
+        df['body'] = clean_bodies(df['body'], workers, chunk_size, urls=df['url'],
+                                  templates=templates)
     return df
 
-files = [
-    # 'data/processed/merck_news_cleaned.csv'
-    'data/processed/pfizer_news_cleaned.csv'
-]
+def save_cleaned(df, file_path, output_dir=OUTPUT_DIR, dataset=False):
+    """Write a cleaned dataframe under output_dir with the input's file name.
 
-for file_path in files:
-    print(f"Processing {file_path}")
-    df = process_file(file_path)
-    output_path = file_path.replace('data/processed', 'data/output')
+    With dataset, the rows also replace the company's partitions of the
+    output Parquet dataset.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, os.path.basename(file_path))
     df.to_csv(output_path, index=False)
-    print(f"Saved cleaned {output_path}")
+    if dataset:
+        from storage.parquet_store import write_articles
+        write_articles(df, 'output', company_from_path(file_path))
+    logger.info(f"Saved cleaned {output_path}")
+    return output_path
+
+def update_boilerplate(file_paths, model, chunksize=STREAM_CHUNK_SIZE):
+    """Learn boilerplate from the bodies of files not yet seen by the model."""
+    added = 0
+    for file_path in file_paths:
+        if 'body' not in pd.read_csv(file_path, nrows=0).columns:
+            continue
+        for chunk in pd.read_csv(file_path, usecols=['url', 'body'], chunksize=chunksize):
+            added += learn_boilerplate(chunk, model)
+    logger.info(f"Boilerplate model: {added} new documents, "
+                f"{sum(len(lines) for lines in model.templates().values())} template lines")
+    return added
+
+def stream_process_file(file_path, output_dir=OUTPUT_DIR, chunksize=STREAM_CHUNK_SIZE,
+                        workers=1, chunk_size=CHUNK_SIZE, executor=None, templates=None,
+                        dataset=False):
+    """Clean the bodies of a file chunk by chunk, appending to the output.
+
+    Only one chunk of rows is held in memory at a time, so peak memory depends
+    on the chunk size rather than on the size of the file.
+    """
+    if dataset:
+        from storage.parquet_store import write_articles
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, os.path.basename(file_path))
+    tmp_path = f'{output_path}.tmp'
+    summary = {'rows': 0, 'chunks': 0}
+
+    for chunk in pd.read_csv(file_path, chunksize=chunksize):
+        if 'body' in chunk.columns:
+            chunk['body'] = clean_bodies(chunk['body'], workers, chunk_size, executor,
+                                         urls=chunk['url'], templates=templates)
+        chunk.to_csv(tmp_path, mode='w' if summary['chunks'] == 0 else 'a',
+                     header=summary['chunks'] == 0, index=False)
+        if dataset:
+            write_articles(chunk, 'output', company_from_path(file_path),
+                           append=summary['chunks'] > 0)
+        summary['rows'] += len(chunk)
+        summary['chunks'] += 1
+
+    os.replace(tmp_path, output_path)
+    logger.info(f"Saved cleaned {output_path} ({summary['rows']} rows, {summary['chunks']} chunks)")
+    return output_path
+
+def cleaner_version(templates=None):
+    """Version recorded in the manifest, including the boilerplate templates in use."""
+    if templates is None:
+        return str(CLEANER_VERSION)
+    digest = hashlib.blake2b(digest_size=8)
+    for site in sorted(templates):
+        digest.update(site.encode('utf-8'))
+        digest.update(b''.join(h.to_bytes(8, 'little') for h in sorted(templates[site])))
+    return f'{CLEANER_VERSION}:{digest.hexdigest()}'
+
+def _changed_rows(df, file_path, output_dir, manifest, version):
+    """Rows whose body or cleaner changed, and what is needed to merge them back."""
+    df.index = keys = row_keys(df['url'])
+    hashes = row_hashes(df)
+    pending = manifest.pending('output', os.path.basename(file_path), keys, hashes, version)
+    output_path = os.path.join(output_dir, os.path.basename(file_path))
+    merge = os.path.exists(output_path) and not pending.all()
+    if not merge:
+        pending[:] = True
+    logger.info(f"{file_path}: {int(pending.sum())} of {len(df)} rows changed")
+    return df[pending], (keys, hashes, version, merge)
+
+def _save_changes(df, file_path, output_dir, dataset, manifest=None, change=None):
+    """Save cleaned rows, merged into the previous output when only some changed."""
+    if change is None:
+        return save_cleaned(df, file_path, output_dir, dataset)
+
+    keys, hashes, version, merge = change
+    if merge:
+        previous = pd.read_csv(os.path.join(output_dir, os.path.basename(file_path)))
+        previous.index = row_keys(previous['url'])
+        df = merge_rows(previous, df, keys)
+    else:
+        df = df.reset_index(drop=True)
+    output_path = save_cleaned(df, file_path, output_dir, dataset)
+    manifest.record('output', os.path.basename(file_path), keys, hashes, version)
+    return output_path
+
+def process_files(file_paths, output_dir=OUTPUT_DIR, workers=None, chunk_size=CHUNK_SIZE,
+                  stream_chunksize=None, boilerplate=None, dataset=False, manifest=None):
+    """Clean the bodies of several files at once on a shared process pool.
+
+    The chunks of every file are queued before any result is collected, so
+    small files do not leave workers idle while a large one is cleaned. With
+    stream_chunksize the files are instead read and written one chunk at a time.
+    With a BoilerplateModel, it first learns from the files' new documents and
+    its template lines replace the keyword filter. With dataset, the results
+    are also written to the output Parquet dataset. With a Manifest, outside
+    streaming mode, only rows whose content or cleaner version changed since
+    the last run are cleaned.
+    """
+    workers = workers or os.cpu_count()
+    templates = None
+    if boilerplate is not None:
+        update_boilerplate(file_paths, boilerplate, stream_chunksize or STREAM_CHUNK_SIZE)
+        templates = boilerplate.templates()
+
+    if stream_chunksize:
+        with ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as executor:
+            return [
+                stream_process_file(file_path, output_dir, stream_chunksize, workers,
+                                    chunk_size, executor, templates, dataset)
+                for file_path in file_paths
+            ]
+
+    version = cleaner_version(templates)
+
+    def load(file_path):
+        df = pd.read_csv(file_path)
+        if manifest is None or 'body' not in df.columns:
+            return df, None
+        return _changed_rows(df, file_path, output_dir, manifest, version)
+
+    cleaned = 0
+    if workers <= 1:
+        output_paths = []
+        for file_path in file_paths:
+            logger.info(f"Processing {file_path}")
+            df, change = load(file_path)
+            if 'body' in df.columns:
+                df['body'] = clean_bodies(df['body'], urls=df['url'], templates=templates)
+            output_paths.append(_save_changes(df, file_path, output_dir, dataset, manifest, change))
+            cleaned += len(df)
+        metrics.annotate(rows=cleaned)
+        return output_paths
+
+    frames = {file_path: load(file_path) for file_path in file_paths}
+    output_paths = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {
+            file_path: [executor.submit(_clean_chunk, bodies, sites, templates)
+                        for bodies, sites in zip(_chunks(df['body'].tolist(), chunk_size),
+                                                 _chunks(df['url'].map(site_key).tolist(),
+                                                         chunk_size))]
+            for file_path, (df, _) in frames.items() if 'body' in df.columns
+        }
+
+        for file_path, (df, change) in frames.items():
+            logger.info(f"Processing {file_path}")
+            if file_path in pending:
+                df['body'] = [body for future in pending[file_path] for body in future.result()]
+            output_paths.append(_save_changes(df, file_path, output_dir, dataset, manifest, change))
+            cleaned += len(df)
+
+    metrics.annotate(rows=cleaned)
+    return output_paths
+
+def main():
+    """Clean the bodies of the processed files into data/output"""
+    parser = argparse.ArgumentParser(description='Clean article bodies')
+    parser.add_argument('files', nargs='*', default=['data/processed/pfizer_news_cleaned.csv'],
+                        help='CSV files with a body column')
+    parser.add_argument('--output-dir', '-o', default=OUTPUT_DIR, help='Output directory')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count(),
+                        help='Worker processes (1 cleans in-process)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='Rows sent to a worker at a time')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read and write in chunks to bound memory use')
+    parser.add_argument('--chunksize', type=int, default=STREAM_CHUNK_SIZE,
+                        help='Rows read at a time in streaming mode')
+    parser.add_argument('--boilerplate', nargs='?', const=MODEL_PATH, metavar='MODEL',
+                        help='Strip lines learned as per-site boilerplate instead of '
+                             f'using the keyword list (model file, default {MODEL_PATH})')
+    parser.add_argument('--boilerplate-threshold', type=float,
+                        help='Fraction of a site\'s documents a line must appear in')
+    parser.add_argument('--no-dataset', action='store_true',
+                        help='Only write CSV files, not the Parquet dataset')
+    parser.add_argument('--full', action='store_true',
+                        help='Reclean every body instead of only those changed since the last run')
+    args = parser.parse_args()
+    setup_logging()
+
+    model = None
+    if args.boilerplate:
+        model = BoilerplateModel.load(args.boilerplate, args.boilerplate_threshold)
+
+    with Manifest() as manifest:
+        if args.full:
+            manifest.clear('output')
+        process_files(args.files, args.output_dir, args.workers, args.chunk_size,
+                      args.chunksize if args.stream else None, model, not args.no_dataset,
+                      manifest)
+
+    if model is not None:
+        model.save(args.boilerplate)
+        logger.info(f"Saved boilerplate model to {args.boilerplate}")
+
+    peak = peak_rss_mb()
+    if peak is not None:
+        logger.info(f"Peak RSS: {peak:.1f} MB")
+
+if __name__ == "__main__":
+    main()
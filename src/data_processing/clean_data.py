@@ -1,62 +1,175 @@
+import argparse
+import logging
+import os
+import sys
 import pandas as pd
-from datetime import datetime
-import numpy as np
+from collections import Counter
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processing.manifest import Manifest, merge_rows, row_hashes, row_keys
+from data_processing.taxonomy import category_labels, category_masks, table_version
+from utils.common import parse_date, parse_dates, peak_rss_mb, setup_logging
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 10000  # rows per chunk in streaming mode
+CLEANER_VERSION = 2  # bump when the cleaning changes so every row is recleaned
+
+# Raw snapshot cleaned for each company
+RAW_FILES = {
+    'lilly': 'data/raw/lilly/lilly_news_20250101_113822_latest.csv',
+    'merck': 'data/raw/merck/merck_news_20241231_160018.csv',
+    'pfizer': 'data/raw/pfizer/pfizer_news_20241231_221326_latest.csv',
+}
+CLEAN_DIR = 'data/clean'
+
+def cleaner_version():
+    """Version recorded in the manifest, including the category taxonomy tables."""
+    return f'{CLEANER_VERSION}:{table_version()}'
 
 def clean_date(date_str):
     """Convert various date formats to datetime"""
-    if pd.isna(date_str):
-        return None
-    
-    # Handle 'Month DD, YYYY' format
-    try:
-        return pd.to_datetime(date_str)
-    except:
-        try:
-            # Try parsing with various formats
-            formats = [
-                '%B %d, %Y',  # e.g. "November 30, 2022"
-                '%Y-%m-%dT%H:%M:%S',  # e.g. "2024-12-20T00:00:00"
-                '%Y-%m-%d'  # e.g. "2024-12-20"
-            ]
-            
-            for fmt in formats:
-                try:
-                    return datetime.strptime(date_str, fmt)
-                except:
-                    continue
-                    
-            return None
-        except:
-            return None
-
-def clean_news_data(file_path):
+    return parse_date(date_str)
+
+def clean_news_data(file_path, date_stats=None):
     """Clean and standardize news data"""
     # Read CSV file
     df = pd.read_csv(file_path)
-    
+    return clean_news_df(df, date_stats)
+
+def clean_news_df(df, date_stats=None):
+    """Clean and standardize a dataframe of scraped news
+
+    If date_stats is a Counter, it is updated with how many rows each date
+    format matched.
+    """
     # Convert dates to datetime
-    df['date'] = df['date'].apply(clean_date)
+    df['date'], formats = parse_dates(df['date'])
+    if date_stats is not None:
+        date_stats.update(formats)
     
     # Filter for dates from 2019 onwards
     df = df[df['date'].dt.year >= 2019]
     
-    # Convert category to lowercase if it exists
+    # Map the free-text category onto the canonical taxonomy, kept as a bitmask too
     if 'category' in df.columns:
-        df['category'] = df['category'].str.lower()
+        df['category_mask'] = category_masks(df['category'])
+        df['category'] = category_labels(df['category_mask'])
     elif 'tags' in df.columns:
         df['tags'] = df['tags'].str.lower()
     
     return df
 
-# Clean each file
-lilly_df = clean_news_data('data/raw/lilly/lilly_news_20250101_113822_latest.csv')
-merck_df = clean_news_data('data/raw/merck/merck_news_20241231_160018.csv')
-pfizer_df = clean_news_data('data/raw/pfizer/pfizer_news_20241231_221326_latest.csv')
+def normalize_columns(df):
+    """Align column names across companies (Merck has tags and an excerpt)"""
+    df = df.drop(columns=['excerpt'], errors='ignore')
+    if 'category' not in df.columns:
+        df = df.rename(columns={'tags': 'category'})
+    return df
+
+def clean_articles(articles):
+    """Clean a list of freshly scraped article dicts"""
+    return clean_news_df(normalize_columns(pd.DataFrame(articles)))
+
+def incremental_clean_news_data(file_path, output_path, manifest, scope, date_stats=None):
+    """Clean only the raw rows that changed since the last run into output_path.
+
+    Rows whose content hash and cleaner version match the manifest are taken
+    from the previous output instead of being recleaned. Returns the merged
+    dataframe and the number of rows cleaned.
+    """
+    df = normalize_columns(pd.read_csv(file_path))
+    df.index = keys = row_keys(df['url'])
+    hashes = row_hashes(df)
+    pending = manifest.pending('clean', scope, keys, hashes, cleaner_version())
+    if not os.path.exists(output_path):
+        pending[:] = True
+
+    cleaned = clean_news_df(df[pending], date_stats)
+    if pending.all():
+        merged = cleaned.reset_index(drop=True)
+    else:
+        previous = pd.read_csv(output_path, parse_dates=['date'])
+        previous.index = row_keys(previous['url'])
+        merged = merge_rows(previous, cleaned, keys)
+
+    tmp_path = f'{output_path}.tmp'
+    merged.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output_path)
+    manifest.record('clean', scope, keys, hashes, cleaner_version())
+    return merged, int(pending.sum())
+
+def stream_clean_news_data(file_path, output_path, chunksize=CHUNK_SIZE, date_stats=None,
+                           company=None):
+    """Clean a CSV chunk by chunk, appending each chunk to output_path.
+
+    Only one chunk is held in memory at a time, so peak memory depends on the
+    chunk size rather than on the size of the file. With a company, each chunk
+    is also written to the clean Parquet dataset.
+    """
+    if company is not None:
+        from storage.parquet_store import write_articles
+
+    tmp_path = f'{output_path}.tmp'
+    summary = {'rows_in': 0, 'rows_out': 0, 'chunks': 0}
+
+    for chunk in pd.read_csv(file_path, chunksize=chunksize):
+        summary['rows_in'] += len(chunk)
+        chunk = clean_news_df(normalize_columns(chunk), date_stats)
+        chunk.to_csv(tmp_path, mode='w' if summary['chunks'] == 0 else 'a',
+                     header=summary['chunks'] == 0, index=False)
+        if company is not None:
+            write_articles(chunk, 'clean', company, append=summary['chunks'] > 0)
+        summary['rows_out'] += len(chunk)
+        summary['chunks'] += 1
+
+    os.replace(tmp_path, output_path)
+    return summary
+
+def main():
+    """Clean the raw snapshots into data/clean"""
+    parser = argparse.ArgumentParser(description='Clean raw news snapshots')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read and write in chunks to bound memory use')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE,
+                        help='Rows per chunk in streaming mode')
+    parser.add_argument('--no-dataset', action='store_true',
+                        help='Only write CSV files, not the Parquet dataset')
+    parser.add_argument('--full', action='store_true',
+                        help='Reclean every row instead of only those changed since the last run')
+    args = parser.parse_args()
+    setup_logging()
+
+    if not args.no_dataset:
+        from storage.parquet_store import write_articles
+    manifest = Manifest()
+    if args.full:
+        manifest.clear('clean')
+
+    os.makedirs(CLEAN_DIR, exist_ok=True)
+    for company, file_path in RAW_FILES.items():
+        output_path = os.path.join(CLEAN_DIR, f'{company}_news_cleaned.csv')
+        date_stats = Counter()
+        if args.stream:
+            summary = stream_clean_news_data(file_path, output_path, args.chunksize, date_stats,
+                                             None if args.no_dataset else company)
+            logger.info(f"{company}: {summary['rows_in']} rows in, {summary['rows_out']} rows out, "
+                        f"{summary['chunks']} chunks")
+        else:
+            df, cleaned = incremental_clean_news_data(file_path, output_path, manifest, company,
+                                                      date_stats)
+            if cleaned and not args.no_dataset:
+                write_articles(df, 'clean', company)
+            logger.info(f"{company}: {len(df)} rows, {cleaned} recleaned")
+        logger.info(f"  date formats: {dict(date_stats.most_common())}")
+
+    manifest.close()
 
-# Save cleaned files
-merck_df = merck_df.drop('excerpt', axis=1)
-merck_df = merck_df.rename(columns={'tags': 'category'})
+    peak = peak_rss_mb()
+    if peak is not None:
+        logger.info(f"Peak RSS: {peak:.1f} MB")
 
-lilly_df.to_csv('data/clean/lilly_news_cleaned.csv', index=False)
-merck_df.to_csv('data/clean/merck_news_cleaned.csv', index=False)
-pfizer_df.to_csv('data/clean/pfizer_news_cleaned.csv', index=False)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
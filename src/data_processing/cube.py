@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+"""
+Dense company x period x category cube of article counts.
+
+Built in one vectorized pass from counts by company, month and category mask
+(the statistics state), so new questions are array slices instead of another
+groupby over every article:
+
+    cube = load_cubes()['all']
+    cube.rollup('Q').top(3, per='period')                  # top categories by quarter
+    cube.rollup('Y').share('company', 'period')            # category share by company per year
+    cube.select(categories=['regulatory approval']).counts('period')   # approvals per month
+
+`counts` sums category memberships, so an article with two categories counts
+in both; `articles` counts every article once. Cubes come in two scopes like
+the statistics state: 'all' counts a near-duplicate cluster once overall,
+'company' once per company. Articles without a date are not in the cube.
+
+    python src/data_processing/cube.py --freq Q --top 3 --per period
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processing.taxonomy import CATEGORIES
+from utils.common import DATA_DIR, ensure_directory
+
+CUBE_PATH = os.path.join(DATA_DIR, 'stats', 'category_cube.npz')
+AXES = ('company', 'period', 'category')
+SCOPES = ('all', 'company')
+
+def _period_labels(month_numbers, freq):
+    """'YYYY-MM', 'YYYY-Qn' or 'YYYY' label of months counted from year 0."""
+    years, months = np.divmod(month_numbers, 12)
+    if freq == 'M':
+        return [f'{y:04d}-{m + 1:02d}' for y, m in zip(years, months)]
+    if freq == 'Q':
+        return [f'{y:04d}-Q{m // 3 + 1}' for y, m in zip(years, months)]
+    return [f'{y:04d}' for y in years]
+
+class CategoryCube:
+    """Article counts on dense company, period and category axes."""
+
+    def __init__(self, companies, periods, counts, articles, freq='M', categories=CATEGORIES):
+        self.companies = [str(company) for company in companies]
+        self.periods = [str(period) for period in periods]
+        self.categories = [str(category) for category in categories]
+        self.counts_array = np.asarray(counts, dtype=np.int64)  # [company, period, category]
+        self.articles_array = np.asarray(articles, dtype=np.int64)  # [company, period]
+        self.freq = freq
+
+    @classmethod
+    def from_counts(cls, counts, companies=()):
+        """Cube from rows of company, month ('YYYY-MM'), category_mask and n.
+
+        Companies are listed first in the given order, then any others alphabetically.
+        """
+        counts = counts[counts['month'].astype(str).str.len() == 7]
+        companies = list(companies) + sorted(set(counts['company']) - set(companies))
+        company_index = pd.Index(companies).get_indexer(counts['company'])
+
+        month_numbers = (counts['month'].str[:4].astype(int) * 12
+                         + counts['month'].str[5:7].astype(int) - 1).to_numpy()
+        first = month_numbers.min() if len(month_numbers) else 0
+        n_months = month_numbers.max() - first + 1 if len(month_numbers) else 0
+        month_index = month_numbers - first
+
+        masks = counts['category_mask'].to_numpy(dtype=np.int64)
+        n = counts['n'].to_numpy(dtype=np.int64)
+        bits = (masks[:, None] >> np.arange(len(CATEGORIES))) & 1
+
+        cube_counts = np.zeros((len(companies), n_months, len(CATEGORIES)), dtype=np.int64)
+        cube_articles = np.zeros((len(companies), n_months), dtype=np.int64)
+        np.add.at(cube_counts, (company_index, month_index), bits * n[:, None])
+        np.add.at(cube_articles, (company_index, month_index), n)
+        periods = _period_labels(np.arange(first, first + n_months), 'M')
+        return cls(companies, periods, cube_counts, cube_articles)
+
+    def _axis_labels(self, axis):
+        return {'company': self.companies, 'period': self.periods,
+                'category': self.categories}[axis]
+
+    def select(self, companies=None, start=None, end=None, categories=None):
+        """Sub-cube of some companies, periods from start to end (inclusive) and categories.
+
+        Periods compare as labels, so start and end take the cube's format:
+        '2024-01', '2024-Q1' or '2024'.
+        """
+        companies_kept = np.isin(self.companies, companies) if companies else \
+            np.ones(len(self.companies), dtype=bool)
+        periods = np.asarray(self.periods, dtype=str)
+        periods_kept = np.ones(len(periods), dtype=bool)
+        if start:
+            periods_kept &= periods >= start
+        if end:
+            periods_kept &= periods <= end
+        categories_kept = np.isin(self.categories, categories) if categories else \
+            np.ones(len(self.categories), dtype=bool)
+
+        counts = self.counts_array[companies_kept][:, periods_kept][:, :, categories_kept]
+        articles = self.articles_array[companies_kept][:, periods_kept]
+        return CategoryCube(np.asarray(self.companies)[companies_kept], periods[periods_kept],
+                            counts, articles, self.freq,
+                            np.asarray(self.categories)[categories_kept])
+
+    def rollup(self, freq):
+        """The cube with periods rolled up to quarters ('Q') or years ('Y')."""
+        if freq == self.freq:
+            return self
+        if self.freq != 'M':
+            raise ValueError(f"Can only roll up a monthly cube, this one is {self.freq}")
+        if freq not in ('Q', 'Y'):
+            raise ValueError(f"Unknown period {freq!r}, expected 'Q' or 'Y'")
+        if not self.periods:
+            return CategoryCube(self.companies, [], self.counts_array, self.articles_array, freq,
+                                self.categories)
+        months = np.array([int(p[:4]) * 12 + int(p[5:7]) - 1 for p in self.periods])
+        labels = np.asarray(_period_labels(months, freq))
+        # Months are contiguous, so each period is one run along the axis
+        starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+        return CategoryCube(self.companies, labels[starts],
+                            np.add.reduceat(self.counts_array, starts, axis=1),
+                            np.add.reduceat(self.articles_array, starts, axis=1), freq,
+                            self.categories)
+
+    def counts(self, *by):
+        """Category memberships summed over every axis not in by; an int without by,
+        else a Series indexed by the by axes (in cube order)."""
+        by = [axis for axis in AXES if axis in by]
+        summed = self.counts_array.sum(axis=tuple(i for i, axis in enumerate(AXES)
+                                                  if axis not in by))
+        return self._labelled(summed, by)
+
+    def articles(self, *by):
+        """Articles summed over company and/or period, each article counted once."""
+        if 'category' in by:
+            raise ValueError("Articles are not split by category, use counts()")
+        by = [axis for axis in AXES[:2] if axis in by]
+        summed = self.articles_array.sum(axis=tuple(i for i, axis in enumerate(AXES[:2])
+                                                    if axis not in by))
+        return self._labelled(summed, by)
+
+    def _labelled(self, values, by):
+        if not by:
+            return int(values)
+        index = pd.MultiIndex.from_product([self._axis_labels(axis) for axis in by], names=by) \
+            if len(by) > 1 else pd.Index(self._axis_labels(by[0]), name=by[0])
+        return pd.Series(values.ravel(), index=index)
+
+    def top(self, k=5, per=None):
+        """Largest categories (k=None for all), overall or per company or period.
+
+        Returns {category: count}, or {label: {category: count}} with per; ties
+        keep taxonomy order and empty categories are left out.
+        """
+        def largest(values):
+            order = np.argsort(-values, kind='stable')[:k]
+            return {self.categories[i]: int(values[i]) for i in order if values[i]}
+
+        if per is None:
+            return largest(self.counts_array.sum(axis=(0, 1)))
+        table = self.table(per)
+        return {label: largest(row) for label, row in zip(table.index, table.to_numpy())}
+
+    def table(self, *by):
+        """Category counts with one row per company and/or period, one column per category."""
+        by = [axis for axis in AXES[:2] if axis in by]
+        if not by:
+            raise ValueError("table() needs 'company' and/or 'period'")
+        summed = self.counts_array.sum(axis=tuple(i for i, axis in enumerate(AXES[:2])
+                                                  if axis not in by))
+        index = self.articles(*by).index
+        return pd.DataFrame(summed.reshape(len(index), -1), index=index, columns=self.categories)
+
+    def share(self, *by):
+        """Share of the articles of each group (by company and/or period) in every category."""
+        return self.table(*by).div(self.articles(*by).replace(0, np.nan), axis=0)
+
+    def _arrays(self, prefix):
+        return {f'{prefix}companies': np.array(self.companies, dtype=str),
+                f'{prefix}periods': np.array(self.periods, dtype=str),
+                f'{prefix}categories': np.array(self.categories, dtype=str),
+                f'{prefix}freq': np.array(self.freq),
+                f'{prefix}counts': self.counts_array,
+                f'{prefix}articles': self.articles_array}
+
+    @classmethod
+    def _from_arrays(cls, data, prefix):
+        return cls(data[f'{prefix}companies'].tolist(), data[f'{prefix}periods'].tolist(),
+                   data[f'{prefix}counts'], data[f'{prefix}articles'],
+                   str(data[f'{prefix}freq']), data[f'{prefix}categories'].tolist())
+
+def save_cubes(cubes, path=CUBE_PATH):
+    """Save the cube of every scope in one .npz file."""
+    ensure_directory(os.path.dirname(path))
+    arrays = {}
+    for scope, cube in cubes.items():
+        arrays.update(cube._arrays(f'{scope}_'))
+    tmp_path = f'{path}.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+def load_cubes(path=CUBE_PATH):
+    """Cubes by scope, as saved by save_cubes."""
+    with np.load(path) as data:
+        return {scope: CategoryCube._from_arrays(data, f'{scope}_') for scope in SCOPES
+                if f'{scope}_counts' in data}
+
+def query(args):
+    """Print the answer to a query of the saved cube, from parsed --scope, --freq,
+    --company, --category, --since, --until, --top, --per and --share arguments."""
+    if not os.path.exists(CUBE_PATH):
+        sys.exit(f"No cube at {CUBE_PATH}, run generate_stats.py first")
+    cube = load_cubes()[args.scope].rollup(args.freq or 'M').select(
+        args.company, args.since, args.until, args.category)
+
+    pd.set_option('display.width', 200)
+    if args.top:
+        result = cube.top(args.top, args.per)
+        if args.per:
+            for label, top in result.items():
+                print(f"{label}: {top}")
+        else:
+            print(result)
+    elif args.share:
+        print(cube.share(*([args.per] if args.per else ['company'])).round(3).to_string())
+    elif args.per:
+        print(cube.table(args.per).to_string())
+    else:
+        print(cube.counts('category').to_string())
+
+def main():
+    """Query the saved category cube"""
+    parser = argparse.ArgumentParser(description='Query the company x period x category cube')
+    parser.add_argument('--scope', choices=SCOPES, default='all',
+                        help="Count duplicates once overall ('all') or per company")
+    parser.add_argument('--freq', choices=['M', 'Q', 'Y'], default='M', help='Period length')
+    parser.add_argument('-c', '--company', action='append', help='Only this company (repeatable)')
+    parser.add_argument('--category', action='append', help='Only this category (repeatable)')
+    parser.add_argument('--since', help='First period, e.g. 2023-01, 2023-Q1 or 2023')
+    parser.add_argument('--until', help='Last period')
+    parser.add_argument('--top', type=int, metavar='K', help='Top K categories')
+    parser.add_argument('--per', choices=['company', 'period'], help='Group --top or --share by')
+    parser.add_argument('--share', action='store_true', help='Category share of the articles')
+    query(parser.parse_args())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+"""
+Near-duplicate detection for article bodies with MinHash and LSH.
+
+Bodies are split into overlapping 5-word shingles, and each document gets a
+MinHash signature of 128 values computed in one NumPy expression. Signatures
+are cut into 16 bands of 8 rows; documents that share any band are candidates
+and become duplicates when the fraction of equal signature values, an
+estimate of their Jaccard similarity, reaches the threshold, they were
+published within two weeks of each other and their titles share at least half
+of their words and name the same numbers. The last checks keep apart recurring
+announcements such as conference invitations, supply deals and tender offer
+extensions. Duplicates are grouped into clusters named after their
+earliest article.
+
+Failed fetches return the site's chrome instead of the release ("Learn about
+SARS-CoV-2..." on Pfizer's COVID-19 pages), which makes unrelated releases
+look identical. Before shingling, the sentences that recur across a site's
+articles are removed, using a BoilerplateModel learned over sentences of the
+indexed files; bodies left empty are not indexed. Articles whose remaining body
+is shared verbatim by SHARED_BODY_DOCS or more articles are only duplicates
+when their titles have the same words.
+
+Signatures are saved with the index, so adding articles only shingles and
+signs the new ones; a site whose boilerplate changes is signed again. Run on
+the cleaned bodies:
+
+    python src/data_processing/dedup.py data/output/*.csv
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processing.boilerplate import BoilerplateModel, line_hash, site_key
+from utils.common import DATA_DIR, canonical_url, setup_logging
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_SIZE = 5  # words per shingle
+NUM_PERM = 128  # values per signature
+BANDS = 16  # LSH bands of NUM_PERM // BANDS rows each
+THRESHOLD = 0.8  # estimated Jaccard similarity of duplicates
+MAX_DAYS = 14  # duplicates are published within this many days of each other
+TITLE_THRESHOLD = 0.5  # Jaccard similarity of the title words of duplicates
+TEMPLATE_THRESHOLD = 0.05  # fraction of a site's articles a boilerplate sentence occurs in
+SHARED_BODY_DOCS = 3  # articles sharing one body verbatim are chrome, matched on title only
+SEED = 1
+INDEX_PATH = os.path.join(DATA_DIR, 'models', 'minhash.npz')
+
+TOKEN_RE = re.compile(r'\w+')
+SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+SHINGLE_BASE = np.uint64(1099511628211)  # odd multiplier combining word hashes
+
+def title_words(title):
+    """Set of lowercased words of a title."""
+    return frozenset(TOKEN_RE.findall(str(title).lower())) if pd.notna(title) else frozenset()
+
+def body_sentences(text):
+    """Sentences of a cleaned body, the units boilerplate is learned and removed in."""
+    return [sentence for sentence in SENTENCE_RE.split(str(text)) if sentence.strip()]
+
+def learn_templates(urls, texts, threshold=TEMPLATE_THRESHOLD):
+    """Hashes of the sentences that recur across a site's articles, for every site seen."""
+    model = BoilerplateModel(threshold)
+    for url, text in zip(urls, texts):
+        if pd.notna(text):
+            model.update(site_key(url), body_sentences(text))
+    return model.templates()
+
+def shingle_hashes(text, k=SHINGLE_SIZE):
+    """Distinct 64-bit hashes of the k-word shingles of a text."""
+    words = TOKEN_RE.findall(str(text).lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words),
+                         dtype=np.uint64, count=len(words))
+    k = min(k, len(words))
+    powers = SHINGLE_BASE ** np.arange(k - 1, -1, -1, dtype=np.uint64)
+    windows = np.lib.stride_tricks.sliding_window_view(hashes, k)
+    return np.unique((windows * powers).sum(axis=1, dtype=np.uint64))
+
+class DedupIndex:
+    """MinHash signatures of every article added so far, keyed by canonical URL."""
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS, threshold=THRESHOLD, seed=SEED):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.threshold = threshold
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hash functions; the multipliers must be odd
+        self._a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+        self.keys = []
+        self.signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self.dates = np.empty(0, dtype='datetime64[D]')
+        self.titles = []
+        self.body_hashes = np.empty(0, dtype=np.uint64)  # of the bodies without boilerplate
+        self.templates = {}  # site -> hashes of the boilerplate sentences
+        self._positions = {}
+        self._clusters = None
+
+    def signature(self, text):
+        """MinHash signature of a text, or None if it has no words."""
+        shingles = shingle_hashes(text)
+        if not len(shingles):
+            return None
+        hashed = (self._a[:, None] * shingles[None, :] + self._b[:, None]) >> np.uint64(32)
+        return hashed.min(axis=1).astype(np.uint32)
+
+    def strip_boilerplate(self, url, text):
+        """Text without the sentences that are boilerplate on the article's site."""
+        templates = self.templates.get(site_key(url))
+        if not templates:
+            return str(text)
+        return ' '.join(sentence for sentence in body_sentences(text)
+                        if line_hash(sentence) not in templates)
+
+    def set_templates(self, templates):
+        """Use newly learned boilerplate of some sites, dropping the articles of those whose
+        boilerplate changed so that they are signed again; returns how many were dropped."""
+        changed = {site for site, lines in templates.items()
+                   if lines != self.templates.get(site, frozenset())}
+        self.templates = {site: lines for site, lines in {**self.templates, **templates}.items()
+                          if lines}
+        kept = [i for i, key in enumerate(self.keys) if site_key(key) not in changed]
+        dropped = len(self.keys) - len(kept)
+        if dropped:
+            self.keys = [self.keys[i] for i in kept]
+            self.signatures = self.signatures[kept]
+            self.dates = self.dates[kept]
+            self.titles = [self.titles[i] for i in kept]
+            self.body_hashes = self.body_hashes[kept]
+            self._positions = {key: i for i, key in enumerate(self.keys)}
+            self._clusters = None
+        return dropped
+
+    def add(self, urls, texts, dates=None, titles=None):
+        """Sign the articles not in the index yet; returns how many were added."""
+        dates = [None] * len(urls) if dates is None else list(dates)
+        titles = [None] * len(urls) if titles is None else list(titles)
+        keys, signatures, new_dates, new_titles, new_hashes = [], [], [], [], []
+        for url, text, date, title in zip(urls, texts, dates, titles):
+            key = canonical_url(url)
+            if key in self._positions or pd.isna(text):
+                continue
+            body = self.strip_boilerplate(url, text)
+            signature = self.signature(body)
+            if signature is None:
+                continue
+            self._positions[key] = len(self.keys) + len(keys)
+            keys.append(key)
+            signatures.append(signature)
+            new_dates.append(np.datetime64(pd.Timestamp(date).date()) if pd.notna(date)
+                             else np.datetime64('NaT'))
+            new_titles.append('' if pd.isna(title) else str(title))
+            new_hashes.append(line_hash(body))
+
+        if keys:
+            self.keys.extend(keys)
+            self.signatures = np.vstack([self.signatures, np.array(signatures)])
+            self.dates = np.concatenate([self.dates, np.array(new_dates, dtype='datetime64[D]')])
+            self.titles.extend(new_titles)
+            self.body_hashes = np.concatenate([self.body_hashes,
+                                               np.array(new_hashes, dtype=np.uint64)])
+            self._clusters = None
+        return len(keys)
+
+    def similarity(self, i, j):
+        """Estimated Jaccard similarity of two indexed articles."""
+        return float(np.mean(self.signatures[i] == self.signatures[j]))
+
+    def _related(self, i, j, words, shared):
+        """Date and title checks of a pair whose bodies are similar."""
+        days = abs(self.dates[i] - self.dates[j])
+        if not np.isnat(days) and days.astype(int) > MAX_DAYS:
+            return False
+        a, b = words[i], words[j]
+        if shared[i] or shared[j]:
+            # A body many articles share says nothing about the pair, only the title does
+            return bool(a) and a == b
+        if {word for word in a if word.isdigit()} != {word for word in b if word.isdigit()}:
+            return False  # "30 million doses" and "600 million doses" are different deals
+        return not (a and b) or len(a & b) / len(a | b) >= TITLE_THRESHOLD
+
+    def _candidate_groups(self):
+        """Row indices sharing a band, one array per bucket with more than one member."""
+        rows = self.num_perm // self.bands
+        banded = self.signatures.reshape(len(self.keys), self.bands, rows)
+        for band in range(self.bands):
+            _, inverse, counts = np.unique(banded[:, band, :], axis=0, return_inverse=True,
+                                           return_counts=True)
+            inverse = inverse.ravel()
+            order = np.argsort(inverse, kind='stable')
+            bounds = np.cumsum(counts)[:-1]
+            for group, count in zip(np.split(order, bounds), counts):
+                if count > 1:
+                    yield group
+
+    def clusters(self):
+        """Map of every indexed canonical URL to the URL of its cluster's earliest article."""
+        if self._clusters is not None:
+            return self._clusters
+
+        parent = list(range(len(self.keys)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        words = [title_words(title) for title in self.titles]
+        _, inverse, counts = np.unique(self.body_hashes, return_inverse=True, return_counts=True)
+        shared = counts[inverse.ravel()] >= SHARED_BODY_DOCS
+        failed = set()  # similar pairs that failed the date or title check in another band
+        seen = set()  # buckets with the same members come up in several bands
+        for group in self._candidate_groups():
+            if group.tobytes() in seen:
+                continue
+            seen.add(group.tobytes())
+            # Members are compared with the first; those that fail are compared among
+            # themselves next, so one outlier at the head does not keep its copies apart
+            while len(group) > 1:
+                first, rest = group[0], group[1:]
+                similar = np.mean(self.signatures[rest] == self.signatures[first],
+                                  axis=1) >= self.threshold
+                linked = np.zeros(len(rest), dtype=bool)
+                for n in np.flatnonzero(similar):
+                    other = rest[n]
+                    if find(other) == find(first):
+                        linked[n] = True
+                    elif (first, other) not in failed:
+                        if self._related(first, other, words, shared):
+                            linked[n] = True
+                            parent[find(other)] = find(first)
+                        else:
+                            failed.add((first, other))
+                group = rest[~linked]
+
+        # Name each cluster after its earliest article (undated ones sort last)
+        roots = np.array([find(i) for i in range(len(self.keys))], dtype=np.int64)
+        days = self.dates.astype('int64')
+        days[np.isnat(self.dates)] = np.iinfo(np.int64).max
+        representative = {}
+        for i in np.lexsort((np.arange(len(roots)), days)):
+            representative.setdefault(roots[i], self.keys[i])
+        self._clusters = {key: representative[root] for key, root in zip(self.keys, roots)}
+        return self._clusters
+
+    def cluster_column(self, urls):
+        """dup_cluster values for a column of URLs; articles not indexed are their own cluster."""
+        clusters = self.clusters()
+        return pd.Series([clusters.get(canonical_url(url), canonical_url(url)) for url in urls],
+                         index=urls.index if isinstance(urls, pd.Series) else None)
+
+    def save(self, path=INDEX_PATH):
+        """Save the keys, signatures and dates in an .npz file."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        meta = {'num_perm': self.num_perm, 'bands': self.bands, 'threshold': self.threshold,
+                'seed': self.seed}
+        tmp_path = f'{path}.tmp.npz'
+        np.savez_compressed(tmp_path, meta=np.array(json.dumps(meta)),
+                            keys=np.array(self.keys, dtype=str), signatures=self.signatures,
+                            dates=self.dates, titles=np.array(self.titles, dtype=str),
+                            body_hashes=self.body_hashes,
+                            template_sites=np.array([site for site, lines in self.templates.items()
+                                                     for _ in lines], dtype=str),
+                            template_hashes=np.array([h for lines in self.templates.values()
+                                                      for h in lines], dtype=np.uint64))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH, threshold=None):
+        """Load a saved index, or return an empty one if the file does not exist."""
+        if not os.path.exists(path):
+            return cls(threshold=threshold if threshold is not None else THRESHOLD)
+
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            index = cls(meta['num_perm'], meta['bands'],
+                        threshold if threshold is not None else meta['threshold'], meta['seed'])
+            if 'body_hashes' not in data:
+                # Signed before boilerplate was removed: start over
+                return index
+            index.keys = data['keys'].tolist()
+            index.signatures = data['signatures']
+            index.dates = data['dates']
+            index.titles = data['titles'].tolist()
+            index.body_hashes = data['body_hashes']
+            for site, h in zip(data['template_sites'].tolist(), data['template_hashes'].tolist()):
+                index.templates.setdefault(site, set()).add(h)
+        index.templates = {site: frozenset(lines) for site, lines in index.templates.items()}
+        index._positions = {key: i for i, key in enumerate(index.keys)}
+        return index
+
+def dedupe_files(file_paths, index, write=True):
+    """Add the bodies of the files to the index and write their dup_cluster column.
+
+    Returns the number of articles that were newly signed.
+    """
+    frames = {file_path: pd.read_csv(file_path) for file_path in file_paths}
+    bodies = [df[['url', 'body']] for df in frames.values() if 'body' in df.columns]
+    if bodies:
+        bodies = pd.concat(bodies, ignore_index=True)
+        dropped = index.set_templates(learn_templates(bodies['url'], bodies['body']))
+        if dropped:
+            logger.info(f"Boilerplate changed, signing {dropped} articles again")
+
+    added = 0
+    for df in frames.values():
+        if 'body' in df.columns:
+            added += index.add(df['url'], df['body'], df.get('date'), df.get('title'))
+
+    for file_path, df in frames.items() if write else []:
+        df['dup_cluster'] = index.cluster_column(df['url'])
+        tmp_path = f'{file_path}.tmp'
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, file_path)
+    return added
+
+def main():
+    """Find near-duplicate articles in the cleaned bodies"""
+    parser = argparse.ArgumentParser(description='Cluster near-duplicate articles')
+    parser.add_argument('files', nargs='+', help='CSV files with url, date and body columns')
+    parser.add_argument('--index', default=INDEX_PATH, help='MinHash index file')
+    parser.add_argument('--threshold', type=float,
+                        help=f'Estimated Jaccard similarity of duplicates (default {THRESHOLD})')
+    parser.add_argument('--no-write', action='store_true',
+                        help='Only update the index, do not add dup_cluster to the files')
+    args = parser.parse_args()
+    setup_logging()
+
+    index = DedupIndex.load(args.index, args.threshold)
+    added = dedupe_files(args.files, index, not args.no_write)
+    index.save(args.index)
+
+    clusters = pd.Series(index.clusters())
+    sizes = clusters.value_counts()
+    duplicates = sizes[sizes > 1]
+    logger.info(f"Signed {added} new articles, {len(index.keys)} in the index")
+    logger.info(f"{len(duplicates)} clusters cover {duplicates.sum()} articles "
+                f"({duplicates.sum() - len(duplicates)} duplicates)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+
+"""
+Entity extraction and an entity -> article index.
+
+Four kinds of entity are extracted from titles and cleaned bodies:
+
+    drug        brand and generic names, both mapped to the generic name
+                ("Zepbound" and "tirzepatide" -> drug:tirzepatide)
+    indication  diseases, with their abbreviations ("NSCLC")
+    phase       trial phases, normalized ("Phase III" -> phase:phase 3)
+    nct         ClinicalTrials.gov identifiers (nct:NCT01234567)
+
+Drug and indication names are matched in one pass over the text by an
+Aho-Corasick automaton compiled from the lexicon: the seed tables below plus
+"Brand® (generic)" pairs learned from the titles. Phases and NCT IDs are
+regexes. Batches are extracted in a process pool.
+
+Mentions are stored in SQLite (data/entities.db) clustered by entity, so
+"all approvals for tirzepatide" is an index range scan joined with the
+article's category bitmask:
+
+    python src/data_processing/entities.py build data/output/*.csv
+    python src/data_processing/entities.py query zepbound --category "regulatory approval"
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import sys
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processing.taxonomy import BITS, category_masks
+from utils.common import (DATA_DIR, canonical_url, company_from_path, ensure_directory,
+                          flush_logging, setup_logging)
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.path.join(DATA_DIR, 'entities.db')
+CHUNK_SIZE = 200  # articles per pool task
+
+# Brand name -> generic name
+DRUGS = {
+    'keytruda': 'pembrolizumab', 'lynparza': 'olaparib', 'jardiance': 'empagliflozin',
+    'lenvima': 'lenvatinib', 'taltz': 'ixekizumab', 'verzenio': 'abemaciclib',
+    'xtandi': 'enzalutamide', 'xeljanz': 'tofacitinib', 'bavencio': 'avelumab',
+    'emgality': 'galcanezumab', 'ibrance': 'palbociclib', 'olumiant': 'baricitinib',
+    'inlyta': 'axitinib', 'retevmo': 'selpercatinib', 'trulicity': 'dulaglutide',
+    'padcev': 'enfortumab vedotin', 'cyramza': 'ramucirumab', 'zepbound': 'tirzepatide',
+    'mounjaro': 'tirzepatide', 'kisunla': 'donanemab', 'braftovi': 'encorafenib',
+    'talzenna': 'talazoparib', 'lorbrena': 'lorlatinib', 'lorviqua': 'lorlatinib',
+    'paxlovid': 'nirmatrelvir', 'welireg': 'belzutifan', 'cibinqo': 'abrocitinib',
+    'lagevrio': 'molnupiravir', 'jaypirca': 'pirtobrutinib', 'reyvow': 'lasmiditan',
+    'ebglyss': 'lebrikizumab', 'omvoh': 'mirikizumab', 'vyndaqel': 'tafamidis',
+    'vyndamax': 'tafamidis', 'comirnaty': 'bnt162b2', 'abrysvo': 'rsvpref',
+    'prevymis': 'letermovir', 'gardasil': 'hpv vaccine', 'vaxneuvance': 'pneumococcal vaccine',
+    'prevnar': 'pneumococcal vaccine', 'eliquis': 'apixaban', 'chantix': 'varenicline',
+    'elrexfio': 'elranatamab', 'adcetris': 'brentuximab vedotin', 'verquvo': 'vericiguat',
+    'steglatro': 'ertugliflozin', 'januvia': 'sitagliptin', 'welchol': 'colesevelam',
+    'humalog': 'insulin lispro', 'alimta': 'pemetrexed', 'erbitux': 'cetuximab',
+    'recarbrio': 'imipenem/cilastatin/relebactam', 'zerbaxa': 'ceftolozane/tazobactam',
+    'hympavzi': 'marstacimab', 'nurtec': 'rimegepant', 'zavzpret': 'zavegepant',
+    'myfembree': 'relugolix combination', 'tivdak': 'tisotumab vedotin',
+    'winrevair': 'sotatercept', 'capvaxive': 'pneumococcal vaccine', 'ervebo': 'ebola vaccine',
+}
+
+# Indication -> other names and abbreviations
+INDICATIONS = {
+    'obesity': ['overweight'],
+    'type 2 diabetes': ['type 2 diabetes mellitus', 't2d'],
+    'type 1 diabetes': ['type 1 diabetes mellitus', 't1d'],
+    "alzheimer's disease": ["alzheimer's", 'alzheimer', "alzheimer's dementia"],
+    'obstructive sleep apnea': ['osa', 'sleep apnea'],
+    'heart failure': ['hfpef', 'hfref'],
+    'chronic kidney disease': ['ckd'],
+    'cardiovascular disease': ['cardiovascular'],
+    'atrial fibrillation': [],
+    'attr-cm': ['transthyretin amyloid cardiomyopathy', 'attr cardiomyopathy'],
+    'breast cancer': ['metastatic breast cancer'],
+    'triple-negative breast cancer': ['tnbc'],
+    'non-small cell lung cancer': ['nsclc', 'non-small-cell lung cancer'],
+    'small cell lung cancer': ['sclc'],
+    'melanoma': [],
+    'prostate cancer': ['mcrpc', 'castration-resistant prostate cancer'],
+    'ovarian cancer': [],
+    'cervical cancer': [],
+    'endometrial cancer': ['endometrial carcinoma'],
+    'urothelial cancer': ['urothelial carcinoma', 'bladder cancer'],
+    'renal cell carcinoma': ['rcc', 'kidney cancer'],
+    'hepatocellular carcinoma': ['hcc', 'liver cancer'],
+    'gastric cancer': ['gastroesophageal junction', 'gej'],
+    'colorectal cancer': ['crc'],
+    'head and neck cancer': ['hnscc', 'head and neck squamous cell carcinoma'],
+    'lymphoma': ['hodgkin lymphoma', 'mantle cell lymphoma', 'dlbcl'],
+    'leukemia': ['chronic lymphocytic leukemia', 'cll', 'aml', 'acute myeloid leukemia'],
+    'multiple myeloma': ['myeloma'],
+    'covid-19': ['sars-cov-2', 'coronavirus'],
+    'rsv': ['respiratory syncytial virus'],
+    'influenza': ['flu'],
+    'hiv': ['hiv-1'],
+    'pneumococcal disease': ['pneumococcal pneumonia', 'invasive pneumococcal disease'],
+    'hpv': ['human papillomavirus'],
+    'cytomegalovirus': ['cmv'],
+    'lyme disease': [],
+    'migraine': [],
+    'plaque psoriasis': ['psoriasis'],
+    'psoriatic arthritis': [],
+    'rheumatoid arthritis': [],
+    'atopic dermatitis': ['eczema'],
+    'ulcerative colitis': [],
+    "crohn's disease": ["crohn's"],
+    'alopecia areata': [],
+    'hemophilia': ['hemophilia a', 'hemophilia b'],
+    'sickle cell disease': [],
+    'pulmonary arterial hypertension': ['pah'],
+}
+
+# "Brand® (generic)" in a title; the generic may carry an FDA suffix such as -azbt
+BRAND_GENERIC_RE = re.compile(
+    r"\b([A-Z][A-Za-z0-9-]{2,})\s*[®™]\s*\(([a-z][a-z0-9-]+(?: [a-z][a-z0-9-]+)?)\)")
+FDA_SUFFIX_RE = re.compile(r'-[a-z]{4}$')
+NCT_RE = re.compile(r'\bNCT\d{8}\b', re.IGNORECASE)
+PHASE = r'(iv|i{1,3}|[1-4])([ab])?'
+PHASE_RE = re.compile(rf'\bphase\s+{PHASE}(?:\s*/\s*{PHASE})?\b', re.IGNORECASE)
+ROMAN = {'i': '1', 'ii': '2', 'iii': '3', 'iv': '4'}
+TRADEMARKS = str.maketrans({'®': ' ', '™': ' ', '’': "'"})
+ALIAS_WORD_RE = re.compile(r'[a-z0-9]+')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL,
+    company TEXT,
+    title TEXT,
+    date TEXT,
+    category_mask INTEGER NOT NULL DEFAULT 0,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mentions (
+    entity TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    in_title INTEGER NOT NULL,
+    PRIMARY KEY (entity, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_mentions_doc ON mentions (doc_id);
+CREATE TABLE IF NOT EXISTS lexicon (
+    alias TEXT PRIMARY KEY,
+    entity TEXT NOT NULL,
+    learned_at TEXT NOT NULL
+);
+"""
+
+def generic_name(name):
+    """Generic name without the FDA biologic suffix, e.g. donanemab-azbt -> donanemab."""
+    return FDA_SUFFIX_RE.sub('', name.lower().strip())
+
+def learn_drugs(titles):
+    """Brand and generic aliases of the "Brand® (generic)" pairs in titles."""
+    aliases = {}
+    for title in titles:
+        for brand, generic in BRAND_GENERIC_RE.findall(str(title)):
+            entity = f'drug:{generic_name(generic)}'
+            aliases[brand.lower()] = entity
+            aliases[generic.lower()] = entity
+            aliases[generic_name(generic)] = entity
+    return aliases
+
+def seed_lexicon():
+    """Aliases of the DRUGS and INDICATIONS tables."""
+    aliases = {}
+    for brand, generic in DRUGS.items():
+        aliases[brand] = aliases[generic] = f'drug:{generic}'
+    for indication, others in INDICATIONS.items():
+        for alias in [indication, *others]:
+            aliases[alias] = f'indication:{indication}'
+    return aliases
+
+class Automaton:
+    """Aho-Corasick automaton over the words of a text.
+
+    Aliases and texts are split into lowercase words at any punctuation, so
+    "non-small cell" and "non-small-cell" match the same alias and matches
+    always cover whole words.
+    """
+
+    def __init__(self, aliases):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]  # (length in words, entity) of the aliases ending at each state
+        for alias, entity in aliases.items():
+            words = ALIAS_WORD_RE.findall(alias.lower())
+            state = 0
+            for word in words:
+                if word not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][word] = len(self.goto) - 1
+                state = self.goto[state][word]
+            if words:
+                self.output[state].append((len(words), entity))
+
+        # Breadth-first, so every state's failure link is set before its children's
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(word, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text):
+        """Entities of the longest non-overlapping matches, left to right."""
+        matches = []
+        state = 0
+        for end, word in enumerate(ALIAS_WORD_RE.findall(text.lower()), 1):
+            while state and word not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(word, 0)
+            for length, entity in self.output[state]:
+                matches.append((end - length, -length, entity))
+
+        entities = []
+        covered = 0
+        for start, negative_length, entity in sorted(matches):
+            if start >= covered:
+                entities.append(entity)
+                covered = start - negative_length
+        return entities
+
+def phase_name(match):
+    """Normalized phase of a PHASE_RE match, e.g. 'phase 1/2' or 'phase 2b'."""
+    first, first_letter, second, second_letter = (group.lower() if group else ''
+                                                  for group in match.groups())
+    name = f'phase {ROMAN.get(first, first)}{first_letter}'
+    if second:
+        name += f'/{ROMAN.get(second, second)}{second_letter}'
+    return name
+
+def extract(text, automaton):
+    """Counter of the entities mentioned in a text."""
+    text = str(text).translate(TRADEMARKS)
+    entities = Counter(automaton.find(text))
+    entities.update(f'nct:{nct.upper()}' for nct in NCT_RE.findall(text))
+    entities.update(f'phase:{phase_name(match)}' for match in PHASE_RE.finditer(text))
+    return entities
+
+_automaton = None
+
+def _init_worker(aliases):
+    global _automaton
+    _automaton = Automaton(aliases)
+
+def _extract_chunk(titles, bodies):
+    """(title entities, all entities) of each article; the unit of work sent to pool workers."""
+    results = []
+    for title, body in zip(titles, bodies):
+        in_title = extract(title, _automaton)
+        results.append((in_title, in_title + extract(body, _automaton) if body else in_title))
+    return results
+
+def extract_entities(titles, bodies, aliases, workers=1, chunk_size=CHUNK_SIZE):
+    """Entities of a batch of articles, in a process pool when workers > 1."""
+    titles = ['' if pd.isna(title) else str(title) for title in titles]
+    bodies = ['' if pd.isna(body) else str(body) for body in bodies]
+    if workers <= 1 or len(titles) <= chunk_size:
+        _init_worker(aliases)
+        return _extract_chunk(titles, bodies)
+
+    chunks = range(0, len(titles), chunk_size)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(aliases,)) as executor:
+        for chunk in executor.map(_extract_chunk, [titles[i:i + chunk_size] for i in chunks],
+                                  [bodies[i:i + chunk_size] for i in chunks]):
+            results.extend(chunk)
+    return results
+
+def content_hash(*values):
+    digest = hashlib.blake2b(digest_size=8)
+    for value in values:
+        digest.update(str(value).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+class EntityIndex:
+    """Entity -> article mentions and the lexicon they were extracted with, in SQLite."""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        if path != ':memory:':
+            ensure_directory(os.path.dirname(path))
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def aliases(self):
+        """Seed aliases updated with the learned ones."""
+        aliases = seed_lexicon()
+        aliases.update(self.conn.execute('SELECT alias, entity FROM lexicon').fetchall())
+        return aliases
+
+    def learn(self, titles):
+        """Add the drug names learned from titles to the lexicon; returns how many were new."""
+        known = self.aliases()
+        new = {alias: entity for alias, entity in learn_drugs(titles).items()
+               if alias not in known}
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO lexicon VALUES (?, ?, ?)',
+                                  [(alias, entity, now) for alias, entity in new.items()])
+        return len(new)
+
+    def add(self, df, company, workers=1, force=False):
+        """Extract and index the articles of a dataframe that are new or changed.
+
+        Returns the number of articles (re)indexed.
+        """
+        bodies = df['body'] if 'body' in df.columns else pd.Series([None] * len(df))
+        masks = (df['category_mask'] if 'category_mask' in df.columns
+                 else category_masks(df.get('category', pd.Series([None] * len(df)))))
+        dates = pd.to_datetime(df['date'], errors='coerce', format='mixed')
+        dates = [None if pd.isna(date) else date.strftime('%Y-%m-%d') for date in dates]
+        # Everything stored for a doc, so a new taxonomy or date re-indexes it too
+        hashes = [content_hash(title, body, date, int(mask), company)
+                  for title, body, date, mask in zip(df['title'], bodies, dates, masks)]
+        keys = [canonical_url(url) for url in df['url']]
+        known = dict(self.conn.execute('SELECT key, content_hash FROM docs'))
+        # Lexicon changes are picked up by `build --full`
+        pending = [i for i, (key, h) in enumerate(zip(keys, hashes))
+                   if force or known.get(key) != h]
+        if not pending:
+            return 0
+
+        results = extract_entities(df['title'].iloc[pending], bodies.iloc[pending],
+                                   self.aliases(), workers)
+        with self.conn:
+            for i, (in_title, entities) in zip(pending, results):
+                date = dates[i]
+                doc_id = self.conn.execute("""
+                    INSERT INTO docs (key, url, company, title, date, category_mask, content_hash)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET url = excluded.url,
+                        company = excluded.company, title = excluded.title,
+                        date = excluded.date, category_mask = excluded.category_mask,
+                        content_hash = excluded.content_hash
+                    RETURNING id
+                """, (keys[i], df['url'].iloc[i], company, df['title'].iloc[i], date,
+                      int(masks.iloc[i]), hashes[i])).fetchone()[0]
+                self.conn.execute('DELETE FROM mentions WHERE doc_id = ?', (doc_id,))
+                self.conn.executemany(
+                    'INSERT INTO mentions VALUES (?, ?, ?, ?)',
+                    [(entity, doc_id, count, int(entity in in_title))
+                     for entity, count in entities.items()])
+        return len(pending)
+
+    def resolve(self, name):
+        """Entity of a query term: an 'kind:value' entity, a known alias or a phase."""
+        name = name.strip()
+        if ':' in name:
+            return name
+        lowered = name.lower().translate(TRADEMARKS).strip()
+        aliases = self.aliases()
+        if lowered in aliases:
+            return aliases[lowered]
+        if generic_name(lowered) in aliases:
+            return aliases[generic_name(lowered)]
+        if NCT_RE.fullmatch(name):
+            return f'nct:{name.upper()}'
+        match = PHASE_RE.fullmatch(lowered)
+        if match:
+            return f'phase:{phase_name(match)}'
+        return f'drug:{lowered}'
+
+    def lookup(self, entity, category=None, company=None, start=None, end=None, in_title=False):
+        """Articles mentioning an entity, newest first."""
+        conditions, params = ['m.entity = ?'], [entity]
+        if category is not None:
+            conditions.append('(d.category_mask & ?) != 0')
+            params.append(BITS[category])
+        if company is not None:
+            conditions.append('d.company = ?')
+            params.append(company)
+        if start is not None:
+            conditions.append('d.date >= ?')
+            params.append(start)
+        if end is not None:
+            conditions.append('d.date <= ?')
+            params.append(end)
+        if in_title:
+            conditions.append('m.in_title = 1')
+        return pd.read_sql_query(f"""
+            SELECT d.date, d.company, d.title, d.url, m.count, m.in_title
+            FROM mentions m JOIN docs d ON d.id = m.doc_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY d.date DESC, d.id
+        """, self.conn, params=params)
+
+    def top_entities(self, kind=None, limit=20):
+        """Most mentioned entities (of one kind) with their article counts."""
+        where, params = '', []
+        if kind:
+            where, params = 'WHERE entity >= ? AND entity < ?', [f'{kind}:', f'{kind};']
+        rows = self.conn.execute(f"""
+            SELECT entity, COUNT(*) AS articles FROM mentions {where}
+            GROUP BY entity ORDER BY articles DESC, entity LIMIT ?
+        """, params + [limit])
+        return pd.DataFrame(rows.fetchall(), columns=['entity', 'articles'])
+
+def build_index(file_paths, index, workers=1, force=False):
+    """Learn drug names from the files' titles, then index their articles.
+
+    Returns the number of articles (re)indexed.
+    """
+    frames = {path: pd.read_csv(path) for path in file_paths}
+    learned = index.learn(pd.concat([df['title'] for df in frames.values()]))
+    if learned:
+        logger.info(f"Learned {learned} drug name aliases")
+    return sum(index.add(df, company_from_path(path), workers, force)
+               for path, df in frames.items())
+
+def main():
+    """Extract entities into the index or query it"""
+    parser = argparse.ArgumentParser(description='Drug, indication, phase and NCT ID index')
+    parser.add_argument('--db', default=DB_PATH, help='Entity index database')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Index the entities of CSV files')
+    build_parser.add_argument('files', nargs='+', help='CSV files with title (and body) columns')
+    build_parser.add_argument('--workers', '-w', type=int, default=os.cpu_count(),
+                              help='Worker processes')
+    build_parser.add_argument('--full', action='store_true',
+                              help='Re-extract every article, e.g. after the lexicon changed')
+
+    query_parser = subparsers.add_parser('query', help='Articles mentioning an entity')
+    query_parser.add_argument('entity', help='Drug, indication, phase, NCT ID or kind:value')
+    query_parser.add_argument('--category', choices=list(BITS), help='Only this category')
+    query_parser.add_argument('--company', '-c', help='Only this company')
+    query_parser.add_argument('--since', help='Earliest date, YYYY-MM-DD')
+    query_parser.add_argument('--until', help='Latest date, YYYY-MM-DD')
+    query_parser.add_argument('--in-title', action='store_true',
+                              help='Only articles naming the entity in the title')
+
+    top_parser = subparsers.add_parser('top', help='Most mentioned entities')
+    top_parser.add_argument('kind', nargs='?', choices=['drug', 'indication', 'phase', 'nct'])
+    top_parser.add_argument('--limit', type=int, default=20)
+
+    args = parser.parse_args()
+    setup_logging()
+    with EntityIndex(args.db) as index:
+        if args.command == 'build':
+            indexed = build_index(args.files, index, args.workers, args.full)
+            total = index.conn.execute('SELECT COUNT(*) FROM docs').fetchone()[0]
+            logger.info(f"Indexed {indexed} articles, {total} in {args.db}")
+        elif args.command == 'query':
+            entity = index.resolve(args.entity)
+            df = index.lookup(entity, args.category, args.company, args.since, args.until,
+                              args.in_title)
+            flush_logging()
+            for row in df.itertuples():
+                print(f"{row.date}  {row.company:<7} {row.title}")
+            print(f"{len(df)} articles mention {entity}")
+        else:
+            top = index.top_entities(args.kind, args.limit)
+            flush_logging()
+            print(top.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -4,35 +4,53 @@
 Generate statistics and visualizations from the cleaned pharma news data.
 """
 
+import argparse
+import logging
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import os
-from datetime import datetime
-import numpy as np
-from collections import Counter
-import json
+import sys
 
-# Set style for better-looking plots
-plt.style.use('ggplot')
-sns.set(style="whitegrid")
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processing.cube import CUBE_PATH, save_cubes
+from data_processing.stats_state import StatsState, write_statistics
+from utils import metrics
+from utils.common import flush_logging, setup_logging
+
+logger = logging.getLogger(__name__)
 
 # Paths
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
 CLEAN_DIR = os.path.join(DATA_DIR, 'clean')
 STATS_DIR = os.path.join(DATA_DIR, 'stats')
 PLOTS_DIR = os.path.join(STATS_DIR, 'plots')
+DATASET_DIR = os.path.join(DATA_DIR, 'dataset')
+DB_PATH = os.path.join(DATA_DIR, 'articles.db')
+DEDUP_INDEX = os.path.join(DATA_DIR, 'models', 'minhash.npz')
+COMPANIES = ['pfizer', 'merck', 'lilly']
+STATS_VERSION = 3  # bump when the statistics or plots change so they are regenerated
 
-# Ensure directories exist
-os.makedirs(STATS_DIR, exist_ok=True)
-os.makedirs(PLOTS_DIR, exist_ok=True)
+def load_data(source=None):
+    """Load all cleaned data files and return a combined dataframe.
 
-def load_data():
-    """Load all cleaned data files and return a combined dataframe."""
+    By default the clean Parquet dataset, or the cleaned CSVs without one. The
+    article store is only read when asked for: scraper and daemon runs create
+    it with just their own rows, and the statistics state drops every article
+    missing from the load.
+    """
+    if source:
+        return SOURCES[source]()
+    if os.path.isdir(os.path.join(DATASET_DIR, 'clean')):
+        return load_dataset()
+    return load_csv()
+
+def load_csv(clean_dir=CLEAN_DIR):
+    """Load the cleaned CSV file of every company."""
     companies = {
-        'pfizer': os.path.join(CLEAN_DIR, 'pfizer_news_cleaned.csv'),
-        'merck': os.path.join(CLEAN_DIR, 'merck_news_cleaned.csv'),
-        'lilly': os.path.join(CLEAN_DIR, 'lilly_news_cleaned.csv')
+        'pfizer': os.path.join(clean_dir, 'pfizer_news_cleaned.csv'),
+        'merck': os.path.join(clean_dir, 'merck_news_cleaned.csv'),
+        'lilly': os.path.join(clean_dir, 'lilly_news_cleaned.csv')
     }
     
     dfs = {}
@@ -46,201 +64,129 @@ def load_data():
     combined_df = pd.concat(dfs.values(), ignore_index=True)
     return dfs, combined_df
 
-def calculate_statistics(dfs, combined_df):
-    """Calculate statistics from the data and return as a dictionary."""
-    stats = {}
-    
-    # Overall statistics
-    stats['total_articles'] = len(combined_df)
-    stats['date_range'] = {
-        'start': combined_df['date'].min().strftime('%Y-%m-%d'),
-        'end': combined_df['date'].max().strftime('%Y-%m-%d')
-    }
-    
-    # Company-specific statistics
-    stats['company_counts'] = {company: len(df) for company, df in dfs.items()}
-    
-    # Category distribution
-    category_counts = combined_df['category'].value_counts().to_dict()
-    stats['category_counts'] = category_counts
-    
-    # Category distribution by company
-    company_categories = {}
-    for company, df in dfs.items():
-        company_categories[company] = df['category'].value_counts().to_dict()
-    stats['company_categories'] = company_categories
-    
-    # Monthly distribution
-    combined_df['month'] = combined_df['date'].dt.to_period('M')
-    monthly_counts = combined_df.groupby(['company', 'month']).size()
-    monthly_series = {}
-    for company in dfs.keys():
-        if company in monthly_counts:
-            company_monthly = monthly_counts[company].reset_index()
-            company_monthly['month'] = company_monthly['month'].astype(str)
-            monthly_series[company] = company_monthly.set_index('month')[0].to_dict()
-    stats['monthly_counts'] = monthly_series
-    
-    return stats
+def load_dataset():
+    """Load the metadata columns of the clean Parquet dataset, without any bodies."""
+    from storage.parquet_store import read_metadata
 
-def generate_plots(dfs, combined_df, stats):
-    """Generate visualization plots and save them."""
-    plots_info = []
-    
-    # 1. Category Distribution Pie Chart
-    plt.figure(figsize=(12, 8))
-    categories = list(stats['category_counts'].keys())
-    values = list(stats['category_counts'].values())
-    
-    # Sort by frequency for better visualization
-    sorted_idx = np.argsort(values)[::-1]
-    categories = [categories[i] for i in sorted_idx]
-    values = [values[i] for i in sorted_idx]
-    
-    # Take top 10 categories for cleaner visualization
-    if len(categories) > 10:
-        other_count = sum(values[10:])
-        categories = categories[:10] + ['Other']
-        values = values[:10] + [other_count]
-    
-    plt.pie(values, labels=categories, autopct='%1.1f%%', startangle=90)
-    plt.axis('equal')
-    plt.title('Distribution of News Categories Across All Companies', fontsize=16)
-    pie_chart_path = os.path.join(PLOTS_DIR, 'category_distribution_pie.png')
-    plt.tight_layout()
-    plt.savefig(pie_chart_path)
-    plots_info.append({
-        'title': 'News Categories Distribution',
-        'description': 'Pie chart showing the distribution of different news categories across all companies',
-        'path': 'data/stats/plots/category_distribution_pie.png'
-    })
-    plt.close()
-    
-    # 2. Company Comparison Bar Chart
-    plt.figure(figsize=(10, 6))
-    companies = list(stats['company_counts'].keys())
-    article_counts = list(stats['company_counts'].values())
-    
-    colors = ['#1f77b4', '#ff7f0e', '#2ca02c']
-    plt.bar(companies, article_counts, color=colors)
-    plt.title('Number of News Articles by Company', fontsize=16)
-    plt.ylabel('Number of Articles')
-    plt.ylim(0, max(article_counts) * 1.1)
-    
-    # Add count labels on top of each bar
-    for i, count in enumerate(article_counts):
-        plt.text(i, count + 5, str(count), ha='center', fontweight='bold')
-    
-    bar_chart_path = os.path.join(PLOTS_DIR, 'company_article_counts.png')
-    plt.tight_layout()
-    plt.savefig(bar_chart_path)
-    plots_info.append({
-        'title': 'Articles by Company',
-        'description': 'Bar chart comparing the number of news articles published by each pharmaceutical company',
-        'path': 'data/stats/plots/company_article_counts.png'
-    })
-    plt.close()
-    
-    # 3. Top Categories by Company Horizontal Bar Chart
-    plt.figure(figsize=(14, 10))
-    
-    # Get top 5 categories for each company
-    top_categories = {}
-    for company, categories in stats['company_categories'].items():
-        sorted_categories = sorted(categories.items(), key=lambda x: x[1], reverse=True)
-        top_categories[company] = dict(sorted_categories[:5])
-    
-    # Create subplots for each company
-    fig, axes = plt.subplots(len(dfs), 1, figsize=(12, 5*len(dfs)))
-    
-    for i, (company, categories) in enumerate(top_categories.items()):
-        ax = axes[i] if len(dfs) > 1 else axes
-        cat_names = list(categories.keys())
-        cat_counts = list(categories.values())
-        
-        # Sort for better visualization
-        sorted_idx = np.argsort(cat_counts)
-        cat_names = [cat_names[j] for j in sorted_idx]
-        cat_counts = [cat_counts[j] for j in sorted_idx]
-        
-        ax.barh(cat_names, cat_counts, color=colors[i % len(colors)])
-        ax.set_title(f'Top Categories for {company.capitalize()}', fontsize=14)
-        ax.set_xlabel('Count')
-        
-        # Add count labels
-        for j, count in enumerate(cat_counts):
-            ax.text(count + 0.5, j, str(count), va='center')
-    
-    plt.tight_layout()
-    categories_chart_path = os.path.join(PLOTS_DIR, 'top_categories_by_company.png')
-    plt.savefig(categories_chart_path)
-    plots_info.append({
-        'title': 'Top Categories by Company',
-        'description': 'Horizontal bar charts showing the most common news categories for each company',
-        'path': 'data/stats/plots/top_categories_by_company.png'
-    })
-    plt.close()
-    
-    # 4. Timeline of News Articles
-    plt.figure(figsize=(15, 8))
-    
-    # Create monthly time series
-    for i, (company, df) in enumerate(dfs.items()):
-        # Group by month and count
-        monthly = df.groupby(df['date'].dt.to_period('M')).size()
-        # Convert period index to datetime for plotting
-        monthly.index = monthly.index.to_timestamp()
-        plt.plot(monthly.index, monthly.values, marker='o', linestyle='-', label=company.capitalize(), color=colors[i % len(colors)])
-    
-    plt.title('Monthly News Articles by Company', fontsize=16)
-    plt.xlabel('Date')
-    plt.ylabel('Number of Articles')
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
-    
-    timeline_chart_path = os.path.join(PLOTS_DIR, 'monthly_articles_timeline.png')
-    plt.savefig(timeline_chart_path)
-    plots_info.append({
-        'title': 'News Articles Timeline',
-        'description': 'Line chart showing the monthly distribution of news articles for each company over time',
-        'path': 'data/stats/plots/monthly_articles_timeline.png'
-    })
-    plt.close()
-    
-    return plots_info
+    metadata = read_metadata('clean', companies=COMPANIES)
+    metadata['category'] = metadata['category'].astype(object)
+    metadata = metadata.sort_values('date', ascending=False, kind='stable')
+
+    dfs = {}
+    for company in COMPANIES:
+        df = metadata[metadata['company'] == company]
+        dfs[company] = df.drop(columns=['company']).assign(company=company).reset_index(drop=True)
+
+    combined_df = pd.concat(dfs.values(), ignore_index=True)
+    return dfs, combined_df
+
+def load_store():
+    """Load article metadata from the article store, without any bodies."""
+    from storage.sql_store import ArticleRepository
+
+    dfs = {}
+    with ArticleRepository(DB_PATH) as repo:
+        for company in COMPANIES:
+            df = repo.articles(company).drop(columns=['company'])
+            df['company'] = company
+            dfs[company] = df
+
+    combined_df = pd.concat(dfs.values(), ignore_index=True)
+    return dfs, combined_df
+
+# --source: loader
+SOURCES = {
+    'csv': load_csv,
+    'dataset': load_dataset,
+    'store': load_store,
+}
+
+def add_duplicate_clusters(dfs, combined_df, index_path=DEDUP_INDEX):
+    """Add the dup_cluster column from the near-duplicate index, if one was built."""
+    if not os.path.exists(index_path):
+        return dfs, combined_df
+
+    from data_processing.dedup import DedupIndex
+
+    index = DedupIndex.load(index_path)
+    dfs = {company: df.assign(dup_cluster=index.cluster_column(df['url']))
+           for company, df in dfs.items()}
+    combined_df = combined_df.assign(dup_cluster=index.cluster_column(combined_df['url']))
+    return dfs, combined_df
+
+def generate_plots(stats, cubes, force=False):
+    """Draw the plots whose numbers changed since they were last drawn."""
+    from data_processing.plots import plot_inputs, render_plots
+
+    return render_plots(plot_inputs(stats, cubes), PLOTS_DIR, force=force)
 
 def save_statistics(stats, plots_info):
     """Save statistics to a JSON file."""
-    # Add plots information to stats
-    stats['plots'] = plots_info
-    
-    # Save to JSON file
-    stats_file = os.path.join(STATS_DIR, 'pharma_news_stats.json')
-    with open(stats_file, 'w') as f:
-        json.dump(stats, f, indent=4)
-    
-    return stats_file
+    return write_statistics(stats, os.path.join(STATS_DIR, 'pharma_news_stats.json'), plots_info)
+
+def update_state(state, combined_df, full=False):
+    """Bring the aggregate state in line with the loaded articles.
+
+    Returns the number of articles added, changed or removed since the last run.
+    """
+    if full:
+        state.clear()
+    changed = state.sync(combined_df)
+    logger.info(f"Statistics state: {changed} articles added, changed or removed, "
+                f"{len(state)} in total")
+    return changed
+
+def generate(state, force_plots=False):
+    """Build the category cubes from the aggregate state, render the statistics and
+    plots from them and save all three. Plots whose numbers did not change are kept.
+
+    Near-duplicate articles (same dup_cluster) are counted once.
+    """
+    logger.info("Calculating statistics...")
+    cubes = state.cubes()
+    save_cubes(cubes)
+    stats = state.statistics(cubes)
+    if 'duplicates_collapsed' in stats:
+        logger.info(f"Collapsed {stats['duplicates_collapsed']} near-duplicate articles")
+    
+    logger.info("Generating plots...")
+    with metrics.span('plots'):
+        plots_info = generate_plots(stats, cubes, force_plots)
+    
+    logger.info("Saving statistics...")
+    return stats, save_statistics(stats, plots_info)
 
 def main():
     """Main function to generate statistics and visualizations."""
-    print("Loading data...")
-    dfs, combined_df = load_data()
-    
-    print("Calculating statistics...")
-    stats = calculate_statistics(dfs, combined_df)
-    
-    print("Generating plots...")
-    plots_info = generate_plots(dfs, combined_df, stats)
-    
-    print("Saving statistics...")
-    stats_file = save_statistics(stats, plots_info)
+    parser = argparse.ArgumentParser(description='Generate statistics and visualizations')
+    parser.add_argument('--full', action='store_true',
+                        help='Rebuild the statistics state from scratch and regenerate')
+    parser.add_argument('--source', choices=list(SOURCES),
+                        help='Where to load the articles from (default: the clean Parquet '
+                             'dataset if there is one, else data/clean); use store only once '
+                             '`main.py store import` has loaded every company')
+    args = parser.parse_args()
+    setup_logging()
+
+    logger.info("Loading data...")
+    dfs, combined_df = load_data(args.source)
+    dfs, combined_df = add_duplicate_clusters(dfs, combined_df)
     
-    print(f"Statistics and visualizations generated successfully!")
-    print(f"Statistics saved to: {stats_file}")
-    print(f"Plots saved to: {PLOTS_DIR}")
+    stats_file = os.path.join(STATS_DIR, 'pharma_news_stats.json')
+    with StatsState() as state:
+        # Only the articles added, changed or removed since the last run are aggregated
+        if (not update_state(state, combined_df, args.full) and os.path.exists(stats_file)
+                and os.path.exists(CUBE_PATH)):
+            logger.info(f"No changes since the last run, {stats_file} is up to date.")
+            return
+        stats, stats_file = generate(state, force_plots=args.full)
+    
+    logger.info(f"Statistics and visualizations generated successfully!")
+    logger.info(f"Statistics saved to: {stats_file}")
+    logger.info(f"Plots saved to: {PLOTS_DIR}")
     
     # Print summary
+    flush_logging()
     print("\nSummary:")
     print(f"Total news articles: {stats['total_articles']}")
     print(f"Articles by company: {stats['company_counts']}")
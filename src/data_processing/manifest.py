@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""
+Content-hash manifest for incremental processing.
+
+For every stage (clean, output, stats) and scope (usually a company), the
+manifest stores one hash per input row together with the version of the code
+that processed it. A stage then only reprocesses rows whose hash is new or
+changed, or every row if its version changed, and merges them into the output
+it wrote last time.
+
+Rows are keyed by canonical URL; repeated URLs get an occurrence suffix so
+duplicate rows in a snapshot stay distinct.
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.common import DATA_DIR, canonical_url, ensure_directory
+
+MANIFEST_PATH = os.path.join(DATA_DIR, 'manifest.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS manifest (
+    stage TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    input_hash INTEGER NOT NULL,
+    version TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (stage, scope, key)
+);
+"""
+
+def row_keys(urls):
+    """Canonical URL of each row, with '#<n>' appended to repeats."""
+    canonical = pd.Series([canonical_url(url) for url in urls], dtype=object)
+    occurrence = canonical.groupby(canonical, sort=False).cumcount()
+    return pd.Index(canonical.where(occurrence == 0,
+                                    canonical + '#' + occurrence.astype(str)))
+
+def row_hashes(df, columns=None):
+    """64-bit content hash of each row over the given columns."""
+    columns = [column for column in (columns or df.columns) if column in df.columns]
+    hashes = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    # SQLite integers are signed
+    return hashes.view(np.int64)
+
+def merge_rows(previous, processed, keys):
+    """Combine kept rows of the previous output with freshly processed ones.
+
+    Both frames are indexed by row key. The result follows the order of
+    `keys`, the current input, and has a plain range index.
+    """
+    kept = previous[previous.index.isin(keys) & ~previous.index.isin(processed.index)]
+    merged = pd.concat([kept, processed]) if len(kept) else processed
+    position = pd.Series(np.arange(len(keys)), index=keys)
+    order = np.argsort(position.reindex(merged.index).to_numpy(), kind='stable')
+    return merged.iloc[order].reset_index(drop=True)
+
+class Manifest:
+    """Input hashes and code versions of every processed row, in SQLite."""
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        if path != ':memory:':
+            ensure_directory(os.path.dirname(path))
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _entries(self, stage, scope):
+        rows = self.conn.execute(
+            'SELECT key, input_hash, version FROM manifest WHERE stage = ? AND scope = ?',
+            (stage, scope))
+        return pd.DataFrame(rows.fetchall(), columns=['key', 'input_hash', 'version'])
+
+    def pending(self, stage, scope, keys, hashes, version):
+        """Boolean array of the rows whose hash or code version changed."""
+        entries = self._entries(stage, scope).set_index('key')
+        entries = entries[entries['version'] == str(version)]
+        recorded = entries['input_hash'].astype('Int64').reindex(keys)
+        return ~(recorded == hashes).to_numpy(dtype=bool, na_value=False)
+
+    def is_current(self, stage, scope, keys, hashes, version):
+        """Whether the input is exactly what was recorded: nothing changed, added or removed."""
+        recorded = self.conn.execute(
+            'SELECT COUNT(*) FROM manifest WHERE stage = ? AND scope = ?', (stage, scope)).fetchone()[0]
+        return recorded == len(keys) and not self.pending(stage, scope, keys, hashes, version).any()
+
+    def record(self, stage, scope, keys, hashes, version):
+        """Replace a scope's entries with the rows just processed."""
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.conn:
+            self.conn.execute('DELETE FROM manifest WHERE stage = ? AND scope = ?',
+                              (stage, scope))
+            self.conn.executemany(
+                'INSERT INTO manifest VALUES (?, ?, ?, ?, ?, ?)',
+                ((stage, scope, key, int(h), str(version), now) for key, h in zip(keys, hashes)))
+
+    def clear(self, stage=None):
+        """Forget a stage, or everything, so the next run reprocesses it all."""
+        with self.conn:
+            if stage is None:
+                self.conn.execute('DELETE FROM manifest')
+            else:
+                self.conn.execute('DELETE FROM manifest WHERE stage = ?', (stage,))
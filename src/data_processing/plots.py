@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""
+Statistics plots, each drawn from a small input of its own.
+
+Every plot records a hash of its input in data/cache/plots.json, and is only
+redrawn when that input changes (or its PNG is missing), so a refresh that
+does not change what a plot shows leaves it alone. The plots that do need
+drawing are rendered in parallel worker processes on the Agg backend.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from utils.common import DATA_DIR, PROJECT_ROOT, ensure_directory
+
+logger = logging.getLogger(__name__)
+
+PLOTS_DIR = os.path.join(DATA_DIR, 'stats', 'plots')
+RENDER_STATE_PATH = os.path.join(DATA_DIR, 'cache', 'plots.json')
+PLOTS_VERSION = 1  # bump when the drawing code changes so every plot is redrawn
+COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c']
+TOP_CATEGORIES = 5  # per company in the top categories plot
+PIE_SLICES = 10  # largest categories in the pie, the rest are 'Other'
+
+@lru_cache(maxsize=None)
+def _pyplot():
+    """pyplot on the Agg backend with the plot style set, once per process."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.style.use('ggplot')
+    sns.set(style="whitegrid")
+    return plt
+
+def draw_category_pie(data, path):
+    plt = _pyplot()
+    categories, values = data['categories'], data['values']
+    # Take the largest categories for cleaner visualization
+    if len(categories) > PIE_SLICES:
+        categories = categories[:PIE_SLICES] + ['Other']
+        values = values[:PIE_SLICES] + [sum(values[PIE_SLICES:])]
+
+    plt.figure(figsize=(12, 8))
+    plt.pie(values, labels=categories, autopct='%1.1f%%', startangle=90)
+    plt.axis('equal')
+    plt.title('Distribution of News Categories Across All Companies', fontsize=16)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def draw_company_counts(data, path):
+    plt = _pyplot()
+    companies, article_counts = data['companies'], data['counts']
+
+    plt.figure(figsize=(10, 6))
+    plt.bar(companies, article_counts, color=COLORS[:len(companies)])
+    plt.title('Number of News Articles by Company', fontsize=16)
+    plt.ylabel('Number of Articles')
+    plt.ylim(0, max(article_counts) * 1.1)
+    # Add count labels on top of each bar
+    for i, count in enumerate(article_counts):
+        plt.text(i, count + 5, str(count), ha='center', fontweight='bold')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def draw_top_categories(data, path):
+    plt = _pyplot()
+    fig, axes = plt.subplots(len(data), 1, figsize=(12, 5 * len(data)), squeeze=False)
+    for i, (company, categories) in enumerate(data.items()):
+        ax = axes[i, 0]
+        # Smallest first, so the largest bar is on top
+        cat_names = list(categories)[::-1]
+        cat_counts = list(categories.values())[::-1]
+        ax.barh(cat_names, cat_counts, color=COLORS[i % len(COLORS)])
+        ax.set_title(f'Top Categories for {company.capitalize()}', fontsize=14)
+        ax.set_xlabel('Count')
+        for j, count in enumerate(cat_counts):
+            ax.text(count + 0.5, j, str(count), va='center')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close(fig)
+
+def draw_timeline(data, path):
+    import pandas as pd
+
+    plt = _pyplot()
+    months = pd.to_datetime(data['months'])
+    plt.figure(figsize=(15, 8))
+    for i, (company, counts) in enumerate(data['series'].items()):
+        plt.plot(months, counts, marker='o', linestyle='-', label=company.capitalize(),
+                 color=COLORS[i % len(COLORS)])
+    plt.title('Monthly News Articles by Company', fontsize=16)
+    plt.xlabel('Date')
+    plt.ylabel('Number of Articles')
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+# Name (and PNG file name): drawing function, title, description
+PLOTS = {
+    'category_distribution_pie': (
+        draw_category_pie, 'News Categories Distribution',
+        'Pie chart showing the distribution of different news categories across all companies'),
+    'company_article_counts': (
+        draw_company_counts, 'Articles by Company',
+        'Bar chart comparing the number of news articles published by each pharmaceutical company'),
+    'top_categories_by_company': (
+        draw_top_categories, 'Top Categories by Company',
+        'Horizontal bar charts showing the most common news categories for each company'),
+    'monthly_articles_timeline': (
+        draw_timeline, 'News Articles Timeline',
+        'Line chart showing the monthly distribution of news articles for each company over time'),
+}
+
+def plot_inputs(stats, cubes):
+    """What each plot shows, as plain JSON-serializable data, by plot name."""
+    monthly = cubes['all'].articles('company', 'period')
+    return {
+        'category_distribution_pie': {'categories': list(stats['category_counts']),
+                                      'values': list(stats['category_counts'].values())},
+        'company_article_counts': {'companies': list(stats['company_counts']),
+                                   'counts': list(stats['company_counts'].values())},
+        'top_categories_by_company': cubes['company'].top(TOP_CATEGORIES, per='company'),
+        'monthly_articles_timeline': {
+            'months': cubes['all'].periods,
+            'series': {company: [int(n) for n in monthly[company]]
+                       for company in cubes['all'].companies},
+        },
+    }
+
+def input_hash(data):
+    """Hash of a plot's input and the drawing code version."""
+    payload = json.dumps([PLOTS_VERSION, data], sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def _render(name, data, path):
+    """Draw one plot; returns the seconds it took."""
+    started = time.perf_counter()
+    PLOTS[name][0](data, path)
+    return time.perf_counter() - started
+
+def render_plots(inputs, plots_dir=PLOTS_DIR, state_path=RENDER_STATE_PATH, workers=None,
+                 force=False):
+    """Draw the plots whose input changed since their last render.
+
+    Returns the plot list of pharma_news_stats.json (every plot, drawn or not).
+    """
+    ensure_directory(plots_dir)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+
+    hashes = {name: input_hash(data) for name, data in inputs.items()}
+    paths = {name: os.path.join(plots_dir, f'{name}.png') for name in inputs}
+    pending = [name for name in inputs
+               if force or state.get(name) != hashes[name] or not os.path.exists(paths[name])]
+
+    if pending:
+        # Imported before the pool forks, so neither the workers nor the timings pay for it
+        _pyplot()
+    workers = min(len(pending), workers or os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {name: pool.submit(_render, name, inputs[name], paths[name])
+                       for name in pending}
+            timings = {name: future.result() for name, future in futures.items()}
+    else:
+        timings = {name: _render(name, inputs[name], paths[name]) for name in pending}
+
+    for name in inputs:
+        if name in timings:
+            logger.info(f"  {name:<28} {timings[name]:6.2f}s")
+        else:
+            logger.info(f"  {name:<28} unchanged")
+
+    state.update({name: hashes[name] for name in pending})
+    ensure_directory(os.path.dirname(state_path))
+    tmp_path = f'{state_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+    return [{'title': PLOTS[name][1], 'description': PLOTS[name][2],
+             'path': os.path.relpath(paths[name], PROJECT_ROOT)} for name in inputs]
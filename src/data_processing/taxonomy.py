@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+"""
+Canonical category taxonomy for the free-text categories the scrapers return.
+
+The LLM-extracted labels vary in case, number and wording ("partnership",
+"partnerships", "collaboration") and sometimes hold several categories
+("covid-19, vaccines", or a list for Lilly). Each label is split into parts
+and every part is resolved to canonical categories by, in order:
+
+    1. the ALIASES lookup table
+    2. a close spelling match against the aliases (difflib)
+    3. KEYWORDS found among its words
+    4. 'other'
+
+Articles can have several categories, so a row's categories are stored as a
+bitmask (bit i set for CATEGORIES[i]) and filtering is a vectorized AND.
+Resolved labels are memoized in memory and in data/cache/category_map.json,
+which is discarded whenever the tables below change. The mapper is shared by
+the pipeline's cleaning threads, so it is guarded by a lock.
+"""
+
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.common import DATA_DIR, ensure_directory
+
+CACHE_PATH = os.path.join(DATA_DIR, 'cache', 'category_map.json')
+FUZZY_CUTOFF = 0.85  # difflib ratio of a close spelling match
+
+# Bit i of a category mask stands for CATEGORIES[i]; only append new ones
+CATEGORIES = (
+    'clinical trial update',
+    'regulatory approval',
+    'financial news',
+    'management update',
+    'commercialized drug update',
+    'research',
+    'partnership',
+    'vaccines',
+    'covid-19',
+    'corporate responsibility',
+    'corporate news',
+    'legal news',
+    'animal health',
+    'other',
+)
+BITS = {name: 1 << i for i, name in enumerate(CATEGORIES)}
+
+# Known label parts and their categories
+ALIASES = {
+    **{name: (name,) for name in CATEGORIES},
+    'clinical trial': ('clinical trial update',),
+    'clinical trials': ('clinical trial update',),
+    'regulatory': ('regulatory approval',),
+    'regulatory update': ('regulatory approval',),
+    'finance': ('financial news',),
+    'financial': ('financial news',),
+    'financial results': ('financial news',),
+    'investment': ('financial news',),
+    'investments': ('financial news',),
+    'management': ('management update',),
+    'leadership': ('management update',),
+    'medicines': ('commercialized drug update',),
+    'prescription medicines': ('commercialized drug update',),
+    'prescription medicine news': ('commercialized drug update',),
+    'product news': ('commercialized drug update',),
+    'research and pipeline': ('research',),
+    'research and development': ('research',),
+    'research and development news': ('research',),
+    'pipeline': ('research',),
+    'partnerships': ('partnership',),
+    'collaboration': ('partnership',),
+    'collaborations': ('partnership',),
+    'research collaboration': ('partnership', 'research'),
+    'licensing agreement': ('partnership',),
+    'licensing and research collaboration': ('partnership', 'research'),
+    'acquisition': ('partnership',),
+    'acquisitions': ('partnership',),
+    'vaccine': ('vaccines',),
+    'vaccine update': ('vaccines',),
+    'vaccine news': ('vaccines',),
+    'covid': ('covid-19',),
+    'corporate responsibility news': ('corporate responsibility',),
+    'corporate social responsibility': ('corporate responsibility',),
+    'social responsibility': ('corporate responsibility',),
+    'philanthropy': ('corporate responsibility',),
+    'esg': ('corporate responsibility',),
+    'corporate': ('corporate news',),
+    'company news': ('corporate news',),
+    'legal': ('legal news',),
+    'litigation': ('legal news',),
+    'animal health news': ('animal health',),
+}
+
+# Words that give away a category when the whole part is unknown
+KEYWORDS = {
+    'trial': 'clinical trial update', 'trials': 'clinical trial update',
+    'phase': 'clinical trial update', 'study': 'clinical trial update',
+    'approval': 'regulatory approval', 'approved': 'regulatory approval',
+    'fda': 'regulatory approval', 'ema': 'regulatory approval', 'chmp': 'regulatory approval',
+    'financial': 'financial news', 'finance': 'financial news', 'earnings': 'financial news',
+    'dividend': 'financial news', 'investor': 'financial news',
+    'management': 'management update', 'executive': 'management update',
+    'appointment': 'management update', 'board': 'management update',
+    'launch': 'commercialized drug update', 'commercial': 'commercialized drug update',
+    'medicine': 'commercialized drug update', 'medicines': 'commercialized drug update',
+    'research': 'research', 'pipeline': 'research', 'science': 'research',
+    'partnership': 'partnership', 'partnerships': 'partnership',
+    'collaboration': 'partnership', 'licensing': 'partnership', 'acquisition': 'partnership',
+    'agreement': 'partnership', 'deal': 'partnership',
+    'vaccine': 'vaccines', 'vaccines': 'vaccines', 'covid': 'covid-19',
+    'responsibility': 'corporate responsibility', 'sustainability': 'corporate responsibility',
+    'legal': 'legal news', 'lawsuit': 'legal news',
+    'animal': 'animal health', 'veterinary': 'animal health',
+}
+
+SPLIT_RE = re.compile(r'\s*[,;|/]\s*')
+WORD_RE = re.compile(r'[a-z0-9]+(?:-[a-z0-9]+)*')
+
+def table_version():
+    """Digest of the taxonomy tables; cached mappings of another version are stale."""
+    tables = json.dumps([CATEGORIES, ALIASES, KEYWORDS, FUZZY_CUTOFF], sort_keys=True)
+    return hashlib.blake2b(tables.encode('utf-8'), digest_size=8).hexdigest()
+
+def label_parts(label):
+    """Lowercased parts of a raw label, which may be a list or a "[...]" string."""
+    if isinstance(label, (list, tuple)):
+        return [part for item in label for part in label_parts(item)]
+    text = str(label).lower().strip().strip('[]')
+    parts = (part.strip(' \'"') for part in SPLIT_RE.split(text))
+    return [' '.join(part.split()) for part in parts if part.strip(' \'"')]
+
+def resolve_part(part):
+    """Canonical categories of one label part."""
+    if part in ALIASES:
+        return ALIASES[part]
+    close = difflib.get_close_matches(part, list(ALIASES), n=1, cutoff=FUZZY_CUTOFF)
+    if close:
+        return ALIASES[close[0]]
+    found = []
+    for word in WORD_RE.findall(part):
+        category = KEYWORDS.get(word) or KEYWORDS.get(word.split('-')[0])
+        if category and category not in found:
+            found.append(category)
+    return tuple(found) or ('other',)
+
+class CategoryMapper:
+    """Raw label -> category bitmask, memoized in memory and on disk."""
+
+    def __init__(self, cache_path=CACHE_PATH):
+        self.cache_path = cache_path
+        self.version = table_version()
+        self.masks = {}
+        self._dirty = False
+        self._lock = threading.RLock()
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached.get('version') == self.version:
+                self.masks = cached['labels']
+
+    def mask(self, label):
+        """Bitmask of a raw label; missing labels have no categories."""
+        if label is None or (not isinstance(label, (list, tuple)) and pd.isna(label)):
+            return 0
+        key = label if isinstance(label, str) else json.dumps(list(label))
+        with self._lock:
+            if key not in self.masks:
+                mask = 0
+                for part in label_parts(label):
+                    for category in resolve_part(part):
+                        mask |= BITS[category]
+                self.masks[key] = mask
+                self._dirty = True
+            return self.masks[key]
+
+    def mask_column(self, labels):
+        """Bitmasks of a column of labels, resolving each distinct label once."""
+        labels = pd.Series(labels)
+        codes, uniques = pd.factorize(labels.map(
+            lambda label: json.dumps(list(label)) if isinstance(label, (list, tuple)) else label))
+        unique_masks = np.array([self.mask(label) for label in uniques], dtype=np.int64)
+        masks = np.zeros(len(codes), dtype=np.int64)
+        masks[codes >= 0] = unique_masks[codes[codes >= 0]]
+        return pd.Series(masks, index=labels.index)
+
+    def save(self):
+        """Write new mappings to the cache file."""
+        with self._lock:
+            if not self._dirty or not self.cache_path:
+                return
+            directory = os.path.dirname(self.cache_path)
+            ensure_directory(directory)
+            # A temporary file of its own, in case another process saves at the same time
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='category_map.',
+                                            suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'version': self.version, 'labels': self.masks}, f, indent=4,
+                              sort_keys=True)
+                os.replace(tmp_path, self.cache_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self._dirty = False
+
+_mapper = None
+_mapper_lock = threading.Lock()
+
+def get_mapper():
+    """Process-wide mapper, loaded from the cache on first use."""
+    global _mapper
+    with _mapper_lock:
+        if _mapper is None:
+            _mapper = CategoryMapper()
+        return _mapper
+
+def category_masks(labels, save=True):
+    """Category bitmask of each raw label, using and updating the shared cache."""
+    mapper = get_mapper()
+    masks = mapper.mask_column(labels)
+    if save:
+        mapper.save()
+    return masks
+
+def category_names(mask):
+    """Canonical categories of a bitmask, in taxonomy order."""
+    return [name for name in CATEGORIES if int(mask) & BITS[name]]
+
+def category_labels(masks):
+    """Comma-separated canonical categories of each mask; NaN when a row has none."""
+    masks = pd.Series(masks)
+    names = {mask: ', '.join(category_names(mask)) or None for mask in masks.unique()}
+    return masks.map(names)
+
+def has_category(masks, *names, match_all=False):
+    """Boolean array of the rows having any (or all) of the given categories."""
+    bits = 0
+    for name in names:
+        bits |= BITS[name]
+    masks = np.asarray(masks, dtype=np.int64)
+    return (masks & bits) == bits if match_all else (masks & bits) != 0
+
+def category_counts(masks):
+    """Number of rows in each category, largest first; a row counts once per category."""
+    masks = np.asarray(masks, dtype=np.int64)
+    counts = {name: int(((masks >> i) & 1).sum()) for i, name in enumerate(CATEGORIES)}
+    return dict(sorted(((name, n) for name, n in counts.items() if n),
+                       key=lambda item: item[1], reverse=True))
+
+def main():
+    """Show how the raw categories of CSV files map onto the taxonomy"""
+    parser = argparse.ArgumentParser(description='Map raw categories onto the taxonomy')
+    parser.add_argument('files', nargs='+', help='CSV files with a category or tags column')
+    args = parser.parse_args()
+
+    labels = pd.concat([pd.read_csv(path).filter(['category', 'tags']).iloc[:, 0]
+                        for path in args.files], ignore_index=True)
+    counts = labels.str.lower().value_counts()
+    masks = category_masks(counts.index)
+    for label, count, mask in zip(counts.index, counts, masks):
+        print(f"{count:>6}  {label:<45} -> {', '.join(category_names(mask))}")
+    print(f"\n{len(counts)} distinct labels, {len(get_mapper().masks)} cached in {CACHE_PATH}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Linking articles to external records such as ClinicalTrials.gov studies."""
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+"""
+Link articles to their ClinicalTrials.gov studies.
+
+Terms come from the entity index (data_processing.entities): the NCT IDs an
+article cites, and for clinical trial updates without one, the drug and
+indication named in the title. They are resolved against the v2 API:
+
+    NCT IDs      batched BATCH_SIZE per request with filter.ids
+    drug terms   one query.intr/query.cond/query.spons search per distinct term
+
+Every request follows nextPageToken and runs on one pooled async HTTP client
+with at most `concurrency` requests in flight. Study records and search
+results are cached in SQLite for `ttl` seconds, so re-runs only ask for what
+is missing or expired. The result is one row per (article, study) pair in
+data/enrichment/article_studies.csv.
+
+The API root can be pointed at the stand-in server in replay_server.py with
+--base-url or CT_API_URL, and --record saves every response page so that it
+can be replayed later.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+import httpx
+import pandas as pd
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from enrichment.schema import project_page, resolve_fields
+from utils.common import DATA_DIR, ensure_directory, setup_logging
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = os.getenv('CT_API_URL', 'https://clinicaltrials.gov/api/v2')
+CACHE_PATH = os.path.join(DATA_DIR, 'cache', 'clinical_trials.db')
+OUTPUT_PATH = os.path.join(DATA_DIR, 'enrichment', 'article_studies.csv')
+FIELDS = ('NCTId,BriefTitle,OverallStatus,Phase,Condition,InterventionName,LeadSponsorName,'
+          'StartDate,PrimaryCompletionDate,EnrollmentCount')
+BATCH_SIZE = 100  # NCT IDs per filter.ids request
+PAGE_SIZE = 100
+MAX_SEARCH_STUDIES = 20  # studies kept per drug/indication search
+CONCURRENCY = 8
+TTL = 7 * 24 * 3600  # seconds a cached record is trusted
+RETRIES = 3
+SPONSORS = {'pfizer': 'Pfizer', 'merck': 'Merck Sharp & Dohme', 'lilly': 'Eli Lilly'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS studies (
+    nct_id TEXT PRIMARY KEY,
+    record TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS searches (
+    query TEXT PRIMARY KEY,
+    nct_ids TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+"""
+
+def flatten_study(study):
+    """Flat dict of the fields we keep from a v2 study record."""
+    protocol = study.get('protocolSection', {})
+    identification = protocol.get('identificationModule', {})
+    status = protocol.get('statusModule', {})
+    design = protocol.get('designModule', {})
+    interventions = protocol.get('armsInterventionsModule', {}).get('interventions', [])
+    return {
+        'nct_id': identification.get('nctId'),
+        'brief_title': identification.get('briefTitle'),
+        'overall_status': status.get('overallStatus'),
+        'phases': '|'.join(design.get('phases', [])),
+        'conditions': '|'.join(protocol.get('conditionsModule', {}).get('conditions', [])),
+        'interventions': '|'.join(item.get('name', '') for item in interventions),
+        'lead_sponsor': protocol.get('sponsorCollaboratorsModule', {})
+                                .get('leadSponsor', {}).get('name'),
+        'start_date': status.get('startDateStruct', {}).get('date'),
+        'primary_completion_date': status.get('primaryCompletionDateStruct', {}).get('date'),
+        'enrollment': design.get('enrollmentInfo', {}).get('count'),
+    }
+
+class StudyCache:
+    """Study records and search results with a time to live, in SQLite."""
+
+    def __init__(self, path=CACHE_PATH, ttl=TTL):
+        self.path = path
+        self.ttl = ttl
+        if path != ':memory:':
+            ensure_directory(os.path.dirname(path))
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def studies(self, nct_ids):
+        """Fresh cached records of the given IDs, by NCT ID; None for IDs the API does not know."""
+        cutoff = time.time() - self.ttl
+        found = {}
+        ids = list(nct_ids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT nct_id, record FROM studies WHERE fetched_at >= ? "
+                f"AND nct_id IN ({','.join('?' * len(chunk))})", [cutoff, *chunk])
+            found.update((nct_id, json.loads(record)) for nct_id, record in rows)
+        return found
+
+    def put_studies(self, records, unknown=()):
+        """Cache records, and the IDs of the unknown ones so they are not asked for again."""
+        now = time.time()
+        rows = [(record['nct_id'], json.dumps(record), now)
+                for record in records if record.get('nct_id')]
+        rows += [(nct_id, 'null', now) for nct_id in unknown]
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO studies VALUES (?, ?, ?)', rows)
+
+    def search(self, query):
+        """NCT IDs a search returned, or None if it is not cached or expired."""
+        row = self.conn.execute('SELECT nct_ids FROM searches WHERE query = ? AND fetched_at >= ?',
+                                (query, time.time() - self.ttl)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_search(self, query, nct_ids):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO searches VALUES (?, ?, ?)',
+                              (query, json.dumps(nct_ids), time.time()))
+
+class ClinicalTrialsClient:
+    """Async v2 API client sharing one connection pool between requests."""
+
+    def __init__(self, base_url=BASE_URL, concurrency=CONCURRENCY, timeout=30, record_dir=None,
+                 fields=FIELDS):
+        self.base_url = base_url.rstrip('/')
+        # Checked against the schema up front rather than failing on the first request
+        self.fields = ','.join(fields) if not isinstance(fields, str) else fields
+        self.paths = resolve_fields(self.fields)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.record_dir = record_dir
+        self.requests = 0
+        self._client = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        limits = httpx.Limits(max_connections=self.concurrency,
+                              max_keepalive_connections=self.concurrency)
+        self._client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+
+    async def _get(self, params):
+        """One response page, retrying rate limits and server errors with backoff."""
+        for attempt in range(RETRIES):
+            async with self._semaphore:
+                response = await self._client.get(f'{self.base_url}/studies', params=params)
+                self.requests += 1
+            if response.status_code == 429 or response.status_code >= 500:
+                await asyncio.sleep(2 ** attempt)
+                continue
+            response.raise_for_status()
+            if self.record_dir:
+                self._record(params, response.text)
+            # Large pages keep only the requested paths, whatever else the server sends
+            return project_page(response.text, self.paths)
+        response.raise_for_status()
+
+    def _record(self, params, text):
+        ensure_directory(self.record_dir)
+        name = f'{time.time_ns()}.json'
+        with open(os.path.join(self.record_dir, name), 'w') as f:
+            f.write(f'{{"params": {json.dumps(params)}, "response": {text}}}')
+
+    async def studies(self, params, limit=None):
+        """Flattened studies of a query, following nextPageToken (up to limit studies)."""
+        params = {'format': 'json', 'fields': self.fields,
+                  'pageSize': min(PAGE_SIZE, limit) if limit else PAGE_SIZE, **params}
+        studies = []
+        while True:
+            page = await self._get(params)
+            studies.extend(flatten_study(study) for study in page.get('studies', []))
+            token = page.get('nextPageToken')
+            if not token or (limit and len(studies) >= limit):
+                return studies[:limit] if limit else studies
+            params = {**params, 'pageToken': token}
+
+    async def by_ids(self, nct_ids):
+        """Records of the given NCT IDs, BATCH_SIZE IDs per request, batches in parallel."""
+        ids = sorted(set(nct_ids))
+        batches = [ids[i:i + BATCH_SIZE] for i in range(0, len(ids), BATCH_SIZE)]
+        results = await asyncio.gather(*(self.studies({'filter.ids': ','.join(batch)})
+                                         for batch in batches))
+        return [study for batch in results for study in batch]
+
+def search_params(drug, indication=None, company=None):
+    """Search parameters for a drug, optionally with a condition and the company as sponsor."""
+    params = {'query.intr': drug}
+    if indication:
+        params['query.cond'] = indication
+    if company in SPONSORS:
+        params['query.spons'] = SPONSORS[company]
+    return params
+
+def collect_terms(entity_db):
+    """Per article, the NCT IDs it cites and the drug/indication pairs of its title.
+
+    Returns (articles, citations, searches): article metadata by doc id, (doc id,
+    NCT ID) pairs, and (doc id, drug, indication) triples for clinical trial
+    updates that cite no NCT ID.
+    """
+    from data_processing.taxonomy import BITS
+
+    conn = sqlite3.connect(entity_db)
+    articles = pd.read_sql_query(
+        'SELECT id AS doc_id, url, company, date, title, category_mask FROM docs', conn
+    ).set_index('doc_id')
+    mentions = pd.read_sql_query('SELECT entity, doc_id, in_title FROM mentions', conn)
+    conn.close()
+
+    kind = mentions['entity'].str.split(':', n=1).str[0]
+    value = mentions['entity'].str.split(':', n=1).str[1]
+    citations = list(zip(mentions['doc_id'][kind == 'nct'], value[kind == 'nct']))
+
+    cited = {doc_id for doc_id, _ in citations}
+    trial_docs = set(articles.index[(articles['category_mask']
+                                     & BITS['clinical trial update']) != 0]) - cited
+    in_title = mentions[(mentions['in_title'] == 1) & mentions['doc_id'].isin(trial_docs)]
+    is_drug = in_title['entity'].str.startswith('drug:')
+    is_indication = in_title['entity'].str.startswith('indication:')
+    drugs = in_title[is_drug].groupby('doc_id')['entity'].first().str[len('drug:'):]
+    indications = (in_title[is_indication].groupby('doc_id')['entity'].first()
+                   .str[len('indication:'):])
+    searches = [(doc_id, drug, indications.get(doc_id)) for doc_id, drug in drugs.items()]
+    return articles, citations, searches
+
+async def enrich(entity_db, cache, base_url=BASE_URL, concurrency=CONCURRENCY, record_dir=None):
+    """Article/study rows for every article in the entity index.
+
+    Returns (links dataframe, number of API requests made).
+    """
+    articles, citations, searches = collect_terms(entity_db)
+
+    search_keys = {}
+    for doc_id, drug, indication in searches:
+        params = search_params(drug, indication, articles.at[doc_id, 'company'])
+        search_keys[doc_id] = json.dumps(params, sort_keys=True)
+
+    async with ClinicalTrialsClient(base_url, concurrency, record_dir=record_dir) as client:
+        async def search(key):
+            studies = await client.studies(json.loads(key), MAX_SEARCH_STUDIES)
+            cache.put_studies(studies)
+            cache.put_search(key, [study['nct_id'] for study in studies])
+
+        # Searches whose results are not cached, all in flight at once. Each is cached as
+        # it completes, so a failed one only leaves itself to the next run
+        pending = {key for key in search_keys.values() if cache.search(key) is None}
+        results = await asyncio.gather(*(search(key) for key in pending), return_exceptions=True)
+        failed = [result for result in results if isinstance(result, BaseException)]
+        if failed:
+            logger.error(f"{len(failed)} of {len(pending)} searches failed")
+            raise failed[0]
+
+        searched = {doc_id: cache.search(key) or [] for doc_id, key in search_keys.items()}
+        wanted = {nct_id for _, nct_id in citations}
+        wanted.update(nct_id for ids in searched.values() for nct_id in ids)
+        missing = wanted - set(cache.studies(wanted))
+        if missing:
+            records = await client.by_ids(missing)
+            cache.put_studies(records, missing - {record['nct_id'] for record in records})
+        requests = client.requests
+
+    studies = cache.studies(wanted)
+    links = [(doc_id, nct_id, 'nct') for doc_id, nct_id in citations]
+    links += [(doc_id, nct_id, 'search') for doc_id, ids in searched.items() for nct_id in ids]
+    rows = []
+    for doc_id, nct_id, match in links:
+        if studies.get(nct_id):
+            rows.append({**articles.loc[doc_id, ['company', 'date', 'title', 'url']].to_dict(),
+                         'match': match, **studies[nct_id]})
+    return pd.DataFrame(rows), requests
+
+def main():
+    """Link the articles of the entity index to ClinicalTrials.gov studies"""
+    from data_processing.entities import DB_PATH as ENTITY_DB
+
+    parser = argparse.ArgumentParser(description='Enrich articles with ClinicalTrials.gov studies')
+    parser.add_argument('--entities', default=ENTITY_DB, help='Entity index database')
+    parser.add_argument('--output', default=OUTPUT_PATH, help='Article/study CSV to write')
+    parser.add_argument('--base-url', default=BASE_URL, help='API root (default: CT_API_URL or '
+                                                             'clinicaltrials.gov)')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                        help='Requests in flight at once')
+    parser.add_argument('--ttl', type=float, default=TTL / 3600,
+                        help='Hours cached studies and searches are reused')
+    parser.add_argument('--cache', default=CACHE_PATH, help='Study cache database')
+    parser.add_argument('--record', metavar='DIR', help='Save every response page to DIR')
+    args = parser.parse_args()
+    setup_logging()
+
+    started = time.perf_counter()
+    with StudyCache(args.cache, args.ttl * 3600) as cache:
+        links, requests = asyncio.run(enrich(args.entities, cache, args.base_url,
+                                             args.concurrency, args.record))
+    ensure_directory(os.path.dirname(args.output))
+    links.to_csv(args.output, index=False)
+    articles = links['url'].nunique() if len(links) else 0
+    studies = links['nct_id'].nunique() if len(links) else 0
+    logger.info(f"Linked {articles} articles to {studies} studies ({len(links)} rows) with "
+                f"{requests} API requests in {time.perf_counter() - started:.1f}s -> {args.output}")
+
+if __name__ == "__main__":
+    main()
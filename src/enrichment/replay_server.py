@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+"""
+Local stand-in for the ClinicalTrials.gov v2 studies endpoint.
+
+Serves the study records of responses recorded with
+`clinical_trials.py --record DIR` (or any directory of v2 JSON pages), so the
+enrichment can be run and timed without the network:
+
+    python src/enrichment/replay_server.py DIR --port 8765
+    python src/enrichment/clinical_trials.py --base-url http://127.0.0.1:8765/api/v2
+
+GET /api/v2/studies supports filter.ids, query.term, query.intr, query.cond,
+query.spons, pageSize and pageToken. Query terms match case-insensitively
+anywhere in the matching section of a record, which is close enough to the
+real ranking for replaying the same requests.
+"""
+
+import argparse
+import glob
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Record section each query parameter searches
+QUERY_SECTIONS = {
+    'query.term': None,
+    'query.intr': 'armsInterventionsModule',
+    'query.cond': 'conditionsModule',
+    'query.spons': 'sponsorCollaboratorsModule',
+}
+DEFAULT_PAGE_SIZE = 10
+
+def load_recordings(directory):
+    """Study records by NCT ID from the recorded pages in a directory."""
+    studies = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(path) as f:
+            page = json.load(f)
+        for study in page.get('response', page).get('studies', []):
+            nct_id = study.get('protocolSection', {}).get('identificationModule', {}).get('nctId')
+            if nct_id:
+                studies[nct_id] = study
+    return studies
+
+def _section_text(study, section):
+    protocol = study.get('protocolSection', {})
+    return json.dumps(protocol if section is None else protocol.get(section, {})).lower()
+
+def matching_studies(studies, query):
+    """Records matching the filters of a parsed query string, in NCT ID order."""
+    selected = sorted(studies)
+    if 'filter.ids' in query:
+        wanted = {nct_id.strip().upper() for value in query['filter.ids']
+                  for nct_id in value.replace('|', ',').split(',')}
+        selected = [nct_id for nct_id in selected if nct_id in wanted]
+    for parameter, section in QUERY_SECTIONS.items():
+        if parameter in query:
+            term = query[parameter][0].lower()
+            selected = [nct_id for nct_id in selected
+                        if term in _section_text(studies[nct_id], section)]
+    return [studies[nct_id] for nct_id in selected]
+
+class StudiesHandler(BaseHTTPRequestHandler):
+    studies = {}
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip('/') != '/api/v2/studies':
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        matches = matching_studies(self.studies, query)
+        size = int(query.get('pageSize', [DEFAULT_PAGE_SIZE])[0])
+        offset = int(query.get('pageToken', ['0'])[0])
+        page = {'studies': matches[offset:offset + size]}
+        if offset + size < len(matches):
+            page['nextPageToken'] = str(offset + size)
+
+        body = json.dumps(page).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(directory, host='127.0.0.1', port=0):
+    """Start the server in a background thread; returns it (server.server_port is the port)."""
+    handler = type('Handler', (StudiesHandler,), {'studies': load_recordings(directory)})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    """Serve recorded ClinicalTrials.gov responses"""
+    parser = argparse.ArgumentParser(description='Stand-in ClinicalTrials.gov v2 server')
+    parser.add_argument('directory', help='Directory of recorded response pages')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    handler = type('Handler', (StudiesHandler,), {'studies': load_recordings(args.directory)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Serving {len(handler.studies)} studies on "
+          f"http://{args.host}:{server.server_port}/api/v2/studies")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+"""
+ClinicalTrials.gov v2 study schema and field projection.
+
+`metatada.json` at the project root is the API's field tree (454 nodes) as a
+Python literal, which only `ast.literal_eval` can read. It is parsed once into
+an index of piece name -> path and saved as real JSON in data/cache, keyed by
+the size and modification time of the source, so later loads are a plain
+json.load.
+
+`fields=` lists are validated against the index, and `project_page` walks a
+response's JSON text keeping only the requested paths. Everything else is
+decoded one value at a time and thrown away, so a page full of resultsSection
+data never exists as one Python object tree: peak memory is a study, not a
+page.
+
+    python src/enrichment/schema.py fields NCTId Phase Condition
+    python src/enrichment/schema.py bench response.json --fields NCTId,BriefTitle
+"""
+
+import argparse
+import ast
+import difflib
+import json
+import logging
+import os
+import re
+import sys
+import time
+import tracemalloc
+from functools import lru_cache
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.common import (DATA_DIR, PROJECT_ROOT, ensure_directory, flush_logging,
+                          setup_logging)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = os.path.join(PROJECT_ROOT, 'metatada.json')
+CACHE_PATH = os.path.join(DATA_DIR, 'cache', 'ct_schema.json')
+
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+# Below this, json.loads of the whole page is several times faster than the
+# projecting walk and the extra fields cost next to nothing
+STREAM_MIN_CHARS = 1 << 20
+
+_decoder = json.JSONDecoder()
+
+def compile_schema(tree):
+    """Index of a field tree: piece -> {path, type, list} and alternative piece names."""
+    pieces = {}
+    aliases = {}
+
+    def walk(nodes, path):
+        for node in nodes:
+            node_path = path + [node['name']]
+            pieces[node['piece']] = {
+                'path': '.'.join(node_path),
+                'type': node['type'],
+                'list': node['type'].endswith('[]'),
+                'source_type': node['sourceType'],
+            }
+            for alias in node.get('altPieceNames', []):
+                aliases[alias] = node['piece']
+            walk(node.get('children', []), node_path)
+
+    walk(tree, [])
+    return {'pieces': pieces, 'aliases': aliases}
+
+@lru_cache(maxsize=None)
+def load_schema(schema_path=SCHEMA_PATH, cache_path=CACHE_PATH):
+    """Compiled schema, from the JSON cache when it matches the source file."""
+    stat = os.stat(schema_path)
+    source = [stat.st_size, stat.st_mtime_ns]
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get('source') == source:
+            return cached['schema']
+
+    with open(schema_path) as f:
+        schema = compile_schema(ast.literal_eval(f.read()))
+    if cache_path:
+        ensure_directory(os.path.dirname(cache_path))
+        tmp_path = f'{cache_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'source': source, 'schema': schema}, f)
+        os.replace(tmp_path, cache_path)
+    return schema
+
+def resolve_fields(fields, schema=None):
+    """Dotted paths of a fields= list of piece names, alternative names or paths.
+
+    Raises ValueError naming the unknown fields and their closest pieces.
+    """
+    schema = schema or load_schema()
+    pieces, aliases = schema['pieces'], schema['aliases']
+    by_lower = {piece.lower(): piece for piece in pieces}
+    known_paths = {info['path'] for info in pieces.values()}
+
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    paths, unknown = [], []
+    for field in (field.strip() for field in fields):
+        piece = aliases.get(field) or by_lower.get(field.lower())
+        if piece:
+            paths.append(pieces[piece]['path'])
+        elif field in known_paths:
+            paths.append(field)
+        elif field:
+            unknown.append(field)
+    if unknown:
+        hints = []
+        for field in unknown:
+            close = difflib.get_close_matches(field, list(pieces), n=1)
+            hints.append(f"{field} (did you mean {close[0]}?)" if close else field)
+        raise ValueError(f"Unknown study fields: {', '.join(hints)}")
+    return paths
+
+def projection(paths):
+    """Nested dict of path components; True marks a value to keep whole."""
+    tree = {}
+    for path in paths:
+        node = tree
+        *parents, last = path.split('.')
+        for name in parents:
+            child = node.setdefault(name, {})
+            if child is True:
+                break
+            node = child
+        else:
+            node[last] = True
+    return tree
+
+def _project_value(text, i, tree):
+    """(projected value, end index) of the value at text[i]."""
+    if tree is True:
+        return _decoder.raw_decode(text, i)
+    char = text[i]
+    if char == '{':
+        return _project_object(text, i, tree)
+    if char == '[':
+        values = []
+        i = WHITESPACE_RE.match(text, i + 1).end()
+        if text[i] == ']':
+            return values, i + 1
+        while True:
+            value, i = _project_value(text, i, tree)
+            values.append(value)
+            i = WHITESPACE_RE.match(text, i).end()
+            if text[i] == ']':
+                return values, i + 1
+            i = WHITESPACE_RE.match(text, i + 1).end()  # past the comma
+    return _decoder.raw_decode(text, i)
+
+def _project_object(text, i, tree):
+    """(dict of the keys in tree, end index) of the object at text[i]."""
+    result = {}
+    i = WHITESPACE_RE.match(text, i + 1).end()
+    if text[i] == '}':
+        return result, i + 1
+    while True:
+        key, i = _decoder.raw_decode(text, i)
+        i = WHITESPACE_RE.match(text, i).end()
+        i = WHITESPACE_RE.match(text, i + 1).end()  # past the colon
+        if key in tree:
+            result[key], i = _project_value(text, i, tree[key])
+        else:
+            # Decoded by the C scanner and dropped at once, so at most one
+            # unrequested subtree is alive at a time
+            _, i = _decoder.raw_decode(text, i)
+        i = WHITESPACE_RE.match(text, i).end()
+        if text[i] == '}':
+            return result, i + 1
+        i = WHITESPACE_RE.match(text, i + 1).end()  # past the comma
+
+def project_page(text, paths):
+    """Studies of a v2 response page with only the given dotted paths, and its nextPageToken.
+
+    Pages shorter than STREAM_MIN_CHARS are decoded whole, unprojected.
+    """
+    if len(text) < STREAM_MIN_CHARS:
+        return json.loads(text)
+    tree = {'studies': projection(paths), 'nextPageToken': True}
+    page, _ = _project_object(text, WHITESPACE_RE.match(text, 0).end(), tree)
+    return page
+
+def benchmark(path, fields, repeat=3):
+    """Best-of-repeat seconds and peak traced bytes of reading a recorded page in full and projected."""
+    with open(path) as f:
+        text = f.read()
+    if text.startswith('{"params"'):
+        # A clinical_trials.py --record file; only the response is benchmarked
+        text = json.dumps(json.loads(text)['response'])
+    paths = resolve_fields(fields)
+    results = {}
+    for name, parse in (('json.loads', json.loads),
+                        ('projected', lambda text: project_page(text, paths))):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            parse(text)
+            best = min(best, time.perf_counter() - started)
+        tracemalloc.start()
+        parse(text)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = (best, peak)
+    return len(text), results
+
+def main():
+    """Look up study fields or benchmark projected parsing"""
+    parser = argparse.ArgumentParser(description='ClinicalTrials.gov study schema')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    fields_parser = subparsers.add_parser('fields', help='Resolve field names to paths')
+    fields_parser.add_argument('fields', nargs='+', help='Piece names or dotted paths')
+    bench_parser = subparsers.add_parser('bench', help='Time full and projected parsing')
+    bench_parser.add_argument('files', nargs='+', help='Recorded v2 response pages')
+    bench_parser.add_argument('--fields', default='NCTId,BriefTitle,OverallStatus,Phase',
+                              help='Comma-separated fields to project')
+    args = parser.parse_args()
+    setup_logging()
+
+    started = time.perf_counter()
+    schema = load_schema()
+    logger.info(f"Schema of {len(schema['pieces'])} fields loaded in "
+                f"{(time.perf_counter() - started) * 1000:.1f} ms")
+    if args.command == 'fields':
+        try:
+            paths = resolve_fields(args.fields, schema)
+        except ValueError as e:
+            sys.exit(str(e))
+        flush_logging()
+        for field, path in zip(args.fields, paths):
+            info = schema['pieces'].get(field) or {}
+            print(f"{field:<28} {path}  {info.get('type', '')}")
+    else:
+        for path in args.files:
+            size, results = benchmark(path, args.fields)
+            flush_logging()
+            print(f"{path}: {size / 1e6:.1f} MB")
+            for name, (seconds, peak) in results.items():
+                print(f"  {name:<11} {seconds * 1000:8.1f} ms  peak {peak / 1e6:7.1f} MB")
+
+if __name__ == "__main__":
+    main()
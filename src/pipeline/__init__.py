@@ -0,0 +1 @@
+"""Scheduling and orchestration of the scraping and processing stages."""
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+"""
+Continuous ingestion daemon.
+
+Each company is refreshed on its own interval, with jitter, using a headless
+browser and an HTTP session that stay open between cycles. A cycle only walks
+the listing pages until it reaches articles that are already known, then runs
+the clean, body and body-cleaning stages on the new rows, stores them in the
+article store, appends them to the existing datasets and folds them into the
+statistics. Every cycle is traced (see utils.metrics) and the run log is
+flushed after each one.
+"""
+
+import asyncio
+import importlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from utils import metrics as run_metrics
+from utils.common import (DATA_DIR, append_to_csv, canonical_url, ensure_directory, log_context,
+                          save_to_csv)
+
+logger = logging.getLogger(__name__)
+
+COMPANIES = ('pfizer', 'merck', 'lilly')
+DEFAULT_INTERVAL = 900  # seconds between refreshes of a company
+DEFAULT_JITTER = 60  # +/- seconds added to every interval
+DEFAULT_MAX_PAGES = 2
+METRICS_PATH = os.path.join(DATA_DIR, 'stats', 'daemon_metrics.json')
+
+def parse_intervals(values, companies=COMPANIES):
+    """Parse interval arguments given as '<seconds>' or '<company>=<seconds>'."""
+    intervals = {company: DEFAULT_INTERVAL for company in companies}
+    for value in values or []:
+        if '=' in value:
+            company, seconds = value.split('=', 1)
+            if company not in intervals:
+                raise ValueError(f"Unknown company in interval: {company}")
+            intervals[company] = float(seconds)
+        else:
+            intervals = {company: float(value) for company in intervals}
+    return intervals
+
+def next_delay(interval, jitter):
+    """Seconds to wait before the next cycle, randomised by the jitter."""
+    return max(0.0, interval + random.uniform(-jitter, jitter))
+
+def _timestamp(seconds):
+    return datetime.fromtimestamp(seconds).isoformat(timespec='seconds')
+
+async def scrape_new_articles(company, page, known_urls, max_pages):
+    """Run the company's listing scraper until it reaches known articles."""
+    scraper = importlib.import_module(f'scrapers.{company}_scraper')
+    if company == 'lilly':
+        return await scraper.scrape_listing(page, start_page=1, stop_page=max_pages,
+                                            known_urls=known_urls)
+    return await scraper.scrape_listing(page, max_pages=max_pages, known_urls=known_urls)
+
+class IngestionDaemon:
+    """Keep the company datasets up to date without supervision."""
+
+    def __init__(self, companies=COMPANIES, intervals=None, jitter=DEFAULT_JITTER,
+                 max_pages=DEFAULT_MAX_PAGES, engine='jina', metrics_path=METRICS_PATH,
+                 boilerplate_path=None, db_path=None, classifier_path=None):
+        self.companies = list(companies)
+        self.intervals = intervals or parse_intervals(None, self.companies)
+        self.jitter = jitter
+        self.max_pages = max_pages
+        self.engine = engine
+        self.metrics_path = metrics_path
+        self.boilerplate_path = boilerplate_path
+        self.boilerplate = None
+        self._boilerplate_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.classifier = None
+        if classifier_path:
+            from data_processing.classifier import CategoryClassifier
+            self.classifier = CategoryClassifier.load(classifier_path)
+        self.session = None
+        self.db_path = db_path
+        self.repo = None
+        self.known_urls = {}
+        self.metrics = {
+            company: {
+                'interval_seconds': self.intervals[company],
+                'runs': 0,
+                'failures': 0,
+                'consecutive_failures': 0,
+                'last_run': None,
+                'last_success': None,
+                'last_duration_seconds': None,
+                'last_new_articles': 0,
+                'total_new_articles': 0,
+                'newest_article_date': None,
+                'publication_lag_seconds': None,
+                'next_run': None,
+                'last_error': None,
+            }
+            for company in self.companies
+        }
+        self._last_success = {}
+
+    def _paths(self, company):
+        filename = f'{company}_news_cleaned.csv'
+        return {
+            'clean': os.path.join(DATA_DIR, 'clean', filename),
+            'processed': os.path.join(DATA_DIR, 'processed', filename),
+            'output': os.path.join(DATA_DIR, 'output', filename),
+        }
+
+    def _known_urls(self, company):
+        """Canonical URLs already in the article store, loaded once and kept in memory.
+
+        Blocking (the first call may import the clean CSV), so run_cycle runs it in a thread.
+        """
+        if company not in self.known_urls:
+            clean_path = self._paths(company)['clean']
+            if not self.repo.count(company) and os.path.exists(clean_path):
+                self.repo.import_csv(clean_path, company)
+            self.known_urls[company] = self.repo.known_urls(company)
+        return self.known_urls[company]
+
+    def ingest(self, company, articles):
+        """Run the clean, body and body-cleaning stages on newly scraped articles."""
+        from data_processing.clean_body import clean_bodies
+        from data_processing.clean_data import clean_articles
+        from scrapers.populate_body import populate_bodies
+
+        raw_path = save_to_csv(articles, f'{company}_news', os.path.join(DATA_DIR, 'raw', company))
+        logger.info(f"[{company}] Saved {len(articles)} new articles to {raw_path}")
+
+        with run_metrics.span('clean', company=company, rows=len(articles)):
+            df = clean_articles(articles)
+        if df.empty:
+            return df
+        if self.classifier is None:
+            self.repo.upsert_articles(df, company)
+            self._append(df, company, 'clean')
+
+        with run_metrics.span('bodies', company=company, rows=len(df)):
+            df = populate_bodies(df, session=self.session, engine=self.engine)
+        with run_metrics.span('clean-bodies', company=company, rows=len(df)):
+            templates = self._learn_boilerplate(df)
+            clean_body = clean_bodies(df['body'], urls=df['url'], templates=templates)
+        if self.classifier is not None:
+            # The model needs the cleaned body, so the clean stage is written once it has run
+            from data_processing.classifier import route_categories
+
+            routed = route_categories(df.assign(body=clean_body), self.classifier)
+            df = routed.assign(body=df['body']).drop(columns=['category_confidence',
+                                                              'category_source'])
+            logger.info(f"[{company}] {(routed['category_source'] == 'llm').sum()} of {len(df)} "
+                        f"categories left to the LLM")
+            self.repo.upsert_articles(df, company)
+            self._append(df.drop(columns=['body']), company, 'clean')
+
+        self.repo.set_bodies(zip(df['url'], df['body']))
+        self._append(df, company, 'processed')
+
+        df['body'] = clean_body
+        self.repo.set_bodies(zip(df['url'], df['body']), 'clean_body')
+        self._append(df, company, 'output')
+        logger.info(f"[{company}] Appended {len(df)} articles to {self._paths(company)['output']}")
+        with run_metrics.span('stats', company=company, rows=len(df)):
+            self._update_stats(df, company)
+        return df
+
+    def _append(self, df, company, stage):
+        """Append rows to a stage's CSV and, if it is in use, its Parquet dataset."""
+        append_to_csv(df, self._paths(company)[stage])
+        if os.path.isdir(os.path.join(DATA_DIR, 'dataset', stage)):
+            from storage.parquet_store import write_articles
+            write_articles(df, stage, company, append=True)
+
+    def _update_stats(self, df, company):
+        """Fold new articles into the statistics state, then rewrite the cubes and statistics."""
+        from data_processing.cube import save_cubes
+        from data_processing.stats_state import StatsState, write_statistics
+
+        with self._stats_lock, StatsState() as state:
+            state.ingest(df.assign(company=company))
+            cubes = state.cubes()
+            save_cubes(cubes)
+            # Plots are left to generate_stats, which redraws the ones whose numbers changed
+            write_statistics(state.statistics(cubes))
+
+    def _learn_boilerplate(self, df):
+        """Add new bodies to the boilerplate model and return its template lines."""
+        if not self.boilerplate_path:
+            return None
+
+        from data_processing.boilerplate import BoilerplateModel
+        from data_processing.clean_body import learn_boilerplate
+
+        with self._boilerplate_lock:
+            if self.boilerplate is None:
+                self.boilerplate = BoilerplateModel.load(self.boilerplate_path)
+            if learn_boilerplate(df, self.boilerplate):
+                self.boilerplate.save(self.boilerplate_path)
+            return self.boilerplate.templates()
+
+    async def run_cycle(self, company, page):
+        """Scrape and process the new articles of one company."""
+        started = time.time()
+        metrics = self.metrics[company]
+        metrics['runs'] += 1
+        metrics['last_run'] = _timestamp(started)
+
+        try:
+            known_urls = await asyncio.to_thread(self._known_urls, company)
+            articles = await scrape_new_articles(company, page, known_urls, self.max_pages)
+            logger.info(f"[{company}] Found {len(articles)} new articles")
+
+            if articles:
+                df = await asyncio.to_thread(self.ingest, company, articles)
+                known_urls.update(canonical_url(article.get('url')) for article in articles)
+                if not df.empty:
+                    newest = df['date'].max()
+                    metrics['newest_article_date'] = newest.strftime('%Y-%m-%d')
+                    metrics['publication_lag_seconds'] = round(
+                        time.time() - newest.timestamp(), 1)
+
+            self._last_success[company] = time.time()
+            metrics['last_success'] = _timestamp(self._last_success[company])
+            metrics['last_new_articles'] = len(articles)
+            metrics['total_new_articles'] += len(articles)
+            metrics['consecutive_failures'] = 0
+            metrics['last_error'] = None
+        except Exception as e:
+            logger.exception(f"[{company}] Error during cycle: {e}")
+            metrics['failures'] += 1
+            metrics['consecutive_failures'] += 1
+            metrics['last_error'] = str(e)
+        finally:
+            metrics['last_duration_seconds'] = round(time.time() - started, 2)
+
+    def write_metrics(self):
+        """Write last-run and lag metrics for every company to JSON."""
+        now = time.time()
+        for company, metrics in self.metrics.items():
+            last_success = self._last_success.get(company)
+            metrics['seconds_since_success'] = (
+                round(now - last_success, 1) if last_success else None)
+
+        ensure_directory(os.path.dirname(self.metrics_path))
+        tmp_path = f'{self.metrics_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'updated_at': _timestamp(now), 'companies': self.metrics}, f, indent=4)
+        os.replace(tmp_path, self.metrics_path)
+        run_metrics.flush()
+
+    async def _schedule(self, browser, company, once):
+        """Refresh one company forever on its own interval."""
+        import agentql
+
+        from scrapers.harness import open_page
+
+        # Stagger the first runs so companies do not all start at once
+        if not once:
+            await asyncio.sleep(random.uniform(0, self.jitter))
+
+        page = await agentql.wrap_async(await open_page(browser))
+        while True:
+            with run_metrics.span('cycle', company=company), log_context(company=company):
+                await self.run_cycle(company, page)
+
+            if self.metrics[company]['consecutive_failures']:
+                # Start from a fresh page in case the old one is in a bad state
+                await page.context.close()
+                page = await agentql.wrap_async(await open_page(browser))
+
+            if once:
+                self.write_metrics()
+                break
+
+            delay = next_delay(self.intervals[company], self.jitter)
+            self.metrics[company]['next_run'] = _timestamp(time.time() + delay)
+            self.write_metrics()
+            await asyncio.sleep(delay)
+
+    async def run(self, once=False):
+        """Run every company's schedule concurrently on one shared browser."""
+        from playwright.async_api import async_playwright
+        from scrapers.populate_body import create_session
+        from storage.sql_store import DB_PATH, ArticleRepository
+
+        self.session = create_session()
+        self.repo = ArticleRepository(self.db_path or DB_PATH)
+        async with async_playwright() as playwright:
+            browser = await playwright.chromium.launch(headless=True)
+            try:
+                await asyncio.gather(*(
+                    self._schedule(browser, company, once) for company in self.companies
+                ))
+            finally:
+                self.session.close()
+                self.repo.close()
+                await browser.close()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+"""
+Minimal task graph runner with cached outputs.
+
+Each task declares the files it reads and writes and the tasks it depends
+on. A task is skipped when its cache key, a hash of its input files, its
+parameters and its version, matches the last successful run and all its
+outputs still exist. Tasks whose dependencies are done run in parallel on a
+thread pool. A task that returns False is not cached. Every task that runs
+is timed as a span named after its stage (see utils.metrics).
+"""
+
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils import metrics
+from utils.common import DATA_DIR, ensure_directory, log_context
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = os.path.join(DATA_DIR, 'cache', 'pipeline.json')
+
+def file_digest(path, digest=None):
+    """Update a hash with a file's name and content, or mark it missing."""
+    digest = digest or hashlib.blake2b(digest_size=16)
+    digest.update(os.path.basename(path).encode('utf-8'))
+    if not os.path.exists(path):
+        digest.update(b'<missing>')
+        return digest
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest
+
+class Task:
+    """One unit of work: a function, its input and output files and dependencies.
+
+    inputs may be a callable so that the file list is resolved when the task
+    is about to run, after its dependencies have written them.
+    """
+
+    def __init__(self, name, stage, func, inputs=(), outputs=(), deps=(), params=None,
+                 version=1):
+        self.name = name
+        self.stage = stage
+        self.func = func
+        self.inputs = inputs
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.params = params or {}
+        self.version = version
+
+    def input_paths(self):
+        return sorted(self.inputs() if callable(self.inputs) else self.inputs)
+
+    def cache_key(self):
+        """Hash of the inputs' content, the parameters and the task version."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([self.name, self.version, self.params],
+                                 sort_keys=True, default=str).encode('utf-8'))
+        for path in self.input_paths():
+            file_digest(path, digest)
+        return digest.hexdigest()
+
+class DAG:
+    """Run tasks in dependency order, in parallel, skipping cached ones."""
+
+    def __init__(self, tasks, cache_path=CACHE_PATH, workers=None):
+        self.tasks = {task.name: task for task in tasks}
+        self.cache_path = cache_path
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.cache = {}
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                self.cache = json.load(f)
+
+    def _save_cache(self):
+        ensure_directory(os.path.dirname(self.cache_path))
+        tmp_path = f'{self.cache_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.cache, f, indent=4)
+        os.replace(tmp_path, self.cache_path)
+
+    def _execute(self, task, force):
+        """Run one task unless its cached outputs are current.
+
+        Returns (status, seconds, cache key).
+        """
+        started = time.perf_counter()
+        key = task.cache_key()
+        if (not force and self.cache.get(task.name, {}).get('key') == key
+                and all(os.path.exists(path) for path in task.outputs)):
+            return 'cached', time.perf_counter() - started, key
+
+        # A task returns False when its outputs are incomplete and it should run again
+        with metrics.span(task.stage, task=task.name), log_context(task=task.name):
+            complete = task.func(**task.params) is not False
+        return 'ran' if complete else 'partial', time.perf_counter() - started, key
+
+    def run(self, selected=None, force=False):
+        """Run the selected tasks (all by default).
+
+        Dependencies outside the selection are assumed to be done. Returns a
+        dict of task name to (status, seconds); status is 'ran', 'partial'
+        (not cached), 'cached', 'failed' or 'skipped' when a dependency failed.
+        """
+        selected = set(self.tasks if selected is None else selected)
+        remaining = {name: [dep for dep in self.tasks[name].deps if dep in selected]
+                     for name in selected}
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = {}
+            while remaining or running:
+                ready = [name for name, deps in remaining.items()
+                         if all(dep in results for dep in deps)]
+                if not ready and not running:
+                    raise ValueError(f"Dependency cycle among: {', '.join(sorted(remaining))}")
+                for name in ready:
+                    deps = remaining.pop(name)
+                    if any(results[dep][0] in ('failed', 'skipped') for dep in deps):
+                        results[name] = ('skipped', 0.0)
+                        logger.warning(f"[{name}] skipped, a dependency failed")
+                        continue
+                    logger.info(f"[{name}] started")
+                    # Run in a copy of this context, so task spans nest under the caller's
+                    context = contextvars.copy_context()
+                    running[executor.submit(context.run, self._execute, self.tasks[name],
+                                            force)] = name
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        status, seconds, key = future.result()
+                    except Exception as e:
+                        logger.error(f"[{name}] failed: {e}")
+                        results[name] = ('failed', 0.0)
+                        continue
+                    results[name] = (status, seconds)
+                    logger.info(f"[{name}] {status} in {seconds:.2f}s")
+                    if status == 'ran':
+                        self.cache[name] = {'key': key,
+                                            'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+                        self._save_cache()
+
+        return results
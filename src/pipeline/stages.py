@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+"""
+Processing stages of `main.py process`, declared as a task graph.
+
+Per company:
+
+    merge -> clean -> bodies -> clean-bodies
+
+then `dedup`, the full-text search `index` and the `entities` index over
+every company's cleaned bodies, `trials` linking the indexed articles to
+ClinicalTrials.gov studies, and `stats` once every company is cleaned and
+deduplicated. Companies run in parallel, and every task is skipped when its
+inputs have not changed since it last ran.
+"""
+
+import glob
+import logging
+import os
+import time
+from collections import Counter
+
+import pandas as pd
+
+from pipeline.dag import DAG, Task
+from utils import metrics
+from utils.common import DATA_DIR, canonical_url, flush_logging
+
+logger = logging.getLogger(__name__)
+
+COMPANIES = ('pfizer', 'merck', 'lilly')
+STAGES = ('merge', 'clean', 'bodies', 'clean-bodies', 'dedup', 'index', 'entities', 'trials',
+          'stats')
+MERGED_DIR = os.path.join(DATA_DIR, 'merged')
+
+def company_paths(company):
+    """Files each stage writes for a company."""
+    filename = f'{company}_news_cleaned.csv'
+    return {
+        'raw': os.path.join(DATA_DIR, 'raw', company),
+        'merged': os.path.join(MERGED_DIR, f'{company}_news.csv'),
+        'clean': os.path.join(DATA_DIR, 'clean', filename),
+        'processed': os.path.join(DATA_DIR, 'processed', filename),
+        'output': os.path.join(DATA_DIR, 'output', filename),
+    }
+
+def _write_csv(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def snapshot_files(company):
+    """Raw snapshots of a company, newest first (the file names start with a timestamp)."""
+    pattern = os.path.join(company_paths(company)['raw'], f'{company}_news_*.csv')
+    return sorted(glob.glob(pattern), key=os.path.basename, reverse=True)
+
+def merge_snapshots(company):
+    """Combine all raw snapshots of a company into one file.
+
+    An article is taken from the newest snapshot that has it; rows of older
+    snapshots are only added for URLs the newer ones do not list.
+    """
+    from data_processing.clean_data import normalize_columns
+
+    seen = set()
+    frames = []
+    for path in snapshot_files(company):
+        df = normalize_columns(pd.read_csv(path))
+        keys = df['url'].map(canonical_url)
+        frames.append(df[~keys.isin(seen)])
+        seen.update(keys)
+    if not frames:
+        raise FileNotFoundError(f"No raw snapshots for {company}")
+    _write_csv(pd.concat(frames, ignore_index=True), company_paths(company)['merged'])
+
+def clean_company(company):
+    """Normalize dates and categories of the merged snapshot."""
+    from data_processing.clean_data import incremental_clean_news_data
+    from data_processing.manifest import Manifest
+
+    paths = company_paths(company)
+    date_stats = Counter()
+    os.makedirs(os.path.dirname(paths['clean']), exist_ok=True)
+    with Manifest() as manifest:
+        df, cleaned = incremental_clean_news_data(paths['merged'], paths['clean'], manifest,
+                                                  company, date_stats)
+    metrics.annotate(rows=len(df))
+    logger.info(f"[clean:{company}] {len(df)} rows, {cleaned} recleaned, "
+                f"date formats: {dict(date_stats.most_common())}")
+
+def populate_company(company, engine='jina', delay=1, max_fetch=None):
+    """Carry over the bodies fetched before and fetch the missing ones.
+
+    Returns False while bodies are still missing, so the task runs again.
+    """
+    from scrapers.populate_body import populate_bodies
+
+    paths = company_paths(company)
+    df = pd.read_csv(paths['clean'])
+    if os.path.exists(paths['processed']):
+        previous = pd.read_csv(paths['processed'], usecols=['url', 'body']).dropna()
+        bodies = dict(zip(previous['url'].map(canonical_url), previous['body']))
+        df['body'] = df['url'].map(canonical_url).map(bodies)
+
+    df = populate_bodies(df, engine=engine, delay=delay, limit=max_fetch)
+    _write_csv(df, paths['processed'])
+    missing = int(df['body'].isna().sum())
+    metrics.annotate(rows=len(df))
+    logger.info(f"[bodies:{company}] {len(df) - missing} of {len(df)} bodies")
+    return missing == 0
+
+def clean_company_bodies(company, workers=1):
+    """Clean the bodies that changed since the last run."""
+    from data_processing.clean_body import process_files
+    from data_processing.manifest import Manifest
+
+    paths = company_paths(company)
+    with Manifest() as manifest:
+        process_files([paths['processed']], os.path.dirname(paths['output']), workers,
+                      manifest=manifest)
+
+def find_duplicates(companies):
+    """Add new cleaned bodies to the near-duplicate index."""
+    from data_processing.dedup import INDEX_PATH, DedupIndex, dedupe_files
+
+    index = DedupIndex.load(INDEX_PATH)
+    # The clusters are read from the index; rewriting the files would change this task's inputs
+    added = dedupe_files([company_paths(company)['output'] for company in companies], index,
+                         write=False)
+    index.save(INDEX_PATH)
+    logger.info(f"[dedup] {added} new articles signed, {len(index.keys)} in the index")
+
+def update_search_index(companies):
+    """Add new and changed cleaned articles to the full-text search index."""
+    from search.index import SearchIndex, index_files
+
+    index = SearchIndex()
+    added = index_files([company_paths(company)['output'] for company in companies], index)
+    logger.info(f"[index] {added} articles indexed, {len(index)} searchable")
+
+def extract_entities(companies, workers=1):
+    """Index the drugs, indications, phases and NCT IDs of new and changed articles."""
+    from data_processing.entities import EntityIndex, build_index
+
+    with EntityIndex() as index:
+        indexed = build_index([company_paths(company)['output'] for company in companies],
+                              index, workers)
+    logger.info(f"[entities] {indexed} articles indexed")
+
+def link_trials():
+    """Link the articles of the entity index to their ClinicalTrials.gov studies."""
+    import asyncio
+
+    from data_processing.entities import DB_PATH as ENTITY_DB
+    from enrichment.clinical_trials import OUTPUT_PATH, StudyCache, enrich
+
+    with StudyCache() as cache:
+        links, requests = asyncio.run(enrich(ENTITY_DB, cache))
+    _write_csv(links, OUTPUT_PATH)
+    logger.info(f"[trials] {len(links)} article/study links, {requests} API requests")
+
+def compute_stats():
+    """Statistics and plots over the cleaned files of all companies."""
+    from data_processing.generate_stats import (add_duplicate_clusters, generate, load_csv,
+                                                update_state)
+    from data_processing.stats_state import StatsState
+
+    dfs, combined_df = load_csv(os.path.join(DATA_DIR, 'clean'))
+    _, combined_df = add_duplicate_clusters(dfs, combined_df)
+    with StatsState() as state:
+        update_state(state, combined_df)
+        generate(state)
+
+def build_tasks(companies=COMPANIES, engine='jina', delay=1, max_fetch=None, workers=None):
+    """Tasks of the whole pipeline for the given companies."""
+    from data_processing.clean_body import CLEANER_VERSION as BODY_CLEANER_VERSION
+    from data_processing.clean_data import cleaner_version
+    from data_processing.dedup import INDEX_PATH
+    from data_processing.entities import DB_PATH as ENTITY_DB
+    from data_processing.generate_stats import STATS_DIR, STATS_VERSION
+    from enrichment.clinical_trials import OUTPUT_PATH as TRIALS_PATH
+    from search.index import INDEX_DIR
+
+    # Share the cores between the companies' body-cleaning pools
+    workers = workers or max(1, (os.cpu_count() or 1) // len(companies))
+    tasks = []
+    for company in companies:
+        paths = company_paths(company)
+        tasks += [
+            Task(f'merge:{company}', 'merge', merge_snapshots,
+                 inputs=lambda company=company: snapshot_files(company),
+                 outputs=[paths['merged']], params={'company': company}),
+            Task(f'clean:{company}', 'clean', clean_company,
+                 inputs=[paths['merged']], outputs=[paths['clean']],
+                 deps=[f'merge:{company}'], params={'company': company},
+                 version=cleaner_version()),
+            Task(f'bodies:{company}', 'bodies', populate_company,
+                 inputs=[paths['clean']], outputs=[paths['processed']],
+                 deps=[f'clean:{company}'],
+                 params={'company': company, 'engine': engine, 'delay': delay,
+                         'max_fetch': max_fetch}),
+            Task(f'clean-bodies:{company}', 'clean-bodies', clean_company_bodies,
+                 inputs=[paths['processed']], outputs=[paths['output']],
+                 deps=[f'bodies:{company}'], params={'company': company, 'workers': workers},
+                 version=BODY_CLEANER_VERSION),
+        ]
+    tasks.append(Task('dedup', 'dedup', find_duplicates,
+                      inputs=[company_paths(company)['output'] for company in companies],
+                      outputs=[INDEX_PATH],
+                      deps=[f'clean-bodies:{company}' for company in companies],
+                      params={'companies': list(companies)}))
+    tasks.append(Task('index', 'index', update_search_index,
+                      inputs=[company_paths(company)['output'] for company in companies],
+                      outputs=[INDEX_DIR],
+                      deps=[f'clean-bodies:{company}' for company in companies],
+                      params={'companies': list(companies)}))
+    tasks.append(Task('entities', 'entities', extract_entities,
+                      inputs=[company_paths(company)['output'] for company in companies],
+                      outputs=[ENTITY_DB],
+                      deps=[f'clean-bodies:{company}' for company in companies],
+                      params={'companies': list(companies),
+                              'workers': workers * len(companies)}))
+    tasks.append(Task('trials', 'trials', link_trials, inputs=[ENTITY_DB],
+                      outputs=[TRIALS_PATH], deps=['entities']))
+    tasks.append(Task('stats', 'stats', compute_stats,
+                      inputs=[company_paths(company)['clean'] for company in COMPANIES]
+                             + [INDEX_PATH],
+                      outputs=[os.path.join(STATS_DIR, 'pharma_news_stats.json')],
+                      deps=[f'clean:{company}' for company in companies] + ['dedup'],
+                      version=STATS_VERSION))
+    return tasks
+
+def select_tasks(tasks, start=None, only=None):
+    """Names of the tasks of one stage (only) or of a stage and those after it (start)."""
+    if only:
+        stages = {only}
+    elif start:
+        stages = set(STAGES[STAGES.index(start):])
+    else:
+        stages = set(STAGES)
+    return [task.name for task in tasks if task.stage in stages]
+
+def print_timings(tasks, results):
+    """Per-task status and time, then the total time of each stage."""
+    flush_logging()
+    print(f"\n{'Task':<24} {'Status':<8} {'Seconds':>8}")
+    totals = Counter()
+    for task in tasks:
+        if task.name in results:
+            status, seconds = results[task.name]
+            totals[task.stage] += seconds
+            print(f"{task.name:<24} {status:<8} {seconds:>8.2f}")
+    print()
+    for stage in STAGES:
+        if stage in totals:
+            print(f"{stage:<24} {'':<8} {totals[stage]:>8.2f}")
+
+def run_pipeline(companies=COMPANIES, start=None, only=None, force=False, engine='jina',
+                 delay=1, max_fetch=None, workers=None):
+    """Run the pipeline and print per-stage timings; returns False if a task failed."""
+    tasks = build_tasks(companies, engine, delay, max_fetch, workers)
+    started = time.perf_counter()
+    results = DAG(tasks).run(select_tasks(tasks, start, only), force)
+    print_timings(tasks, results)
+    print(f"\nTotal: {time.perf_counter() - started:.2f}s")
+    return all(status in ('ran', 'partial', 'cached') for status, _ in results.values())
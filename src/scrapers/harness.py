@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+
+"""
+Record/replay harness for running the scrapers and body fetchers offline.
+
+A local HTTP server stands in for the news sites and the paid APIs:
+
+    /site?url=...            the sites, served from recorded HAR files
+    /agentql/api/v2/...      AgentQL (point AGENTQL_API_HOST at /agentql)
+    /jina/<url>              Jina reader (JINA_URL)
+    /spider/crawl            Spider (SPIDER_URL)
+    /firecrawl/v1/scrape     Firecrawl (FIRECRAWL_API_URL)
+    /harness/stats           requests served, by service
+
+Record a crawl once with the live sites and APIs. Pages record their traffic
+to DIR/site.har and the server proxies every API call, saving it to
+DIR/api.jsonl:
+
+    python src/scrapers/harness.py record pfizer data/recordings/pfizer --bodies 20
+
+Then replay it as often as needed, with no network, optionally with added
+latency and injected errors (503s, drawn from a seeded generator):
+
+    python src/scrapers/harness.py run pfizer data/recordings/pfizer --latency agentql=800
+
+Without recordings the mocks answer from checked-in data: AgentQL returns the
+listing rows in data/raw page by page, and the body APIs the bodies in
+data/output_scraping.zip. `serve` starts the server alone and prints the
+environment that points any scraper at it.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+import zipfile
+from base64 import b64decode
+from collections import Counter, defaultdict
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.common import (DATA_DIR, canonical_url, ensure_directory, flush_logging, load_env,
+                          setup_logging)
+
+logger = logging.getLogger(__name__)
+
+RAW_DIR = os.path.join(DATA_DIR, 'raw')
+BODIES_ZIP = os.path.join(DATA_DIR, 'output_scraping.zip')
+COMPANIES = ['pfizer', 'merck', 'lilly']
+SERVICES = ('site', 'agentql', 'jina', 'spider', 'firecrawl')
+UPSTREAM = {
+    'agentql': 'https://api.agentql.com',
+    'jina': 'https://r.jina.ai',
+    'spider': 'https://api.spider.cloud',
+    'firecrawl': 'https://api.firecrawl.dev',
+}
+PAGE_SIZE = 50  # listing rows per mock AgentQL response
+# Hop-by-hop and encoding headers; bodies are replayed decoded
+DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+
+@lru_cache(maxsize=None)
+def listing_rows(company):
+    """Listing rows of a company as AgentQL returns them, from its raw CSV snapshots."""
+    import pandas as pd
+
+    paths = sorted(glob.glob(os.path.join(RAW_DIR, company, '*.csv')))
+    df = pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+    df = df.drop_duplicates('url')
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+@lru_cache(maxsize=None)
+def stored_articles():
+    """Articles with bodies of every company, from data/output_scraping.zip."""
+    import pandas as pd
+
+    frames = []
+    with zipfile.ZipFile(BODIES_ZIP) as archive:
+        for company in COMPANIES:
+            with archive.open(f'output_scrapping/{company}_news_cleaned.csv') as f:
+                frames.append(pd.read_csv(f).assign(company=company))
+    return pd.concat(frames, ignore_index=True)
+
+@lru_cache(maxsize=None)
+def _bodies_by_url():
+    articles = stored_articles().dropna(subset=['body'])
+    return dict(zip(articles['url'].map(canonical_url), articles['body']))
+
+def mock_body(url):
+    """Stored body of an article URL, or a placeholder for unknown ones."""
+    return _bodies_by_url().get(canonical_url(url)) or f"# {url}\n\nNo recorded body.\n"
+
+def company_of(url):
+    """Company whose site a URL is on, or None."""
+    host = urlsplit(url or '').netloc
+    return next((company for company in COMPANIES if company in host), None)
+
+def parse_settings(values, default=0.0):
+    """{service: value} from [SERVICE=]VALUE options; a bare value applies to every service."""
+    settings = dict.fromkeys(SERVICES, default)
+    for value in values or []:
+        service, _, number = value.rpartition('=')
+        if service and service not in SERVICES:
+            raise ValueError(f"Unknown service {service!r}, expected one of {', '.join(SERVICES)}")
+        for name in ([service] if service else SERVICES):
+            settings[name] = float(number)
+    return settings
+
+class Recordings:
+    """Recorded responses by request key; repeats of a key get its responses in turn."""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.responses = defaultdict(list)
+        self.served = Counter()
+        self.lock = threading.Lock()
+        if not directory:
+            return
+        for path in sorted(glob.glob(os.path.join(directory, '*.har'))):
+            self._load_har(path)
+        api_path = os.path.join(directory, 'api.jsonl')
+        if os.path.exists(api_path):
+            with open(api_path) as f:
+                for line in f:
+                    exchange = json.loads(line)
+                    self.responses[tuple(exchange['key'])].append(
+                        (exchange['status'], exchange['headers'],
+                         exchange['body'].encode('utf-8')))
+
+    def _load_har(self, path):
+        with open(path) as f:
+            entries = json.load(f)['log']['entries']
+        for entry in entries:
+            request, response = entry['request'], entry['response']
+            content = response.get('content', {})
+            body = content.get('text', '')
+            body = b64decode(body) if content.get('encoding') == 'base64' else body.encode('utf-8')
+            headers = [(header['name'], header['value']) for header in response['headers']
+                       if header['name'].lower() not in DROPPED_HEADERS]
+            self.responses[('site', request['method'], request['url'])].append(
+                (response['status'], headers, body))
+
+    def __len__(self):
+        return sum(len(responses) for responses in self.responses.values())
+
+    def get(self, key):
+        """(status, headers, body) recorded for a key, or None."""
+        with self.lock:
+            responses = self.responses.get(key)
+            if not responses:
+                return None
+            index = self.served[key] % len(responses)
+            self.served[key] += 1
+            return responses[index]
+
+    def add(self, key, status, headers, body):
+        """Record an API exchange, appended to DIR/api.jsonl."""
+        content_type = dict((name.lower(), value) for name, value in headers).get('content-type')
+        exchange = {'key': list(key), 'status': status,
+                    'headers': [['Content-Type', content_type]] if content_type else [],
+                    'body': body.decode('utf-8', errors='replace')}
+        with self.lock:
+            self.responses[key].append((status, exchange['headers'], body))
+            ensure_directory(self.directory)
+            with open(os.path.join(self.directory, 'api.jsonl'), 'a') as f:
+                f.write(json.dumps(exchange) + '\n')
+
+class HarnessHandler(BaseHTTPRequestHandler):
+    recordings = Recordings()
+    record = False  # proxy API calls upstream and record them
+    latency = dict.fromkeys(SERVICES, 0.0)  # milliseconds per request
+    error_rate = dict.fromkeys(SERVICES, 0.0)
+    rng = random.Random(0)  # draws the injected errors
+    stats = Counter()
+    lock = threading.Lock()
+    listing_offsets = Counter()  # next mock AgentQL row by company
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        if url.path == '/harness/stats':
+            self._send(200, [('Content-Type', 'application/json')],
+                       json.dumps(dict(self.stats)).encode('utf-8'))
+            return
+        service = url.path.strip('/').split('/')[0]
+        if service not in SERVICES:
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            key = self._key(service, url, body)
+        except ValueError as e:
+            self.send_error(400, f"Bad request: {e}")
+            return
+
+        with self.lock:
+            self.stats[service] += 1
+            if service == 'site' and parse_qs(url.query).get('type') == ['document']:
+                self.stats['site_pages'] += 1
+            failed = not self.record and self.rng.random() < self.error_rate[service]
+            if failed:
+                self.stats['errors_injected'] += 1
+        if not self.record and self.latency[service]:
+            time.sleep(self.latency[service] / 1000)
+        if failed:
+            self._send(503, [('Content-Type', 'text/plain')], b'Injected error')
+            return
+
+        response = self.recordings.get(key)
+        if response is None and self.record and service != 'site':
+            response = self._proxy(service, url, body)
+            self.recordings.add(key, *response)
+        if response is None:
+            response = self._mock(service, url, body)
+        if response is None:
+            self.send_error(404, f"Nothing recorded for {key}")
+            return
+        self._send(*response)
+
+    @staticmethod
+    def _payload(body):
+        """JSON object of a request body; ValueError if it is not one."""
+        payload = json.loads(body or b'{}')
+        if not isinstance(payload, dict):
+            raise ValueError("the body is not a JSON object")
+        return payload
+
+    def _key(self, service, url, body):
+        """What identifies a request among the recordings; ValueError for a malformed one."""
+        if service == 'site':
+            query = parse_qs(url.query)
+            if 'url' not in query:
+                raise ValueError("/site needs a url parameter")
+            return ('site', query.get('method', ['GET'])[0], query['url'][0])
+        if service == 'jina':
+            return ('jina', unquote(self.path[len('/jina/'):]))
+        payload = self._payload(body)
+        if service == 'agentql':
+            return ('agentql', url.path, payload.get('metadata', {}).get('url'),
+                    ' '.join(payload.get('query', '').split()))
+        return (service, url.path, payload.get('url'))
+
+    def _proxy(self, service, url, body):
+        """Forward a request to the real API; returns its (status, headers, body)."""
+        import httpx
+
+        path = url.path[len(service) + 1:] + (f'?{url.query}' if url.query else '')
+        headers = {name: value for name, value in self.headers.items()
+                   if name.lower() not in DROPPED_HEADERS | {'host'}}
+        response = httpx.request(self.command, UPSTREAM[service] + path, headers=headers,
+                                 content=body, timeout=120, follow_redirects=True)
+        headers = [(name, value) for name, value in response.headers.items()
+                   if name.lower() not in DROPPED_HEADERS]
+        return response.status_code, headers, response.content
+
+    def _mock(self, service, url, body):
+        """Response made up from the checked-in data, or None."""
+        json_type = [('Content-Type', 'application/json')]
+        if service == 'site':
+            if parse_qs(url.query).get('type') != ['document']:
+                return None
+            return 200, [('Content-Type', 'text/html')], b'<html><body></body></html>'
+        if service == 'jina':
+            text = mock_body(unquote(self.path[len('/jina/'):]))
+            return 200, [('Content-Type', 'text/plain')], text.encode('utf-8')
+
+        payload = self._payload(body)
+        if service == 'agentql':
+            company = company_of(payload.get('metadata', {}).get('url'))
+            if not url.path.endswith('/query-data') or company is None:
+                return None
+            rows = listing_rows(company)
+            with self.lock:
+                offset = self.listing_offsets[company] % len(rows)
+                self.listing_offsets[company] += PAGE_SIZE
+            data = {'request_id': uuid.uuid4().hex,
+                    'response': {'articles': rows[offset:offset + PAGE_SIZE]}}
+        elif service == 'spider':
+            data = [{'url': payload.get('url'), 'content': mock_body(payload.get('url'))}]
+        else:
+            data = {'success': True, 'data': {'markdown': mock_body(payload.get('url')),
+                                              'metadata': {'sourceURL': payload.get('url')}}}
+        return 200, json_type, json.dumps(data).encode('utf-8')
+
+    def _send(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(directory=None, host='127.0.0.1', port=0, record=False, latency=None,
+          error_rate=None, seed=0):
+    """Start the harness in a background thread; returns it (server.server_port is the port)."""
+    handler = type('Handler', (HarnessHandler,), {
+        'recordings': Recordings(directory),
+        'record': record,
+        'latency': latency or dict.fromkeys(SERVICES, 0.0),
+        'error_rate': error_rate or dict.fromkeys(SERVICES, 0.0),
+        'rng': random.Random(seed),
+        'stats': Counter(),
+        'listing_offsets': Counter(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def harness_env(url, replay_site=True):
+    """Environment pointing the scrapers and body fetchers at a harness at url."""
+    env = {
+        'AGENTQL_API_HOST': f'{url}/agentql',
+        'JINA_URL': f'{url}/jina/',
+        'SPIDER_URL': f'{url}/spider/crawl',
+        'FIRECRAWL_API_URL': f'{url}/firecrawl',
+    }
+    if replay_site:
+        env['HARNESS_URL'] = url
+    return env
+
+async def _serve_from_harness(route):
+    """Fulfill a browser request from the harness at HARNESS_URL instead of the network."""
+    harness = os.environ['HARNESS_URL'].rstrip('/')
+    request = route.request
+    if request.url.startswith(harness):
+        await route.continue_()
+        return
+    response = await route.fetch(
+        url=f"{harness}/site?url={quote(request.url, safe='')}&method={request.method}"
+            f"&type={request.resource_type}",
+        method=request.method, post_data=request.post_data_buffer)
+    await route.fulfill(response=response)
+
+async def open_page(browser):
+    """New scraping page on its own browser context.
+
+    With SCRAPER_HAR set the context records its traffic to that HAR file (written
+    when the context closes); with HARNESS_URL set every request is served by the
+    harness there instead of the network.
+    """
+    har_path = os.getenv('SCRAPER_HAR')
+    options = {}
+    if har_path:
+        ensure_directory(os.path.dirname(os.path.abspath(har_path)))
+        options = {'record_har_path': har_path, 'record_har_content': 'embed'}
+    context = await browser.new_context(**options)
+    if os.getenv('HARNESS_URL'):
+        await context.route('**/*', _serve_from_harness)
+    return await context.new_page()
+
+async def crawl(company, max_pages, bodies, engine):
+    """Scrape a company's listing and fetch some bodies; returns the counts and timings."""
+    import agentql
+    from playwright.async_api import async_playwright
+
+    from pipeline.daemon import scrape_new_articles
+    from scrapers.populate_body import create_session, fetch_article_body
+
+    started = time.perf_counter()
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch(headless=True)
+        try:
+            raw_page = await open_page(browser)
+            page = await agentql.wrap_async(raw_page)
+            articles = await scrape_new_articles(company, page, set(), max_pages)
+            await raw_page.context.close()
+        finally:
+            await browser.close()
+    listing_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    session = create_session()
+    fetched = sum(1 for article in articles[:bodies]
+                  if fetch_article_body(article['url'], session, engine))
+    session.close()
+    return {'articles': len(articles), 'bodies_fetched': fetched,
+            'listing_seconds': round(listing_seconds, 3),
+            'bodies_seconds': round(time.perf_counter() - started, 3)}
+
+def measure(company, directory=None, record=False, max_pages=2, bodies=10, engine='jina',
+            latency=None, error_rate=None, seed=0):
+    """Run a crawl against a harness serving (or recording to) directory; returns its report."""
+    import asyncio
+
+    load_env()  # the real keys when recording; replays only need AgentQL to see one
+    server = serve(directory, record=record, latency=latency, error_rate=error_rate, seed=seed)
+    url = f'http://127.0.0.1:{server.server_port}'
+    env = harness_env(url, replay_site=not record)
+    if record:
+        env['SCRAPER_HAR'] = os.path.join(directory, 'site.har')
+    else:
+        env.setdefault('AGENTQL_API_KEY', os.getenv('AGENTQL_API_KEY') or 'harness')
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        started = time.perf_counter()
+        report = asyncio.run(crawl(company, max_pages, bodies, engine))
+        wall = time.perf_counter() - started
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        server.shutdown()
+
+    stats = server.RequestHandlerClass.stats
+    return {
+        'company': company, 'recordings': directory, 'engine': engine,
+        'wall_seconds': round(wall, 3), **report,
+        'site_pages': stats['site_pages'],
+        'pages_per_second': round(stats['site_pages'] / report['listing_seconds'], 2)
+        if report['listing_seconds'] else None,
+        'llm_calls': stats['agentql'],
+        'body_requests': stats['jina'] + stats['spider'] + stats['firecrawl'],
+        'errors_injected': stats['errors_injected'],
+        'requests': {service: stats[service] for service in SERVICES},
+    }
+
+def main():
+    """Serve, record or replay a crawl through the harness"""
+    parser = argparse.ArgumentParser(description='Offline record/replay harness for the scrapers')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_fault_arguments(subparser):
+        subparser.add_argument('--latency', action='append', metavar='[SERVICE=]MS',
+                               help='Delay added to every response (repeatable)')
+        subparser.add_argument('--error-rate', action='append', metavar='[SERVICE=]RATE',
+                               help='Share of requests answered with a 503 (repeatable)')
+        subparser.add_argument('--seed', type=int, default=0, help='Seed of the injected errors')
+
+    def add_crawl_arguments(subparser):
+        subparser.add_argument('company', choices=COMPANIES)
+        subparser.add_argument('--max-pages', type=int, default=2, help='Listing pages to scrape')
+        subparser.add_argument('--bodies', type=int, default=10,
+                               help='Bodies to fetch from the scraped articles')
+        subparser.add_argument('--engine', choices=['jina', 'spider'], default='jina',
+                               help='API used to fetch article bodies')
+
+    serve_parser = subparsers.add_parser('serve', help='Run the harness server')
+    serve_parser.add_argument('directory', nargs='?', help='Recordings to serve')
+    serve_parser.add_argument('--record', action='store_true',
+                              help='Proxy API calls to the real services and record them')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8766)
+    add_fault_arguments(serve_parser)
+
+    record_parser = subparsers.add_parser('record', help='Record a live crawl')
+    add_crawl_arguments(record_parser)
+    record_parser.add_argument('directory', help='Where to save site.har and api.jsonl')
+
+    run_parser = subparsers.add_parser('run', help='Replay a crawl and measure it')
+    add_crawl_arguments(run_parser)
+    run_parser.add_argument('directory', nargs='?',
+                            help='Recordings to replay (default: mocks from checked-in data)')
+    run_parser.add_argument('--output', help='Also write the report JSON here')
+    add_fault_arguments(run_parser)
+    args = parser.parse_args()
+    setup_logging()
+
+    try:
+        latency = parse_settings(getattr(args, 'latency', None))
+        error_rate = parse_settings(getattr(args, 'error_rate', None))
+    except ValueError as e:
+        sys.exit(str(e))
+
+    if args.command == 'serve':
+        server = serve(args.directory, args.host, args.port, args.record, latency, error_rate,
+                       args.seed)
+        url = f'http://{args.host}:{server.server_port}'
+        logger.info(f"Serving {len(server.RequestHandlerClass.recordings)} recorded responses "
+                    f"on {url}")
+        flush_logging()
+        for name, value in harness_env(url, replay_site=not args.record).items():
+            print(f"export {name}={value}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    if args.command == 'record':
+        report = measure(args.company, args.directory, record=True, max_pages=args.max_pages,
+                         bodies=args.bodies, engine=args.engine)
+    else:
+        report = measure(args.company, args.directory, max_pages=args.max_pages,
+                         bodies=args.bodies, engine=args.engine, latency=latency,
+                         error_rate=error_rate, seed=args.seed)
+    flush_logging()
+    print(json.dumps(report, indent=2))
+    if getattr(args, 'output', None):
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
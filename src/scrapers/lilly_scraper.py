@@ -3,18 +3,23 @@
 """Lilly news scraper using AgentQL and Playwright."""
 
 import asyncio
-import pandas as pd
-from datetime import datetime
+import logging
 import os
-from dotenv import load_dotenv
-import agentql
-from agentql.ext.playwright.async_api import Page
-from playwright.async_api import async_playwright
+import sys
+from datetime import datetime
+from typing import TYPE_CHECKING
 from urllib.parse import urlparse, parse_qs, urlencode
 
-# Load environment variables
-load_dotenv()
-os.environ["AGENTQL_API_KEY"] = os.getenv("AGENTQL_API_KEY")
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import metrics
+from utils.common import filter_new_articles, load_env, log_context, setup_logging
+
+if TYPE_CHECKING:
+    from agentql.ext.playwright.async_api import Page
+
+logger = logging.getLogger(__name__)
 
 BASE_URL = "https://lilly.mediaroom.com/index.php"
 ITEMS_PER_PAGE = 50  # Changed from 100 to 50
@@ -22,7 +27,7 @@ ITEMS_PER_PAGE = 50  # Changed from 100 to 50
 START_PAGE = 5  # Modify this to start from specific page
 STOP_PAGE = 6  # Modify this to stop at specific page
 
-async def extract_news_articles(page: Page) -> list:
+async def extract_news_articles(page: 'Page') -> list:
     """Extract news articles from the current page."""
     query = """
     {
@@ -36,17 +41,19 @@ async def extract_news_articles(page: Page) -> list:
     """
     
     try:
-        print("Extracting articles...")
-        data = await page.query_data(query)
-        articles = data.get("articles", [])
-        print(f"Successfully extracted {len(articles)} articles")
+        logger.debug("Extracting articles...")
+        with metrics.span('extract', company='lilly') as span:
+            data = await page.query_data(query)
+            articles = data.get("articles", [])
+            span['rows'] = len(articles)
+        logger.debug(f"Successfully extracted {len(articles)} articles")
         
         if len(articles) < ITEMS_PER_PAGE:  # Updated to use constant
-            print(f"Warning: Fewer articles than expected ({ITEMS_PER_PAGE})")
+            logger.warning(f"Fewer articles than expected ({ITEMS_PER_PAGE})")
             
         return articles
     except Exception as e:
-        print(f"Error extracting articles: {e}")
+        logger.error(f"Error extracting articles: {e}")
         return []
 
 def get_page_url(page_num: int) -> str:
@@ -58,53 +65,85 @@ def get_page_url(page_num: int) -> str:
     else:
         return f"{BASE_URL}?s=9042&l={ITEMS_PER_PAGE}&o={offset}"
 
-async def has_next_page(page: Page) -> bool:
+async def has_next_page(page: 'Page') -> bool:
     """Check if next page exists by looking for the next button."""
     next_button = page.locator('li.wd_page_link.wd_page_next a')
     return await next_button.count() > 0
 
 def save_to_csv(articles: list):
     """Save articles to CSV file."""
+    import pandas as pd
+
     if not articles:
         return
     
     df = pd.DataFrame(articles)
     filename = f"lilly_news_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     df.to_csv(filename, index=False)
-    print(f"Saved {len(articles)} articles to {filename}")
+    logger.info(f"Saved {len(articles)} articles to {filename}")
+
+async def scrape_listing(page: 'Page', start_page: int = START_PAGE, stop_page: int = STOP_PAGE,
+                         known_urls=None) -> list:
+    """Scrape the listing pages, stopping once already-known articles show up."""
+    all_articles = []
+    
+    for page_num in range(start_page, stop_page + 1):
+        logger.info(f"Scraping page {page_num}")
+        current_url = get_page_url(page_num)
+        logger.debug(f"Loading URL: {current_url}")
+        
+        with metrics.span('navigate', company='lilly', page=page_num):
+            await page.goto(current_url)
+            await page.wait_for_load_state("networkidle")
+        await metrics.wait(10)
+        
+        articles = await extract_news_articles(page)
+        logger.info(f"Found {len(articles)} articles on this page")
+        new_articles = filter_new_articles(articles, known_urls)
+        all_articles.extend(new_articles)
+        
+        # Listing is newest first, so a known article means the rest are known too
+        if len(new_articles) < len(articles):
+            logger.info("Reached already scraped articles")
+            break
+        
+        if not await has_next_page(page):
+            logger.info("No more pages available")
+            break
+        
+    return all_articles
 
-async def main():
+async def main(headless: bool = True):
     """Main function to run the scraper."""
+    import agentql
+    from playwright.async_api import async_playwright
+
+    from data_processing.clean_data import clean_articles
+    from scrapers.harness import open_page
+    from storage.sql_store import ArticleRepository
+
+    setup_logging()
+    load_env()
     async with async_playwright() as playwright:
-        browser = await playwright.chromium.launch(headless=True)
-        page = await agentql.wrap_async(await browser.new_page())
+        browser = await playwright.chromium.launch(headless=headless)
+        raw_page = await open_page(browser)
+        page = await agentql.wrap_async(raw_page)
+        repo = ArticleRepository()
         
         try:
-            all_articles = []
-            
-            for page_num in range(START_PAGE, STOP_PAGE + 1):
-                print(f"\n=== Scraping page {page_num} ===")
-                current_url = get_page_url(page_num)
-                print(f"Loading URL: {current_url}")
-                
-                await page.goto(current_url)
-                await page.wait_for_load_state("networkidle")
-                await asyncio.sleep(10)
-                
-                articles = await extract_news_articles(page)
-                print(f"Found {len(articles)} articles on this page")
-                all_articles.extend(articles)
-                
-                if not await has_next_page(page):
-                    print("No more pages available")
-                    break
-                
-            print(f"\nTotal articles collected: {len(all_articles)}")
+            with log_context(company='lilly'):
+                all_articles = await scrape_listing(page, known_urls=repo.known_urls('lilly'))
+            logger.info(f"Total articles collected: {len(all_articles)}")
             save_to_csv(all_articles)
+            if all_articles:
+                added = repo.upsert_articles(clean_articles(all_articles), 'lilly')
+                logger.info(f"Stored {added} new articles in {repo.path}")
             
         except Exception as e:
-            print(f"Error during scraping: {e}")
+            logger.exception(f"Error during scraping: {e}")
         finally:
+            repo.close()
+            await raw_page.context.close()  # writes the HAR when recording
             await browser.close()
 
 if __name__ == "__main__":
@@ -3,22 +3,27 @@
 """Merck news scraper using AgentQL and Playwright."""
 
 import asyncio
-import pandas as pd
-from datetime import datetime, timedelta
+import logging
 import os
-from dotenv import load_dotenv
-import agentql
-from agentql.ext.playwright.async_api import Page
-from playwright.async_api import async_playwright
+import sys
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Load environment variables from .env file
-load_dotenv()
+from utils import metrics
+from utils.common import filter_new_articles, load_env, log_context, setup_logging
 
-os.environ["AGENTQL_API_KEY"] = os.getenv("AGENTQL_API_KEY")
+if TYPE_CHECKING:
+    from agentql.ext.playwright.async_api import Page
+
+logger = logging.getLogger(__name__)
 
 URL = "https://www.merck.com/media/news/"
+MAX_PAGES = 20
 
-async def extract_news_articles(page: Page) -> list:
+async def extract_news_articles(page: 'Page') -> list:
     """Extract news articles from the current page."""
     # Define the query structure matching Merck's news page HTML
     query = """
@@ -33,21 +38,23 @@ async def extract_news_articles(page: Page) -> list:
     """
     
     try:
-        print("Extracting articles...")
-        data = await page.query_data(query)
-        articles = data.get("articles", [])
-        print(f"Successfully extracted {len(articles)} articles")
+        logger.debug("Extracting articles...")
+        with metrics.span('extract', company='merck') as span:
+            data = await page.query_data(query)
+            articles = data.get("articles", [])
+            span['rows'] = len(articles)
+        logger.debug(f"Successfully extracted {len(articles)} articles")
         
         # Verify expected count
         if len(articles) < 50:
-            print("Warning: Extracted fewer articles than expected")
+            logger.warning("Extracted fewer articles than expected")
             
         return articles
     except Exception as e:
-        print(f"Error extracting articles: {e}")
+        logger.error(f"Error extracting articles: {e}")
         return []
 
-async def get_next_page(page: Page) -> bool:
+async def get_next_page(page: 'Page') -> bool:
     """Navigate to the next page by clicking the next button."""
     try:
         # Get current range before clicking
@@ -57,29 +64,29 @@ async def get_next_page(page: Page) -> bool:
         
         expected_start = current_range[1] + 1
         
-        print("Finding next page button...")
+        logger.debug("Finding next page button...")
         # Locate the next page button using class
         next_button = page.locator('div.d8-page-right.page-right')
         
         if not await next_button.count():
-            print("Next button not found")
+            logger.debug("Next button not found")
             return False
             
         # Check if button is visible
         is_visible = await next_button.is_visible()
         if not is_visible:
-            print("Next button is not visible - reached last page")
+            logger.debug("Next button is not visible - reached last page")
             return False
             
-        print("Clicking next page...")
+        logger.debug("Clicking next page...")
         # Click the button and wait for navigation
         await next_button.click()
         # Wait for page content to load
         await page.wait_for_load_state("networkidle")
         
         # Additional wait for articles to load
-        print("Waiting for articles to load...")
-        await asyncio.sleep(7)
+        logger.debug("Waiting for articles to load...")
+        await metrics.wait(7)
         
         # # Verify new page loaded correctly
         # if not await verify_next_page(page, expected_start):
@@ -89,21 +96,21 @@ async def get_next_page(page: Page) -> bool:
         return True
         
     except Exception as e:
-        print(f"Error navigating to next page: {e}")
+        logger.error(f"Error navigating to next page: {e}")
         return False
 
-async def set_items_per_page(page: Page) -> bool:
+async def set_items_per_page(page: 'Page') -> bool:
     """Set items per page to 50."""
     try:
-        print("Finding items per page dropdown...")
+        logger.debug("Finding items per page dropdown...")
         # Use Playwright's locator to find the select element
         select_element = page.locator('select[aria-label="Items per page"]')
         
         if not await select_element.count():
-            print("Items per page select not found")
+            logger.debug("Items per page select not found")
             return False
         
-        print("Selecting 50 items per page...")    
+        logger.debug("Selecting 50 items per page...")
         # Select 50 items option
         await select_element.select_option(value="50")
         
@@ -111,8 +118,8 @@ async def set_items_per_page(page: Page) -> bool:
         await page.wait_for_load_state("networkidle")
         
         # Additional wait for articles to load
-        print("Waiting for articles to load...")
-        await asyncio.sleep(6)
+        logger.debug("Waiting for articles to load...")
+        await metrics.wait(6)
         
         # # Verify 50 items are shown
         # if not await verify_items_per_page(page):
@@ -122,40 +129,42 @@ async def set_items_per_page(page: Page) -> bool:
         return True
         
     except Exception as e:
-        print(f"Error setting items per page: {e}")
+        logger.error(f"Error setting items per page: {e}")
         return False
 
-async def accept_cookies(page: Page) -> bool:
+async def accept_cookies(page: 'Page') -> bool:
     """Handle the cookie consent popup."""
     try:
-        print("Looking for cookie consent dialog...")
+        logger.debug("Looking for cookie consent dialog...")
         # Find accept button using prompt
         accept_btn = await page.get_by_prompt("Accept cookies button")
         
         if not accept_btn:
-            print("No cookie dialog found")
+            logger.debug("No cookie dialog found")
             return True
             
-        print("Accepting cookies...")
+        logger.debug("Accepting cookies...")
         await accept_btn.click()
         await page.wait_for_load_state("networkidle")
         return True
         
     except Exception as e:
-        print(f"Error handling cookie consent: {e}")
+        logger.error(f"Error handling cookie consent: {e}")
         return False
 
 def save_to_csv(articles: list):
     """Save articles to CSV file."""
+    import pandas as pd
+
     if not articles:
         return
     
     df = pd.DataFrame(articles)
     filename = f"merck_news_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     df.to_csv(filename, index=False)
-    print(f"Saved {len(articles)} articles to {filename}")
+    logger.info(f"Saved {len(articles)} articles to {filename}")
 
-async def get_pagination_range(page: Page) -> tuple:
+async def get_pagination_range(page: 'Page') -> tuple:
     """Get current pagination range from page."""
     try:
         # Get pagination text
@@ -168,10 +177,10 @@ async def get_pagination_range(page: Page) -> tuple:
         start, end = map(int, range_part.split('-'))
         return (start, end)
     except Exception as e:
-        print(f"Error getting pagination range: {e}")
+        logger.error(f"Error getting pagination range: {e}")
         return None
 
-# async def verify_items_per_page(page: Page) -> bool:
+# async def verify_items_per_page(page: 'Page') -> bool:
 #     """Verify 100 items per page is set correctly."""
 #     range_tuple = await get_pagination_range(page)
 #     if not range_tuple:
@@ -180,7 +189,7 @@ async def get_pagination_range(page: Page) -> tuple:
 #     start, end = range_tuple
 #     return (end - start + 1) == 100
 
-# async def verify_next_page(page: Page, expected_start: int) -> bool:
+# async def verify_next_page(page: 'Page', expected_start: int) -> bool:
 #     """Verify next page loaded correctly."""
 #     range_tuple = await get_pagination_range(page)
 #     if not range_tuple:
@@ -189,53 +198,79 @@ async def get_pagination_range(page: Page) -> tuple:
 #     start, end = range_tuple
 #     return start == expected_start
 
-async def main():
+async def scrape_listing(page: 'Page', max_pages: int = MAX_PAGES, known_urls=None) -> list:
+    """Scrape the listing pages, stopping once already-known articles show up."""
+    logger.debug("Opening Merck news page...")
+    with metrics.span('navigate', company='merck', page=1):
+        await page.goto(URL)
+    await metrics.wait(2)  # Wait to see the page
+    
+    # Handle cookies first
+    if not await accept_cookies(page):
+        logger.warning("Could not handle cookie consent")
+        
+    logger.debug("Setting items per page to 50...")
+    if not await set_items_per_page(page):
+        logger.warning("Could not set items per page to 50")
+    await metrics.wait(5)
+    
+    all_articles = []
+    page_num = 1
+    
+    while page_num <= max_pages:
+        logger.info(f"Scraping page {page_num}")
+        articles = await extract_news_articles(page)
+        logger.info(f"Found {len(articles)} articles on this page")
+        new_articles = filter_new_articles(articles, known_urls)
+        all_articles.extend(new_articles)
+        
+        # Listing is newest first, so a known article means the rest are known too
+        if len(new_articles) < len(articles):
+            logger.info("Reached already scraped articles")
+            break
+        
+        with metrics.span('navigate', company='merck', page=page_num + 1):
+            has_next = await get_next_page(page)
+        if not has_next:
+            logger.info("No more pages available")
+            break
+        
+        await metrics.wait(1)  # See the page transition
+        page_num += 1
+        
+    return all_articles
+
+async def main(headless: bool = True):
     """Main function to run the scraper."""
+    import agentql
+    from playwright.async_api import async_playwright
+
+    from data_processing.clean_data import clean_articles
+    from scrapers.harness import open_page
+    from storage.sql_store import ArticleRepository
+
+    setup_logging()
+    load_env()
     async with async_playwright() as playwright:
-        # Launch browser in visible mode with slower speed
-        browser = await playwright.chromium.launch(
-            headless=False,  # Make browser visible
-        )
-        page = await agentql.wrap_async(await browser.new_page())
+        browser = await playwright.chromium.launch(headless=headless)
+        raw_page = await open_page(browser)
+        page = await agentql.wrap_async(raw_page)
+        repo = ArticleRepository()
         
         try:
-            print("Opening Merck news page...")
-            await page.goto(URL)
-            await asyncio.sleep(2)  # Wait to see the page
-            
-            # Handle cookies first
-            if not await accept_cookies(page):
-                print("Warning: Could not handle cookie consent")
-                
-            print("Setting items per page to 50...")
-            if not await set_items_per_page(page):
-                print("Warning: Could not set items per page to 50")
-            await asyncio.sleep(5)
-            
-            all_articles = []
-            page_num = 1
-            max_pages = 20
-            
-            while page_num <= max_pages:
-                print(f"\n=== Scraping page {page_num} ===")
-                articles = await extract_news_articles(page)
-                print(f"Found {len(articles)} articles on this page")
-                all_articles.extend(articles)
-                
-                if not await get_next_page(page):
-                    print("No more pages available")
-                    break
-                
-                await asyncio.sleep(1)  # See the page transition
-                page_num += 1
-                
-            print(f"\nTotal articles collected: {len(all_articles)}")
+            with log_context(company='merck'):
+                all_articles = await scrape_listing(page, known_urls=repo.known_urls('merck'))
+            logger.info(f"Total articles collected: {len(all_articles)}")
             save_to_csv(all_articles)
+            if all_articles:
+                added = repo.upsert_articles(clean_articles(all_articles), 'merck')
+                logger.info(f"Stored {added} new articles in {repo.path}")
             
         except Exception as e:
-            print(f"Error during scraping: {e}")
+            logger.exception(f"Error during scraping: {e}")
         finally:
-            input("Press Enter to close the browser...")  # Keep browser open
+            repo.close()
+            await raw_page.context.close()  # writes the HAR when recording
             await browser.close()
 
 if __name__ == "__main__":
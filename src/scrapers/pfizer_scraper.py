@@ -3,75 +3,81 @@
 """Pfizer news scraper using AgentQL and Playwright."""
 
 import asyncio
-import pandas as pd
-from datetime import datetime
+import logging
 import os
-from dotenv import load_dotenv
-import agentql
-from agentql.ext.playwright.async_api import Page
-from playwright.async_api import async_playwright
+import sys
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import metrics
+from utils.common import filter_new_articles, load_env, log_context, setup_logging
+
+if TYPE_CHECKING:
+    from agentql.ext.playwright.async_api import Page
 
-# Load environment variables
-load_dotenv()
-os.environ["AGENTQL_API_KEY"] = os.getenv("AGENTQL_API_KEY")
+logger = logging.getLogger(__name__)
 
 URL = "https://www.pfizer.com/news/press-releases"
+MAX_PAGES = 18
 
-async def set_items_per_page(page: Page) -> bool:
+async def set_items_per_page(page: 'Page') -> bool:
     """Set items per page to 48."""
     try:
-        print("Finding items per page dropdown...")
+        logger.debug("Finding items per page dropdown...")
         # Find and click the view toggle button
         toggle_button = page.locator('button.js-toggle-view')
         
         if not await toggle_button.count():
-            print("View toggle button not found")
+            logger.debug("View toggle button not found")
             return False
             
-        print("Clicking view toggle...")
+        logger.debug("Clicking view toggle...")
         await toggle_button.click()
         
         # Find and click the "View 48" option
         view_48_option = page.locator('text="View 48"')
         
         if not await view_48_option.count():
-            print("View 48 option not found")
+            logger.debug("View 48 option not found")
             return False
             
-        print("Selecting 48 items per page...")
+        logger.debug("Selecting 48 items per page...")
         await view_48_option.click()
         
         # Wait for page to reload
         await page.wait_for_load_state("networkidle")
-        await asyncio.sleep(5)  # Additional wait for content to load
+        await metrics.wait(5)  # Additional wait for content to load
         
         return True
         
     except Exception as e:
-        print(f"Error setting items per page: {e}")
+        logger.error(f"Error setting items per page: {e}")
         return False
 
-async def accept_cookies(page: Page) -> bool:
+async def accept_cookies(page: 'Page') -> bool:
     """Handle the cookie consent popup."""
     try:
-        print("Looking for cookie consent dialog...")
+        logger.debug("Looking for cookie consent dialog...")
         # Pfizer uses a specific cookie consent button
         cookie_button = page.locator('button#onetrust-accept-btn-handler')
         
         if not await cookie_button.count():
-            print("No cookie dialog found")
+            logger.debug("No cookie dialog found")
             return True
             
-        print("Accepting cookies...")
+        logger.debug("Accepting cookies...")
         await cookie_button.click()
         await page.wait_for_load_state("networkidle")
         return True
         
     except Exception as e:
-        print(f"Error handling cookie consent: {e}")
+        logger.error(f"Error handling cookie consent: {e}")
         return False
 
-async def extract_news_articles(page: Page) -> list:
+async def extract_news_articles(page: 'Page') -> list:
     """Extract news articles from the current page."""
     query = """
     {
@@ -85,94 +91,128 @@ async def extract_news_articles(page: Page) -> list:
     """
     
     try:
-        print("Waiting for articles to load...")
-        await asyncio.sleep(10)  # Added wait before extraction
+        logger.debug("Waiting for articles to load...")
+        await metrics.wait(10)  # Added wait before extraction
         
-        print("Extracting articles...")
-        data = await page.query_data(query)
-        articles = data.get("articles", [])
-        print(f"Successfully extracted {len(articles)} articles")
+        logger.debug("Extracting articles...")
+        with metrics.span('extract', company='pfizer') as span:
+            data = await page.query_data(query)
+            articles = data.get("articles", [])
+            span['rows'] = len(articles)
+        logger.debug(f"Successfully extracted {len(articles)} articles")
         
         if len(articles) < 48:
-            print("Warning: Fewer articles than expected")
+            logger.warning("Fewer articles than expected")
             
         return articles
     except Exception as e:
-        print(f"Error extracting articles: {e}")
+        logger.error(f"Error extracting articles: {e}")
         return []
 
-async def get_next_page(page: Page) -> bool:
+async def get_next_page(page: 'Page') -> bool:
     """Navigate to the next page."""
     try:
-        print("Finding next page button...")
+        logger.debug("Finding next page button...")
         next_button = page.locator('a[rel="next"]')
         
         if not await next_button.count():
-            print("Next button not found")
+            logger.debug("Next button not found")
             return False
             
         if not await next_button.is_visible():
-            print("Next button is not visible - reached last page")
+            logger.debug("Next button is not visible - reached last page")
             return False
             
-        print("Clicking next page...")
+        logger.debug("Clicking next page...")
         await next_button.click()
         await page.wait_for_load_state("networkidle")
-        await asyncio.sleep(5)  # Increased wait time after clicking
+        await metrics.wait(5)  # Increased wait time after clicking
         
         return True
         
     except Exception as e:
-        print(f"Error navigating to next page: {e}")
+        logger.error(f"Error navigating to next page: {e}")
         return False
 
 def save_to_csv(articles: list):
     """Save articles to CSV file."""
+    import pandas as pd
+
     if not articles:
         return
     
     df = pd.DataFrame(articles)
     filename = f"pfizer_news_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     df.to_csv(filename, index=False)
-    print(f"Saved {len(articles)} articles to {filename}")
+    logger.info(f"Saved {len(articles)} articles to {filename}")
 
-async def main():
+async def scrape_listing(page: 'Page', max_pages: int = MAX_PAGES, known_urls=None) -> list:
+    """Scrape the listing pages, stopping once already-known articles show up."""
+    logger.debug("Opening Pfizer news page...")
+    with metrics.span('navigate', company='pfizer', page=1):
+        await page.goto(URL)
+    await metrics.wait(2)
+    
+    logger.debug("Setting items per page to 48...")
+    if not await set_items_per_page(page):
+        logger.warning("Could not set items per page to 48")
+    
+    all_articles = []
+    page_num = 1
+    
+    while page_num <= max_pages:
+        logger.info(f"Scraping page {page_num}")
+        articles = await extract_news_articles(page)
+        logger.info(f"Found {len(articles)} articles on this page")
+        new_articles = filter_new_articles(articles, known_urls)
+        all_articles.extend(new_articles)
+        
+        # Listing is newest first, so a known article means the rest are known too
+        if len(new_articles) < len(articles):
+            logger.info("Reached already scraped articles")
+            break
+        
+        with metrics.span('navigate', company='pfizer', page=page_num + 1):
+            has_next = await get_next_page(page)
+        if not has_next:
+            logger.info("No more pages available")
+            break
+        
+        page_num += 1
+        
+    return all_articles
+
+async def main(headless: bool = True):
     """Main function to run the scraper."""
+    import agentql
+    from playwright.async_api import async_playwright
+
+    from data_processing.clean_data import clean_articles
+    from scrapers.harness import open_page
+    from storage.sql_store import ArticleRepository
+
+    setup_logging()
+    load_env()
     async with async_playwright() as playwright:
-        browser = await playwright.chromium.launch(headless=True)
-        page = await agentql.wrap_async(await browser.new_page())
+        browser = await playwright.chromium.launch(headless=headless)
+        raw_page = await open_page(browser)
+        page = await agentql.wrap_async(raw_page)
+        repo = ArticleRepository()
         
         try:
-            print("Opening Pfizer news page...")
-            await page.goto(URL)
-            await asyncio.sleep(2)
-            
-            print("Setting items per page to 48...")
-            if not await set_items_per_page(page):
-                print("Warning: Could not set items per page to 48")
-            
-            all_articles = []
-            page_num = 1
-            max_pages = 18
-            
-            while page_num <= max_pages:
-                print(f"\n=== Scraping page {page_num} ===")
-                articles = await extract_news_articles(page)
-                print(f"Found {len(articles)} articles on this page")
-                all_articles.extend(articles)
-                
-                if not await get_next_page(page):
-                    print("No more pages available")
-                    break
-                
-                page_num += 1
-                
-            print(f"\nTotal articles collected: {len(all_articles)}")
+            with log_context(company='pfizer'):
+                all_articles = await scrape_listing(page, known_urls=repo.known_urls('pfizer'))
+            logger.info(f"Total articles collected: {len(all_articles)}")
             save_to_csv(all_articles)
+            if all_articles:
+                added = repo.upsert_articles(clean_articles(all_articles), 'pfizer')
+                logger.info(f"Stored {added} new articles in {repo.path}")
             
         except Exception as e:
-            print(f"Error during scraping: {e}")
+            logger.exception(f"Error during scraping: {e}")
         finally:
+            repo.close()
+            await raw_page.context.close()  # writes the HAR when recording
             await browser.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+"""Fetch article bodies as markdown through the Jina or Spider APIs."""
+
+import argparse
+import logging
+import os
+import sys
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import metrics
+from utils.common import load_env, setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Overridden by the JINA_URL and SPIDER_URL environment variables, e.g. to use
+# the mock endpoints of scrapers/harness.py
+JINA_URL = "https://r.jina.ai/"
+SPIDER_URL = "https://api.spider.cloud/crawl"
+ENGINES = ('jina', 'spider')
+
+def create_session():
+    """Create an HTTP session whose connections are reused between fetches.
+
+    Also loads the API keys from .env, which every fetch goes through a session for.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    load_env()
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def fetch_jina(url, session):
+    """Fetch article body using Jina AI API"""
+    headers = {
+        'Authorization': f'Bearer {os.getenv("JINA_API_KEY")}'
+    }
+    response = session.get(f'{os.getenv("JINA_URL", JINA_URL)}{url}', headers=headers,
+                           timeout=60)
+    metrics.count('bytes_downloaded', len(response.content), service='jina')
+
+    if response.status_code == 200:
+        return response.text
+    metrics.count('fetch_errors', service='jina', status=response.status_code)
+    logger.warning(f"Error fetching {url}: {response.status_code}")
+    return None
+
+def fetch_spider(url, session):
+    """Fetch article body using Spider Cloud API"""
+    headers = {
+        'Authorization': f'Bearer {os.getenv("SPIDER_API_KEY")}',
+        'Content-Type': 'application/json',
+    }
+    json_data = {
+        "limit": 1,
+        "return_format": "markdown",
+        "url": url
+    }
+    response = session.post(os.getenv('SPIDER_URL', SPIDER_URL), headers=headers,
+                            json=json_data, timeout=60)
+    metrics.count('bytes_downloaded', len(response.content), service='spider')
+
+    if response.status_code == 200:
+        return response.json()[0].get('content')
+    metrics.count('fetch_errors', service='spider', status=response.status_code)
+    logger.warning(f"Error fetching {url}: {response.status_code}")
+    return None
+
+FETCHERS = {
+    'jina': fetch_jina,
+    'spider': fetch_spider,
+}
+
+def fetch_article_body(url, session=None, engine='jina'):
+    """Fetch a single article body, returning None on failure."""
+    session = session or create_session()
+    try:
+        with metrics.span('fetch', engine=engine):
+            body = FETCHERS[engine](url, session)
+        logger.debug(f"Fetched {url} through {engine}: {len(body or '')} characters")
+        return body
+    except Exception as e:
+        metrics.count('fetch_errors', service=engine, status=type(e).__name__)
+        logger.warning(f"Exception fetching {url}: {e}")
+        return None
+
+def populate_bodies(df, session=None, engine='jina', delay=1, limit=None):
+    """Fill in the body column for every row that does not have one yet.
+
+    With a limit, at most that many bodies are fetched in this call.
+    """
+    import pandas as pd
+
+    session = session or create_session()
+    df = df.copy()
+    if 'body' not in df.columns:
+        df['body'] = None
+
+    fetched = 0
+    for idx in df.index:
+        if pd.isna(df.loc[idx, 'body']):  # Only process if body is empty
+            if limit is not None and fetched >= limit:
+                break
+            body = fetch_article_body(df.loc[idx, 'url'], session, engine)
+            if body:
+                df.loc[idx, 'body'] = body
+            fetched += 1
+            metrics.sleep(delay)  # Rate limiting
+
+    return df
+
+def populate_store(repo, company=None, session=None, engine='jina', delay=1, limit=None):
+    """Fetch the bodies the article store is missing; returns how many were stored."""
+    session = session or create_session()
+    stored = 0
+    for url, source_url in repo.missing_bodies(company, limit):
+        body = fetch_article_body(source_url, session, engine)
+        if body:
+            repo.set_body(url, body)
+            stored += 1
+        metrics.sleep(delay)  # Rate limiting
+    return stored
+
+def main():
+    """Fill in missing bodies in the article store"""
+    from storage.sql_store import DB_PATH, ArticleRepository
+
+    parser = argparse.ArgumentParser(description='Fetch missing article bodies')
+    parser.add_argument('--company', '-c', help='Only fetch bodies for this company')
+    parser.add_argument('--engine', choices=ENGINES, default='jina',
+                        help='API used to fetch article bodies')
+    parser.add_argument('--limit', type=int, help='Maximum number of bodies to fetch')
+    parser.add_argument('--delay', type=float, default=1, help='Seconds between requests')
+    parser.add_argument('--db', default=DB_PATH, help='Article store')
+    args = parser.parse_args()
+    setup_logging()
+
+    with ArticleRepository(args.db) as repo:
+        stored = populate_store(repo, args.company, engine=args.engine, delay=args.delay,
+                                limit=args.limit)
+    logger.info(f"Stored {stored} bodies in {args.db}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Full-text search over article titles and bodies."""
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+
+"""
+On-disk inverted index with BM25 ranking.
+
+The index is a directory of immutable segments. Each segment holds:
+
+    docs.json      one row per article: key, url, title, company, date,
+                   category, length in terms and a content hash
+    lexicon.json   term -> [offset, byte length, document frequency]
+    postings.bin   per term, (document gap, term frequency) pairs as varints
+    columns.json   the distinct companies and categories of its articles
+    columns.bin    per article, the length, company and category codes and the date
+
+Adding articles writes a new segment with only the new or changed ones; their
+older copies are recorded as deleted in meta.json, next to the number and
+total length of the live articles. A query only reads the postings of its
+terms and checks each posting against the columns and the deleted copies, so
+it never walks the whole corpus, and docs.json is only read for the results.
+Once there are more than MAX_SEGMENTS segments they are merged into one. Only
+the standard library is used, so `main.py search` starts quickly.
+"""
+
+import csv
+import hashlib
+import heapq
+import json
+import math
+import os
+import shutil
+import sys
+from array import array
+from collections import Counter
+
+from search.tokenizer import tokenize
+from utils.common import DATA_DIR, canonical_url, company_from_path
+
+INDEX_DIR = os.path.join(DATA_DIR, 'search')
+META_FILE = 'meta.json'
+DATE_WIDTH = 10  # bytes of the date column per article, 'YYYY-MM-DD'
+MAX_SEGMENTS = 8
+TITLE_WEIGHT = 2  # title terms count this many times
+K1 = 1.2
+B = 0.75
+
+def encode_varint(value, out):
+    """Append an unsigned integer to a bytearray, 7 bits per byte."""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_postings(data):
+    """(document, term frequency) pairs of a varint-encoded postings list."""
+    postings = []
+    numbers = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        numbers.append(value)
+        value = shift = 0
+    doc = 0
+    for i in range(0, len(numbers), 2):
+        doc += numbers[i]
+        postings.append((doc, numbers[i + 1]))
+    return postings
+
+def content_hash(*values):
+    """Short hash of the indexed fields of an article."""
+    digest = hashlib.blake2b(digest_size=8)
+    for value in values:
+        digest.update(str(value).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _text(value):
+    return '' if value is None or value != value else str(value)  # NaN != NaN
+
+class Segment:
+    """One immutable part of the index."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, 'lexicon.json')) as f:
+            self.lexicon = json.load(f)
+        self._docs = None
+        self._postings = None
+        if os.path.exists(os.path.join(path, 'columns.json')):
+            with open(os.path.join(path, 'columns.json')) as f:
+                header = json.load(f)
+            with open(os.path.join(path, 'columns.bin'), 'rb') as f:
+                data = f.read()
+        else:
+            # Written before the columns existed
+            header, data = Segment._columns(self.docs)
+        self.companies = header['companies']
+        self.categories = header['categories']
+        n = header['count']
+        self.lengths, self.company_codes, self.category_codes = array('I'), array('I'), array('I')
+        size = self.lengths.itemsize * n
+        self.lengths.frombytes(data[:size])
+        self.company_codes.frombytes(data[size:2 * size])
+        self.category_codes.frombytes(data[2 * size:3 * size])
+        self.dates = data[3 * size:]
+
+    @property
+    def docs(self):
+        """Rows of docs.json, read on first use."""
+        if self._docs is None:
+            with open(os.path.join(self.path, 'docs.json')) as f:
+                self._docs = json.load(f)
+        return self._docs
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def date(self, doc_id):
+        """Date of an article as bytes, compared like the date strings of docs.json."""
+        return self.dates[doc_id * DATE_WIDTH:(doc_id + 1) * DATE_WIDTH].rstrip(b'\0')
+
+    def postings(self, term):
+        entry = self.lexicon.get(term)
+        if entry is None:
+            return []
+        if self._postings is None:
+            with open(os.path.join(self.path, 'postings.bin'), 'rb') as f:
+                self._postings = f.read()
+        offset, length, _ = entry
+        return decode_postings(self._postings[offset:offset + length])
+
+    @staticmethod
+    def _columns(docs):
+        """Header and packed columns of a segment's rows."""
+        companies, categories = {}, {}
+        lengths, company_codes, category_codes = array('I'), array('I'), array('I')
+        dates = bytearray()
+        for doc in docs:
+            lengths.append(doc['length'])
+            company_codes.append(companies.setdefault(str(doc['company']), len(companies)))
+            category_codes.append(categories.setdefault(doc['category'], len(categories)))
+            dates += doc['date'].encode('utf-8')[:DATE_WIDTH].ljust(DATE_WIDTH, b'\0')
+        header = {'count': len(docs), 'companies': list(companies), 'categories': list(categories)}
+        return header, (lengths.tobytes() + company_codes.tobytes() + category_codes.tobytes()
+                        + bytes(dates))
+
+    @staticmethod
+    def write(path, articles):
+        """Write a segment from (doc fields, term counts) pairs."""
+        postings = {}
+        docs = []
+        for doc_id, (doc, counts) in enumerate(articles):
+            docs.append(doc)
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        blob = bytearray()
+        lexicon = {}
+        for term in sorted(postings):
+            start = len(blob)
+            previous = 0
+            for doc_id, tf in postings[term]:
+                encode_varint(doc_id - previous, blob)
+                encode_varint(tf, blob)
+                previous = doc_id
+            lexicon[term] = [start, len(blob) - start, len(postings[term])]
+
+        header, columns = Segment._columns(docs)
+        tmp_path = f'{path}.tmp'
+        os.makedirs(tmp_path, exist_ok=True)
+        with open(os.path.join(tmp_path, 'postings.bin'), 'wb') as f:
+            f.write(blob)
+        with open(os.path.join(tmp_path, 'lexicon.json'), 'w') as f:
+            json.dump(lexicon, f, separators=(',', ':'))
+        with open(os.path.join(tmp_path, 'docs.json'), 'w') as f:
+            json.dump(docs, f, separators=(',', ':'))
+        with open(os.path.join(tmp_path, 'columns.json'), 'w') as f:
+            json.dump(header, f, separators=(',', ':'))
+        with open(os.path.join(tmp_path, 'columns.bin'), 'wb') as f:
+            f.write(columns)
+        os.replace(tmp_path, path)
+        return Segment(path)
+
+class SearchIndex:
+    """BM25 search over the segments of an index directory."""
+
+    def __init__(self, path=INDEX_DIR):
+        self.path = path
+        names = sorted(name for name in os.listdir(path)
+                       if name.startswith('seg-') and not name.endswith('.tmp')) \
+            if os.path.isdir(path) else []
+        self.segments = [Segment(os.path.join(path, name)) for name in names]
+        self._live = None
+        meta = None
+        if os.path.exists(os.path.join(path, META_FILE)):
+            with open(os.path.join(path, META_FILE)) as f:
+                meta = json.load(f)
+        if meta is None or meta['segments'] != names:
+            # No meta.json yet, or a write stopped between a segment and its meta.json
+            self._rebuild_meta()
+            if self.segments:
+                self._save_meta()
+        else:
+            self.num_docs = meta['num_docs']
+            self.total_length = meta['total_length']
+            self.deleted = {name: set(doc_ids) for name, doc_ids in meta['deleted'].items()}
+
+    def _rebuild_meta(self):
+        """Work out the live copy of each article from every segment's rows."""
+        self._live = {}  # key -> (segment number, doc id) of the newest copy
+        self.deleted = {}
+        for number, segment in enumerate(self.segments):
+            for doc_id, doc in enumerate(segment.docs):
+                old = self._live.get(doc['key'])
+                if old is not None:
+                    self.deleted.setdefault(self.segments[old[0]].name, set()).add(old[1])
+                self._live[doc['key']] = (number, doc_id)
+        self.num_docs = len(self._live)
+        self.total_length = sum(self.segments[number].lengths[doc_id]
+                                for number, doc_id in self._live.values())
+
+    def _save_meta(self):
+        meta = {'segments': [segment.name for segment in self.segments],
+                'num_docs': self.num_docs, 'total_length': self.total_length,
+                'deleted': {name: sorted(doc_ids) for name, doc_ids in self.deleted.items()
+                            if doc_ids}}
+        tmp_path = os.path.join(self.path, f'{META_FILE}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f, separators=(',', ':'))
+        os.replace(tmp_path, os.path.join(self.path, META_FILE))
+
+    def _live_docs(self):
+        """key -> (segment number, doc id) of the live copy of every article; reads docs.json."""
+        if self._live is None:
+            self._live = {}
+            for number, segment in enumerate(self.segments):
+                deleted = self.deleted.get(segment.name, ())
+                for doc_id, doc in enumerate(segment.docs):
+                    if doc_id not in deleted:
+                        self._live[doc['key']] = (number, doc_id)
+        return self._live
+
+    def __len__(self):
+        return self.num_docs
+
+    @property
+    def avg_length(self):
+        return self.total_length / self.num_docs if self.num_docs else 0.0
+
+    @staticmethod
+    def _analyze(title, body):
+        counts = Counter(tokenize(body))
+        for term in tokenize(title):
+            counts[term] += TITLE_WEIGHT
+        return counts
+
+    def add(self, articles, company=None):
+        """Index new or changed articles; returns how many were added.
+
+        articles is an iterable of dicts with url, title, date, category and
+        body (and company unless given).
+        """
+        live = self._live_docs()
+        pending = {}
+        for article in articles:
+            key = canonical_url(article['url'])
+            title, body = _text(article.get('title')), _text(article.get('body'))
+            date = _text(article.get('date'))[:10]
+            category = _text(article.get('category')).lower()
+            doc_hash = content_hash(title, body, date, category)
+            current = pending[key][0] if key in pending else (
+                self.segments[live[key][0]].docs[live[key][1]] if key in live else None)
+            if current is not None and current['hash'] == doc_hash:
+                continue
+            counts = self._analyze(title, body)
+            doc = {'key': key, 'url': article['url'], 'title': title,
+                   'company': company or article.get('company'), 'date': date,
+                   'category': category, 'length': sum(counts.values()), 'hash': doc_hash}
+            pending[key] = (doc, counts)
+
+        if pending:
+            os.makedirs(self.path, exist_ok=True)
+            number = int(self.segments[-1].path.rsplit('-', 1)[1]) + 1 if self.segments else 0
+            segment = Segment.write(os.path.join(self.path, f'seg-{number:06d}'),
+                                    list(pending.values()))
+            # The copies the new segment supersedes stop counting
+            for doc_id, key in enumerate(pending):
+                if key in live:
+                    old_number, old_id = live[key]
+                    self.deleted.setdefault(self.segments[old_number].name, set()).add(old_id)
+                    self.num_docs -= 1
+                    self.total_length -= self.segments[old_number].lengths[old_id]
+                live[key] = (len(self.segments), doc_id)
+                self.num_docs += 1
+                self.total_length += segment.lengths[doc_id]
+            self.segments.append(segment)
+            self._save_meta()
+            if len(self.segments) > MAX_SEGMENTS:
+                self.compact()
+        return len(pending)
+
+    def compact(self):
+        """Merge every segment into one, dropping superseded copies."""
+        if len(self.segments) <= 1:
+            return
+        articles = []
+        for segment in self.segments:
+            terms = {}
+            for term in segment.lexicon:
+                for doc_id, tf in segment.postings(term):
+                    terms.setdefault(doc_id, {})[term] = tf
+            deleted = self.deleted.get(segment.name, ())
+            for doc_id, doc in enumerate(segment.docs):
+                if doc_id not in deleted:
+                    articles.append((doc, terms.get(doc_id, {})))
+
+        old_paths = [segment.path for segment in self.segments]
+        number = int(old_paths[-1].rsplit('-', 1)[1]) + 1
+        merged = Segment.write(os.path.join(self.path, f'seg-{number:06d}'), articles)
+        self.segments = [merged]
+        self.deleted = {}
+        self._live = None
+        self._save_meta()
+        for path in old_paths:
+            shutil.rmtree(path)
+
+    def _live_postings(self, segment, term):
+        """Postings of a term in a segment, without the superseded copies."""
+        postings = segment.postings(term)
+        deleted = self.deleted.get(segment.name)
+        return [posting for posting in postings if posting[0] not in deleted] if deleted \
+            else postings
+
+    def search(self, query, k=10, companies=None, start=None, end=None, categories=None):
+        """Top k articles for a query, best first, as dicts with a score.
+
+        Articles can be restricted to companies, categories (an article
+        matches if it has any of them) and a date range (ISO date strings,
+        inclusive).
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.num_docs:
+            return []
+        companies = set(companies) if companies else None
+        categories = {category.lower() for category in categories} if categories else None
+        start = start.encode('utf-8') if start else None
+        end = end.encode('utf-8') if end else None
+        avg_length = self.avg_length
+
+        # Per segment, the company and category codes the filters allow (None: any)
+        allowed = []
+        for segment in self.segments:
+            company_codes = ({code for code, name in enumerate(segment.companies)
+                              if name in companies} if companies else None)
+            category_codes = ({code for code, name in enumerate(segment.categories)
+                               if not categories.isdisjoint(name.split(', '))}
+                              if categories else None)
+            allowed.append((company_codes, category_codes))
+
+        scores = Counter()
+        for term in terms:
+            postings = [self._live_postings(segment, term) for segment in self.segments]
+            df = sum(map(len, postings))
+            if not df:
+                continue
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            for number, (segment, term_postings) in enumerate(zip(self.segments, postings)):
+                company_codes, category_codes = allowed[number]
+                if company_codes is not None and not company_codes or \
+                        category_codes is not None and not category_codes:
+                    continue
+                for doc_id, tf in term_postings:
+                    if company_codes is not None and \
+                            segment.company_codes[doc_id] not in company_codes:
+                        continue
+                    if category_codes is not None and \
+                            segment.category_codes[doc_id] not in category_codes:
+                        continue
+                    if start or end:
+                        date = segment.date(doc_id)
+                        if (start and date < start) or (end and date > end):
+                            continue
+                    norm = K1 * (1 - B + B * segment.lengths[doc_id] / avg_length)
+                    scores[(number, doc_id)] += idf * tf * (K1 + 1) / (tf + norm)
+
+        results = []
+        for (number, doc_id), score in heapq.nlargest(k, scores.items(), key=lambda item: item[1]):
+            doc = self.segments[number].docs[doc_id]
+            results.append({'score': round(score, 4), 'company': doc['company'],
+                            'date': doc['date'], 'category': doc['category'],
+                            'title': doc['title'], 'url': doc['url']})
+        return results
+
+    def document_frequency(self, term):
+        """Number of live documents containing a term, over all segments."""
+        return sum(len(self._live_postings(segment, term)) for segment in self.segments)
+
+def index_files(file_paths, index):
+    """Index the articles of cleaned CSVs named <company>_news_cleaned.csv.
+
+    Returns the number of new or changed articles.
+    """
+    csv.field_size_limit(sys.maxsize)  # article bodies exceed the default limit
+    added = 0
+    for file_path in file_paths:
+        company = company_from_path(file_path)
+        with open(file_path, newline='', encoding='utf-8') as f:
+            added += index.add(csv.DictReader(f), company)
+    return added
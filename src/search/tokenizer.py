@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+"""
+Tokenizer for press releases.
+
+Text is lowercased and trademark signs are dropped, so "Zepbound®" and
+"zepbound" match. Compound names such as "donanemab-azbt", "COVID-19" or
+"doravirine/islatravir" are kept whole and also split into their parts, so a
+query for either the full name or one part finds the article. Possessives
+("Merck's") are reduced to the name.
+"""
+
+import re
+
+TRADEMARKS = str.maketrans({'®': ' ', '™': ' ', '©': ' ', '℠': ' ', '’': "'"})
+WORD_RE = re.compile(r"[a-z0-9]+(?:[-/.][a-z0-9]+)*")
+SEPARATORS_RE = re.compile(r'[-/.]')
+POSSESSIVE_RE = re.compile(r"'s\b")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in into is it its of on or that the their
+this to was were which will with
+""".split())
+
+def tokenize(text):
+    """Index terms of a text, in order, with compound names followed by their parts."""
+    text = POSSESSIVE_RE.sub(' ', str(text).translate(TRADEMARKS).lower())
+    tokens = []
+    for word in WORD_RE.findall(text):
+        if word in STOPWORDS:
+            continue
+        tokens.append(word)
+        if SEPARATORS_RE.search(word):
+            tokens.extend(part for part in SEPARATORS_RE.split(word)
+                          if len(part) > 1 and part not in STOPWORDS)
+    return tokens
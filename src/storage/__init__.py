@@ -0,0 +1 @@
+"""Article storage backends."""
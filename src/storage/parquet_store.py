@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""
+Parquet dataset store for articles.
+
+Each pipeline stage (clean, processed, output) is a Parquet dataset under
+data/dataset/<stage>, hive-partitioned by company and year:
+
+    data/dataset/clean/company=pfizer/year=2024/part-<id>-0.parquet
+
+Category is dictionary-encoded and every column, the bodies in particular, is
+zstd-compressed. Reads prune partitions and push filters down to the row
+groups, and only the requested columns are decoded, so loading metadata never
+reads the body bytes. CSV files remain available through export_csv.
+"""
+
+import os
+import shutil
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from utils.common import DATA_DIR, ensure_directory
+
+DATASET_DIR = os.path.join(DATA_DIR, 'dataset')
+STAGES = ('clean', 'processed', 'output')
+METADATA_COLUMNS = ['company', 'title', 'url', 'date', 'category']
+
+PARTITIONING = ds.partitioning(
+    pa.schema([('company', pa.string()), ('year', pa.int16())]), flavor='hive')
+
+def stage_path(stage, root=DATASET_DIR):
+    """Directory of a stage's dataset."""
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage: {stage}")
+    return os.path.join(root, stage)
+
+def has_stage(stage, root=DATASET_DIR):
+    """Whether a stage's dataset has been written."""
+    path = stage_path(stage, root)
+    return os.path.isdir(path) and any(name.startswith('company=') for name in os.listdir(path))
+
+def _to_table(df, company=None):
+    """Arrow table with the partition columns and a dictionary-encoded category."""
+    df = df.copy()
+    if company is not None:
+        df['company'] = company
+    df['date'] = pd.to_datetime(df['date'])
+    df['year'] = df['date'].dt.year.astype('Int16')
+    if 'category' in df.columns:
+        df['category'] = df['category'].astype('category')
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    fields = []
+    for field in table.schema:
+        if pa.types.is_timestamp(field.type):
+            field = field.with_type(pa.timestamp('ms'))
+        elif pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        fields.append(field)
+    return table.cast(pa.schema(fields))
+
+def write_articles(df, stage, company=None, root=DATASET_DIR, append=False):
+    """Write articles to a stage's dataset.
+
+    Without append, the existing partitions of the companies being written
+    are replaced, like overwriting their CSV snapshot. With append, new files
+    are added next to the existing ones.
+    """
+    table = _to_table(df, company)
+    path = stage_path(stage, root)
+    if not append:
+        for name in set(table.column('company').to_pylist()):
+            shutil.rmtree(os.path.join(path, f'company={name}'), ignore_errors=True)
+    ensure_directory(path)
+
+    file_format = ds.ParquetFileFormat()
+    ds.write_dataset(
+        table, path, format=file_format, partitioning=PARTITIONING,
+        basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+        file_options=file_format.make_write_options(
+            compression='zstd', use_dictionary=['category']),
+    )
+    return path
+
+def _filter(companies=None, start=None, end=None, categories=None):
+    """Filter expression; the company and year terms prune whole partitions."""
+    expression = None
+
+    def add(term):
+        nonlocal expression
+        expression = term if expression is None else expression & term
+
+    if companies:
+        add(ds.field('company').isin(list(companies)))
+    if start is not None:
+        start = pd.Timestamp(start)
+        add(ds.field('year') >= start.year)
+        add(ds.field('date') >= pa.scalar(start.to_pydatetime(), pa.timestamp('ms')))
+    if end is not None:
+        end = pd.Timestamp(end)
+        add(ds.field('year') <= end.year)
+        add(ds.field('date') <= pa.scalar(end.to_pydatetime(), pa.timestamp('ms')))
+    if categories:
+        add(ds.field('category').isin(list(categories)))
+    return expression
+
+def read_articles(stage, columns=None, companies=None, start=None, end=None, categories=None,
+                  root=DATASET_DIR):
+    """Read a stage's articles as a dataframe.
+
+    Only `columns` are decoded (all but the partition year by default), and
+    the company, date and category filters are pushed down to the scan.
+    """
+    dataset = ds.dataset(stage_path(stage, root), format='parquet', partitioning=PARTITIONING)
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name != 'year']
+    table = dataset.to_table(columns=list(columns),
+                             filter=_filter(companies, start, end, categories))
+    df = table.to_pandas()
+    if 'date' in df.columns:
+        df['date'] = df['date'].astype('datetime64[ns]')
+    return df
+
+def read_metadata(stage='clean', **filters):
+    """Metadata columns only; the body column chunks are never read."""
+    return read_articles(stage, columns=METADATA_COLUMNS, **filters)
+
+def import_csv(file_path, stage, company, root=DATASET_DIR):
+    """Load an existing CSV snapshot into a stage's dataset."""
+    return write_articles(pd.read_csv(file_path), stage, company, root)
+
+def export_csv(stage, output_dir, root=DATASET_DIR, suffix='_news_cleaned.csv'):
+    """Write one CSV per company in the layout the CSV pipeline used."""
+    ensure_directory(output_dir)
+    df = read_articles(stage, root=root)
+    paths = []
+    for company, group in df.groupby('company', observed=True, sort=False):
+        group = group.drop(columns=['company']).sort_values('date', ascending=False)
+        group['category'] = group['category'].astype(object)
+        path = os.path.join(output_dir, f'{company}{suffix}')
+        group.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+def dataset_size(stage, root=DATASET_DIR):
+    """Compressed bytes per column across a stage's files."""
+    sizes = {}
+    for dirpath, _, filenames in os.walk(stage_path(stage, root)):
+        for filename in filenames:
+            if not filename.endswith('.parquet'):
+                continue
+            metadata = pq.ParquetFile(os.path.join(dirpath, filename)).metadata
+            for i in range(metadata.num_row_groups):
+                row_group = metadata.row_group(i)
+                for j in range(row_group.num_columns):
+                    column = row_group.column(j)
+                    sizes[column.path_in_schema] = (
+                        sizes.get(column.path_in_schema, 0) + column.total_compressed_size)
+    return sizes
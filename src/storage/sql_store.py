@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+"""
+SQLite article repository.
+
+Articles are keyed by their canonical URL, so scraping the same listing twice
+updates rows instead of duplicating them. Metadata lives in `articles`, indexed
+on (company, date) and category, and the large markdown bodies live in a
+separate `bodies` table so that metadata queries never page them in.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from utils.common import DATA_DIR, canonical_url, ensure_directory
+
+DB_PATH = os.path.join(DATA_DIR, 'articles.db')
+COMPANIES = ('pfizer', 'merck', 'lilly')
+# CSV stage directory and the body column its files fill in
+STAGES = (('clean', None), ('processed', 'body'), ('output', 'clean_body'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    source_url TEXT NOT NULL,
+    company TEXT NOT NULL,
+    title TEXT,
+    date TEXT,
+    category TEXT,
+    first_seen TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_articles_company_date ON articles (company, date);
+CREATE INDEX IF NOT EXISTS idx_articles_category ON articles (category);
+
+CREATE TABLE IF NOT EXISTS bodies (
+    article_id INTEGER PRIMARY KEY REFERENCES articles (id) ON DELETE CASCADE,
+    body TEXT,
+    clean_body TEXT,
+    fetched_at TEXT,
+    cleaned_at TEXT
+);
+"""
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+def _date(value):
+    """ISO date string for storage, or None."""
+    if value is None or pd.isna(value):
+        return None
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+def _text(value):
+    return None if value is None or pd.isna(value) else str(value)
+
+class ArticleRepository:
+    """Read and write articles, bodies and cleaned bodies in one SQLite file."""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        if path != ':memory:':
+            ensure_directory(os.path.dirname(path))
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self.conn.executescript(SCHEMA)
+        # The daemon reads and writes from several threads through one connection
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    # Articles
+    def upsert_articles(self, df, company=None):
+        """Insert new articles and update known ones; returns the number inserted.
+
+        Rows are matched on the canonical URL. Values that are missing in the
+        new row keep what was stored before.
+        """
+        now = _now()
+        rows = [
+            (canonical_url(row['url']), row['url'], company or row['company'],
+             _text(row.get('title')), _date(row.get('date')), _text(row.get('category')), now, now)
+            for row in df.to_dict('records') if _text(row.get('url'))
+        ]
+        with self._lock, self.conn:
+            before = self.count()
+            self.conn.executemany("""
+                INSERT INTO articles (url, source_url, company, title, date, category,
+                                      first_seen, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    title = COALESCE(excluded.title, title),
+                    date = COALESCE(excluded.date, date),
+                    category = COALESCE(excluded.category, category),
+                    updated_at = excluded.updated_at
+            """, rows)
+            return self.count() - before
+
+    def count(self, company=None):
+        """Number of stored articles."""
+        with self._lock:
+            if company is None:
+                return self.conn.execute('SELECT COUNT(*) FROM articles').fetchone()[0]
+            return self.conn.execute('SELECT COUNT(*) FROM articles WHERE company = ?',
+                                     (company,)).fetchone()[0]
+
+    def contains(self, url):
+        """Whether an article is stored, by canonical URL (an index lookup)."""
+        with self._lock:
+            return self.conn.execute('SELECT 1 FROM articles WHERE url = ?',
+                                     (canonical_url(url),)).fetchone() is not None
+
+    def known_urls(self, company=None):
+        """Canonical URLs of the stored articles, for filter_new_articles."""
+        with self._lock:
+            if company is None:
+                rows = self.conn.execute('SELECT url FROM articles')
+            else:
+                rows = self.conn.execute('SELECT url FROM articles WHERE company = ?', (company,))
+            return {row[0] for row in rows}
+
+    def articles(self, company=None, start=None, end=None, category=None, with_body=False,
+                 clean=False):
+        """Articles as a dataframe, filtered on the indexed columns.
+
+        Bodies are only joined in when with_body is set; clean selects the
+        cleaned body instead of the fetched markdown.
+        """
+        columns = 'a.company, a.title, a.source_url AS url, a.date, a.category'
+        joins = ''
+        if with_body:
+            columns += ', b.clean_body AS body' if clean else ', b.body'
+            joins = 'LEFT JOIN bodies b ON b.article_id = a.id'
+
+        conditions, params = [], []
+        if company is not None:
+            conditions.append('a.company = ?')
+            params.append(company)
+        if start is not None:
+            conditions.append('a.date >= ?')
+            params.append(_date(start))
+        if end is not None:
+            conditions.append('a.date <= ?')
+            params.append(_date(end))
+        if category is not None:
+            conditions.append('a.category = ?')
+            params.append(category)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        with self._lock:
+            df = pd.read_sql_query(
+                f'SELECT {columns} FROM articles a {joins} {where} ORDER BY a.date DESC, a.id',
+                self.conn, params=params)
+        df['date'] = pd.to_datetime(df['date'])
+        return df
+
+    # Bodies
+    def missing_bodies(self, company=None, limit=None):
+        """(url, source_url) of articles without a fetched body."""
+        sql = """
+            SELECT a.url, a.source_url FROM articles a
+            LEFT JOIN bodies b ON b.article_id = a.id
+            WHERE b.body IS NULL
+        """
+        params = []
+        if company is not None:
+            sql += ' AND a.company = ?'
+            params.append(company)
+        sql += ' ORDER BY a.date DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self._lock:
+            return [tuple(row) for row in self.conn.execute(sql, params)]
+
+    def uncleaned_bodies(self, company=None):
+        """(url, body) of fetched bodies that have not been cleaned yet."""
+        sql = """
+            SELECT a.url, b.body FROM articles a
+            JOIN bodies b ON b.article_id = a.id
+            WHERE b.body IS NOT NULL AND b.clean_body IS NULL
+        """
+        params = []
+        if company is not None:
+            sql += ' AND a.company = ?'
+            params.append(company)
+        with self._lock:
+            return [tuple(row) for row in self.conn.execute(sql, params)]
+
+    def set_bodies(self, items, column='body'):
+        """Store (url, text) pairs as fetched bodies, or cleaned ones with column='clean_body'."""
+        if column not in ('body', 'clean_body'):
+            raise ValueError(f"Unknown body column: {column}")
+        stamp = 'fetched_at' if column == 'body' else 'cleaned_at'
+        now = _now()
+        rows = [(_text(text), now, canonical_url(url)) for url, text in items]
+        with self._lock, self.conn:
+            self.conn.executemany(f"""
+                INSERT INTO bodies (article_id, {column}, {stamp})
+                SELECT id, ?, ? FROM articles WHERE url = ?
+                ON CONFLICT (article_id) DO UPDATE SET
+                    {column} = excluded.{column},
+                    {stamp} = excluded.{stamp}
+            """, rows)
+
+    def set_body(self, url, body):
+        """Store the fetched body of one article."""
+        self.set_bodies([(url, body)])
+
+    # CSV compatibility
+    def import_csv(self, file_path, company, body_column=None):
+        """Load a CSV snapshot; body_column ('body' or 'clean_body') stores its bodies too."""
+        df = pd.read_csv(file_path)
+        inserted = self.upsert_articles(df, company)
+        if body_column and 'body' in df.columns:
+            bodies = df[df['body'].notna()]
+            self.set_bodies(zip(bodies['url'], bodies['body']), body_column)
+        return inserted
+
+    def export_csv(self, company, file_path, with_body=False, clean=False):
+        """Write a company's articles in the CSV layout of the file pipeline."""
+        df = self.articles(company, with_body=with_body, clean=clean).drop(columns=['company'])
+        ensure_directory(os.path.dirname(file_path))
+        df.to_csv(file_path, index=False)
+        return file_path
+
+    def import_stages(self, data_dir=DATA_DIR, companies=COMPANIES):
+        """Load the clean, processed and output CSVs of every company; returns rows added."""
+        added = 0
+        for stage, body_column in STAGES:
+            for company in companies:
+                file_path = os.path.join(data_dir, stage, f'{company}_news_cleaned.csv')
+                if os.path.exists(file_path):
+                    added += self.import_csv(file_path, company, body_column)
+        return added
+
+    def export_stages(self, data_dir=DATA_DIR, companies=COMPANIES):
+        """Write the clean, processed and output CSVs of every company."""
+        paths = []
+        for stage, body_column in STAGES:
+            for company in companies:
+                file_path = os.path.join(data_dir, stage, f'{company}_news_cleaned.csv')
+                paths.append(self.export_csv(company, file_path, with_body=body_column is not None,
+                                             clean=body_column == 'clean_body'))
+        return paths
@@ -0,0 +1,77 @@
+import asyncio, glob, json, os, sys, tempfile
+
+import pandas as pd
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processing.entities import EntityIndex
+from data_processing.taxonomy import BITS
+from enrichment import clinical_trials, replay_server
+from enrichment.clinical_trials import StudyCache, enrich
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'clinical_trials')
+
+# Small batches and pages, so six IDs take two filter.ids batches and the first one two pages
+clinical_trials.BATCH_SIZE = 3
+clinical_trials.PAGE_SIZE = 2
+
+tmp = tempfile.mkdtemp()
+entity_db = os.path.join(tmp, 'entities.db')
+with EntityIndex(entity_db) as index:
+    index.add(pd.DataFrame({
+        'url': ['https://www.lilly.com/news/trials'],
+        'date': ['2024-06-21'],
+        'title': ['Lilly reports results from five phase 3 trials'],
+        'body': ['Results from NCT00000001, NCT00000002, NCT00000003, NCT00000004 and '
+                 'NCT00000005 were presented, as was the design of NCT00000009.'],
+        'category_mask': [BITS['clinical trial update']],
+    }), 'lilly')
+    index.add(pd.DataFrame({
+        'url': ['https://www.merck.com/news/keytruda-nsclc'],
+        'date': ['2019-11-20'],
+        'title': ['KEYTRUDA plus chemotherapy improves survival in NSCLC'],
+        'body': ['Overall survival results from the phase 3 study were presented.'],
+        'category_mask': [BITS['clinical trial update']],
+    }), 'merck')
+
+server = replay_server.serve(FIXTURES)
+base_url = f'http://127.0.0.1:{server.server_port}/api/v2'
+record_dir = os.path.join(tmp, 'record')
+
+with StudyCache(':memory:') as cache:
+    links, requests = asyncio.run(enrich(entity_db, cache, base_url, record_dir=record_dir))
+    print(links[['company', 'match', 'nct_id', 'brief_title']].to_string())
+
+    # Rows: the five recorded IDs the Lilly article cites (NCT00000009 is unknown and cached
+    # as such) and the one pembrolizumab NSCLC study by Merck that its drug search finds
+    assert sorted(zip(links['match'], links['nct_id'])) == [
+        ('nct', 'NCT00000001'), ('nct', 'NCT00000002'), ('nct', 'NCT00000003'),
+        ('nct', 'NCT00000004'), ('nct', 'NCT00000005'), ('search', 'NCT00000006')]
+    row = links.set_index('nct_id').loc['NCT00000006']
+    assert row['company'] == 'merck' and row['phases'] == 'PHASE3', row
+    assert row['interventions'] == 'Pembrolizumab|Pemetrexed' and row['enrollment'] == 616, row
+
+    # Requests: the search, then two ID batches, the first taking two pages
+    params = []
+    for path in sorted(glob.glob(os.path.join(record_dir, '*.json'))):
+        with open(path) as f:
+            params.append(json.load(f)['params'])
+    searches = [p for p in params if 'query.intr' in p]
+    batches = [(p['filter.ids'], p.get('pageToken')) for p in params if 'filter.ids' in p]
+    assert [(p['query.intr'], p['query.cond'], p['query.spons']) for p in searches] == [
+        ('pembrolizumab', 'non-small cell lung cancer', 'Merck Sharp & Dohme')], searches
+    assert sorted(batches, key=str) == sorted([
+        ('NCT00000001,NCT00000002,NCT00000003', None),
+        ('NCT00000001,NCT00000002,NCT00000003', '2'),
+        ('NCT00000004,NCT00000005,NCT00000009', None)], key=str), batches
+    assert requests == 4, requests
+
+    # A warm re-run is answered from the cache
+    warm, requests = asyncio.run(enrich(entity_db, cache, base_url))
+    assert requests == 0, requests
+    assert warm.sort_values('nct_id').reset_index(drop=True).equals(
+        links.sort_values('nct_id').reset_index(drop=True))
+
+server.shutdown()
+print('OK')
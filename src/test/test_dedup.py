@@ -0,0 +1,46 @@
+import os, sys
+
+# Make the src packages importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processing.dedup import DedupIndex, learn_templates
+from scrapers.harness import stored_articles
+
+body = ' '.join(f'word{i}' for i in range(200))
+title = 'Company announces results of phase 3 trial'
+urls = ['https://example.com/2019', 'https://example.com/2024-a', 'https://example.com/2024-b']
+
+# The 2019 copy comes first in every bucket and fails the date check against both others,
+# which still have to end up in one cluster
+index = DedupIndex()
+index.add(urls, [body] * 3, ['2019-01-01', '2024-05-01', '2024-05-02'], [title] * 3)
+clusters = index.cluster_column(urls).tolist()
+print(clusters)
+assert clusters == [urls[0], urls[1], urls[1]], clusters
+
+# Copies of one article dated apart by more than two weeks stay apart
+index = DedupIndex()
+index.add(urls[:2], [body] * 2, ['2024-05-01', '2024-06-01'], [title] * 2)
+assert index.cluster_column(urls[:2]).tolist() == urls[:2]
+
+# Titles naming different numbers are different releases, however alike the bodies
+index = DedupIndex()
+index.add(urls[1:], [body] * 2, ['2020-07-20', '2020-07-22'],
+          ['Pfizer and BioNTech Announce Agreement for 30 Million Doses',
+           'Pfizer and BioNTech Announce Agreement for up to 600 Million Doses'])
+assert index.cluster_column(urls[1:]).tolist() == urls[1:]
+
+# In the stored corpus the UK and US supply deals of July 2020 were both fetched as the
+# same site chrome, which is boilerplate once learned over the corpus
+articles = stored_articles()
+index = DedupIndex()
+index.set_templates(learn_templates(articles['url'], articles['body']))
+index.add(articles['url'], articles['body'], articles['date'], articles['title'])
+deals = articles[articles['title'].str.contains('United Kingdom for 30 Million Doses|'
+                                                'U.S. Government for up to 600 Million Doses')]
+assert len(deals) == 2 and deals['body'].nunique() == 1, deals
+clusters = index.cluster_column(deals['url'])
+print(clusters.tolist())
+assert clusters.nunique() == 2, clusters
+
+print('OK')
@@ -2,24 +2,177 @@
 
 """Common utility functions used across the project."""
 
+import contextvars
+import logging
 import os
-import pandas as pd
+import sys
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
-import logging
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# pandas and numpy are imported by the functions that need them, since every
+# command imports this module and most never touch a dataframe
+
+# Project paths
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DATA_DIR = os.path.join(PROJECT_ROOT, 'data')
+
+# Logging
+LOG_DIR = os.path.join(PROJECT_ROOT, 'logs')
+DEBUG_SAMPLE_EVERY = 10  # debug records kept per call site: the first, then one in this many
+# Third-party loggers that are too chatty below WARNING
+QUIET_LOGGERS = ('asyncio', 'urllib3', 'httpx', 'httpcore', 'matplotlib', 'PIL', 'filelock')
+
+_log_context = contextvars.ContextVar('log_context', default={})
+_log_listener = None
+_log_handler = None
+
+@contextmanager
+def log_context(**fields):
+    """Add fields (company, task, ...) to every record logged within the block.
+
+    The fields belong to the calling thread or asyncio task, so concurrent
+    tasks each log their own.
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+class ContextFilter(logging.Filter):
+    """Stamp records with the logging context and asyncio task they were logged from."""
+
+    def filter(self, record):
+        record.context = _log_context.get()
+        record.asyncio_task = None
+        asyncio = sys.modules.get('asyncio')  # never imported just to ask
+        if asyncio is not None:
+            try:
+                task = asyncio.current_task()
+            except RuntimeError:  # no event loop running in this thread
+                task = None
+            record.asyncio_task = task.get_name() if task else None
+        return True
+
+class DebugSampler(logging.Filter):
+    """Keep the first debug record of every call site, then one in `every`.
+
+    Kept records carry the sampling rate, so counts can be scaled back up.
+    """
+
+    def __init__(self, every=DEBUG_SAMPLE_EVERY):
+        super().__init__()
+        self.every = every
+        self.seen = Counter()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every <= 1:
+            return True
+        key = record.pathname, record.lineno
+        seen = self.seen[key]
+        self.seen[key] = seen + 1
+        if seen % self.every:
+            return False
+        record.sample_rate = self.every
+        return True
 
-# Set up logging
-def setup_logging(level=logging.INFO):
-    """Configure logging for the application."""
-    logging.basicConfig(
-        level=level,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler(f"logs/scraper_{datetime.now().strftime('%Y%m%d')}.log")
-        ]
-    )
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with its context fields at the top level."""
+
+    def format(self, record):
+        import json
+
+        entry = {
+            **getattr(record, 'context', {}),
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for field in ('asyncio_task', 'sample_rate'):
+            if getattr(record, field, None):
+                entry[field] = getattr(record, field)
+        return json.dumps(entry, default=str)
+
+class ConsoleFormatter(logging.Formatter):
+    """The bare message at INFO, as the prints it replaced showed it; the level otherwise."""
+
+    def format(self, record):
+        if record.levelno == logging.INFO:
+            return record.getMessage()
+        return f'{record.levelname}: {record.getMessage()}'
+
+def setup_logging(level=logging.INFO, debug_sample_every=DEBUG_SAMPLE_EVERY, log_dir=LOG_DIR):
+    """Route all logging through a queue to a background writer thread.
+
+    Logging calls only put the record on an in-memory queue, so the event
+    loop and worker threads never wait on the terminal or the disk. The
+    writer prints records at `level` and above to stderr, and appends every
+    record, debug included (sampled per call site), as a line of JSON to
+    logs/scraper_YYYYMMDD.log. Calling it again only changes the console
+    level; the queue is drained when the process exits.
+    """
+    global _log_listener, _log_handler
+    if _log_listener is not None:
+        _log_listener.handlers[0].setLevel(level)
+        return logging.getLogger(__name__)
+
+    import atexit
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+
+    console = logging.StreamHandler()
+    console.setLevel(level)
+    console.setFormatter(ConsoleFormatter())
+    ensure_directory(log_dir)
+    log_file = logging.FileHandler(
+        os.path.join(log_dir, f"scraper_{datetime.now().strftime('%Y%m%d')}.log"))
+    log_file.setLevel(logging.DEBUG)
+    log_file.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    _log_handler = QueueHandler(log_queue)
+    # Sample first, so dropped records skip the rest; the context is only known here
+    _log_handler.addFilter(DebugSampler(debug_sample_every))
+    _log_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.addHandler(_log_handler)
+    root.setLevel(logging.DEBUG)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _log_listener = QueueListener(log_queue, console, log_file, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(stop_logging)
     return logging.getLogger(__name__)
 
+def stop_logging():
+    """Write out the records still queued and stop the writer thread."""
+    global _log_listener, _log_handler
+    if _log_listener is None:
+        return
+    logging.getLogger().removeHandler(_log_handler)
+    _log_listener.stop()
+    _log_listener = _log_handler = None
+
+def flush_logging():
+    """Write out the records queued so far, so that output printed next comes after them."""
+    if _log_listener is None:
+        return
+    # stop() drains the queue; records logged meanwhile wait for the new writer thread
+    _log_listener.stop()
+    _log_listener.start()
+
+@lru_cache(maxsize=None)
+def load_env():
+    """Load the API keys in .env into the environment, once per process."""
+    from dotenv import load_dotenv
+    load_dotenv()
+
 # File operations
 def ensure_directory(directory):
     """Ensure the directory exists, create if not."""
@@ -28,6 +181,8 @@ def ensure_directory(directory):
         
 def save_to_csv(data, filename, directory="data/raw"):
     """Save data to CSV file with proper naming."""
+    import pandas as pd
+
     ensure_directory(directory)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     file_path = os.path.join(directory, f"{filename}_{timestamp}.csv")
@@ -36,33 +191,156 @@ def save_to_csv(data, filename, directory="data/raw"):
     df.to_csv(file_path, index=False)
     return file_path
 
+def append_to_csv(df, file_path):
+    """Append rows to a CSV file, matching the column order of an existing file."""
+    import pandas as pd
+
+    ensure_directory(os.path.dirname(file_path))
+    if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+        columns = pd.read_csv(file_path, nrows=0).columns
+        df.reindex(columns=columns).to_csv(file_path, mode='a', header=False, index=False)
+    else:
+        df.to_csv(file_path, index=False)
+    return file_path
+
+def company_from_path(file_path):
+    """Company a data file belongs to, e.g. 'lilly' for lilly_news_cleaned.csv."""
+    return os.path.basename(file_path).split('_')[0].lower()
+
+# URL handling
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid')
+
+def canonical_url(url):
+    """Key identifying an article across URL variants.
+
+    Lowercases the scheme and host, drops 'www.', the fragment, tracking
+    parameters and any trailing slash, and sorts the remaining query.
+    """
+    if not isinstance(url, str):
+        return url
+    parts = urlsplit(url.strip())
+    netloc = parts.netloc.lower()
+    if netloc.startswith('www.'):
+        netloc = netloc[4:]
+    path = parts.path.rstrip('/') or '/'
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PARAMS)))
+    return urlunsplit((parts.scheme.lower(), netloc, path, query, ''))
+
+def filter_new_articles(articles, known_urls=None):
+    """Drop articles whose canonical URL has already been scraped."""
+    if not known_urls:
+        return list(articles)
+    return [article for article in articles
+            if canonical_url(article.get('url')) not in known_urls]
+
+# Resource usage
+def peak_rss_mb():
+    """Peak resident set size in MB of this process or its largest finished child, or None.
+
+    Worker pools do their work in child processes, which RUSAGE_SELF does not see.
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
 # Date handling
+DATE_FORMATS = (
+    '%B %d, %Y',  # e.g. "November 30, 2022"
+    '%Y-%m-%dT%H:%M:%S',  # e.g. "2024-12-20T00:00:00"
+    '%Y-%m-%d',  # e.g. "2024-12-20"
+    '%m/%d/%Y',  # e.g. "12/20/2024"
+    '%d %B %Y'  # e.g. "20 December 2024"
+)
+
+@lru_cache(maxsize=65536)
+def _parse_date_str(date_str, formats=DATE_FORMATS):
+    """Parse one date string, trying the known formats before pandas' parser."""
+    import pandas as pd
+
+    for fmt in formats:
+        try:
+            return pd.Timestamp(datetime.strptime(date_str, fmt))
+        except ValueError:
+            continue
+    try:
+        timestamp = pd.to_datetime(date_str)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if pd.isna(timestamp):
+        return None
+    return timestamp.tz_convert(None) if timestamp.tzinfo else timestamp
+
 def parse_date(date_str, formats=None):
     """Parse date string using multiple possible formats."""
-    if formats is None:
-        formats = [
-            '%B %d, %Y',  # e.g. "November 30, 2022"
-            '%Y-%m-%dT%H:%M:%S',  # e.g. "2024-12-20T00:00:00"
-            '%Y-%m-%d',  # e.g. "2024-12-20"
-            '%m/%d/%Y',  # e.g. "12/20/2024"
-            '%d %B %Y'  # e.g. "20 December 2024"
-        ]
-    
+    import pandas as pd
+
     if pd.isna(date_str) or not date_str:
         return None
-    
-    # Try pandas datetime parsing first
-    try:
-        return pd.to_datetime(date_str)
-    except:
-        # Try each format
-        for fmt in formats:
-            try:
-                return datetime.strptime(date_str, fmt)
-            except:
-                continue
-    
-    return None
+    return _parse_date_str(str(date_str).strip(), tuple(formats or DATE_FORMATS))
+
+def parse_dates(values, formats=None, sample_size=200):
+    """Parse a column of date strings in bulk.
+
+    Every distinct string is parsed once. The format matching most of a sample
+    of them is applied to all in one vectorized call, the other formats only to
+    the strings it did not match, and parse_date only to what is still left.
+
+    Returns the parsed datetime Series and a Counter of how many rows each
+    format matched ('fallback' for parse_date, 'unparsed' for failures).
+    """
+    import numpy as np
+    import pandas as pd
+
+    formats = tuple(formats or DATE_FORMATS)
+    values = pd.Series(values)
+    stats = Counter()
+    if pd.api.types.is_datetime64_any_dtype(values):
+        stats['datetime'] = int(values.notna().sum())
+        return values, stats
+
+    codes, uniques = pd.factorize(values.astype(object).map(
+        lambda value: value.strip() if isinstance(value, str) else value))
+    if len(uniques) == 0:
+        return pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]'), stats
+
+    uniques = pd.Series(uniques, dtype=object).astype(str)
+    row_counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    parsed = pd.Series(pd.NaT, index=uniques.index, dtype='datetime64[ns]')
+    remaining = np.ones(len(uniques), dtype=bool)
+
+    # Try the formats in order of how well they match a sample
+    sample = uniques.iloc[:sample_size]
+    hits = {fmt: pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+            for fmt in formats}
+    for fmt in sorted(formats, key=lambda fmt: -hits[fmt]):
+        if not remaining.any():
+            break
+        candidates = uniques[remaining]
+        matched = pd.to_datetime(candidates, format=fmt, errors='coerce')
+        ok = matched.notna().to_numpy()
+        if ok.any():
+            index = candidates.index[ok]
+            parsed[index] = matched[ok]
+            remaining[index] = False
+            stats[fmt] = int(row_counts[index].sum())
+
+    for i in np.flatnonzero(remaining):
+        timestamp = _parse_date_str(uniques.iloc[i], formats)
+        key = 'unparsed' if timestamp is None else 'fallback'
+        if timestamp is not None:
+            parsed.iloc[i] = timestamp
+        stats[key] += int(row_counts[i])
+
+    result = parsed.to_numpy()[codes]
+    result[codes < 0] = np.datetime64('NaT')
+    return pd.Series(result, index=values.index), stats
 
 # List all raw data files
 def list_data_files(directory="data/raw", pattern="*.csv"):
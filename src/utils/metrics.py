@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+"""
+Run metrics: timed spans, counters and histograms.
+
+    with metrics.span('fetch', engine='jina'):
+        body = fetch(url)
+    metrics.count('bytes_downloaded', len(body), service='jina')
+    metrics.annotate(rows=len(df))  # attribute of the innermost open span
+
+Spans nest within a thread or asyncio task (the open span is kept in a
+context variable), so the run log reads as a trace: every finished span is
+one JSON line with its id, parent, start time, duration and attributes. Span
+durations also feed the `span_seconds` histogram, labelled by span name, and
+a span annotated with `rows` adds them to the `rows` counter.
+
+main.py starts a run for every command and, when it ends, appends the spans,
+counters and histograms to data/runs/<run id>.jsonl, writes them in the
+Prometheus text format to data/runs/metrics.prom and prints a summary table.
+The daemon flushes after every cycle and can serve /metrics over HTTP.
+
+Only the standard library is used, so importing this module costs every
+command next to nothing.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Not taken from utils.common, which imports logging and more that main.py does not need
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+RUNS_DIR = os.path.join(PROJECT_ROOT, 'data', 'runs')
+PROMETHEUS_PATH = os.path.join(RUNS_DIR, 'metrics.prom')
+PREFIX = 'pharma_'  # of every exported metric name
+# Upper bounds, in seconds, of the span_seconds buckets and any other histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# (span id, attributes) of the innermost open span of this thread or task
+_current = contextvars.ContextVar('metrics_span', default=None)
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+class Registry:
+    """Counters, histograms and the finished spans of one run."""
+
+    def __init__(self, command=None):
+        self.run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.urandom(3).hex()}"
+        self.command = command
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [count per bucket..., count, sum]
+        self.spans = {}  # name -> [count, seconds, max seconds, rows]
+        self.pending = []  # finished spans not yet written to the run log
+        self.flushed = False
+
+    @property
+    def log_path(self):
+        return os.path.join(RUNS_DIR, f'{self.run_id}.jsonl')
+
+    def count(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[name, _labels_key(labels)] += value
+
+    def observe(self, name, value, **labels):
+        key = name, _labels_key(labels)
+        with self.lock:
+            histogram = self.histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += 1
+            histogram[-1] += value
+
+    @contextmanager
+    def span(self, name, **attrs):
+        parent = _current.get()
+        span_id = os.urandom(8).hex()
+        token = _current.set((span_id, attrs))
+        started_at = time.time()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            seconds = time.perf_counter() - started
+            self._finish(name, span_id, parent[0] if parent else None, started_at, seconds,
+                         attrs, error)
+
+    def _finish(self, name, span_id, parent_id, started_at, seconds, attrs, error):
+        rows = attrs.get('rows')
+        self.observe('span_seconds', seconds, span=name)
+        if rows:
+            self.count('rows', rows, span=name)
+        if error:
+            self.count('span_errors', span=name, error=error)
+        record = {'type': 'span', 'name': name, 'id': span_id, 'parent': parent_id,
+                  'start': round(started_at, 6), 'seconds': round(seconds, 6), **attrs}
+        if error:
+            record['error'] = error
+        with self.lock:
+            totals = self.spans.setdefault(name, [0, 0.0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            totals[3] += rows or 0
+            self.pending.append(record)
+
+    def snapshot(self):
+        """Copies of the counters and histograms, taken under the lock."""
+        with self.lock:
+            return dict(self.counters), {key: list(value)
+                                         for key, value in self.histograms.items()}
+
+    def flush(self, final=False):
+        """Append the spans finished since the last flush to the run log, then the
+        counters and histograms at this point, and rewrite the Prometheus file.
+
+        Does nothing for a run that recorded nothing.
+        """
+        with self.lock:
+            records, self.pending = self.pending, []
+            if not records and not self.counters and not self.histograms:
+                return None
+        counters, histograms = self.snapshot()
+        os.makedirs(RUNS_DIR, exist_ok=True)
+        with open(self.log_path, 'a') as f:
+            if not self.flushed:
+                f.write(json.dumps({'type': 'run', 'run_id': self.run_id,
+                                    'command': self.command, 'start': self.started_at}) + '\n')
+            for record in records:
+                f.write(json.dumps(record, default=str) + '\n')
+            seconds = round(time.perf_counter() - self.started, 3)
+            for (name, labels), value in sorted(counters.items()):
+                f.write(json.dumps({'type': 'counter', 'name': name, 'labels': dict(labels),
+                                    'value': value, 'run_seconds': seconds}) + '\n')
+            for (name, labels), histogram in sorted(histograms.items()):
+                f.write(json.dumps({'type': 'histogram', 'name': name, 'labels': dict(labels),
+                                    'buckets': dict(zip(map(str, BUCKETS), histogram)),
+                                    'count': histogram[-2], 'sum': round(histogram[-1], 6),
+                                    'run_seconds': seconds}) + '\n')
+            if final:
+                f.write(json.dumps({'type': 'end', 'run_id': self.run_id,
+                                    'seconds': seconds}) + '\n')
+        self.flushed = True
+
+        tmp_path = f'{PROMETHEUS_PATH}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, PROMETHEUS_PATH)
+        return self.log_path
+
+    def prometheus(self):
+        """Counters and histograms in the Prometheus text exposition format."""
+        def labels_text(labels, extra=()):
+            pairs = [*labels, *extra]
+            if not pairs:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"')
+                       for _, value in pairs)
+            return '{' + ','.join(f'{key}="{value}"'
+                                  for (key, _), value in zip(pairs, escaped)) + '}'
+
+        counters, histograms = self.snapshot()
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(counters.items()):
+            metric = f'{PREFIX}{name}_total'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} counter')
+                typed.add(metric)
+            lines.append(f'{metric}{labels_text(labels)} {value:g}')
+        for (name, labels), histogram in sorted(histograms.items()):
+            metric = f'{PREFIX}{name}'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} histogram')
+                typed.add(metric)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram):
+                cumulative += count
+                lines.append(f'{metric}_bucket{labels_text(labels, [("le", bound)])} '
+                             f'{cumulative}')
+            lines.append(f'{metric}_bucket{labels_text(labels, [("le", "+Inf")])} '
+                         f'{histogram[-2]}')
+            lines.append(f'{metric}_sum{labels_text(labels)} {histogram[-1]:g}')
+            lines.append(f'{metric}_count{labels_text(labels)} {histogram[-2]}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Table of the spans by total time, then the counters."""
+        wall = time.perf_counter() - self.started
+        counters, _ = self.snapshot()
+        with self.lock:
+            spans = sorted(self.spans.items(), key=lambda item: -item[1][1])
+        lines = [f"{'Span':<20} {'Count':>6} {'Total s':>9} {'Mean s':>8} {'Max s':>8} "
+                 f"{'Share':>6} {'Rows/s':>9}"]
+        for name, (n, seconds, longest, rows) in spans:
+            rate = f'{rows / seconds:9,.0f}' if rows and seconds else f"{'':>9}"
+            lines.append(f"{name:<20} {n:>6} {seconds:>9.2f} {seconds / n:>8.3f} "
+                         f"{longest:>8.3f} {seconds / wall:>6.0%} {rate}")
+        shown = [(name, labels, value) for (name, labels), value in sorted(counters.items())
+                 if name != 'rows']
+        if shown:
+            lines.append('')
+            lines.append(f"{'Counter':<48} {'Value':>14}")
+            for name, labels, value in shown:
+                label = name + (f"{{{','.join(f'{k}={v}' for k, v in labels)}}}"
+                                if labels else '')
+                number = f'{value:,.0f}' if value == int(value) else f'{value:,.2f}'
+                lines.append(f"{label:<48} {number:>14}")
+        lines.append('')
+        lines.append(f"Run {self.run_id}: {wall:.2f}s wall time")
+        return '\n'.join(lines)
+
+_registry = Registry()
+
+def registry():
+    """The registry of the current run."""
+    return _registry
+
+def start_run(command=None):
+    """Start recording a new run, discarding anything recorded before."""
+    global _registry
+    _registry = Registry(command)
+    return _registry
+
+def finish_run():
+    """Write the run log and Prometheus file of the current run.
+
+    Returns the summary table, or None if the run recorded nothing.
+    """
+    if _registry.flush(final=True) is None:
+        return None
+    return f"{_registry.summary()}\nRun log: {_registry.log_path}"
+
+def flush():
+    """Write what the current run recorded so far, for long-running commands."""
+    return _registry.flush()
+
+def span(name, **attrs):
+    """Context manager timing a block as a span; yields its attribute dict."""
+    return _registry.span(name, **attrs)
+
+def annotate(**attrs):
+    """Add attributes to the innermost open span, e.g. the rows it processed."""
+    current = _current.get()
+    if current is not None:
+        current[1].update(attrs)
+
+def count(name, value=1, **labels):
+    """Add to a counter."""
+    _registry.count(name, value, **labels)
+
+def observe(name, value, **labels):
+    """Record a value, in seconds unless the name says otherwise, in a histogram."""
+    _registry.observe(name, value, **labels)
+
+def sleep(seconds, reason='rate_limit'):
+    """time.sleep, counted in the sleep_seconds counter."""
+    _registry.count('sleep_seconds', seconds, reason=reason)
+    time.sleep(seconds)
+
+async def wait(seconds, reason='page_load'):
+    """asyncio.sleep, counted in the sleep_seconds counter."""
+    import asyncio
+
+    _registry.count('sleep_seconds', seconds, reason=reason)
+    await asyncio.sleep(seconds)
+
+def serve_prometheus(port, host='127.0.0.1'):
+    """Serve the current run's metrics at /metrics from a background thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = _registry.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server